@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""Compare queue payload encodings: body size and encode/decode time.
+
+Encodes ChatRequest payloads with message contents of several sizes as JSON,
+MessagePack and MessagePack compressed with zstd, decodes them again, and
+reports bytes on the wire and microseconds per encode and decode. Nothing is
+published; only the codec is measured.
+
+Usage (from the repository root):
+    PYTHONPATH=src python scripts/bench_payloads.py --iterations 20000
+"""
+
+import argparse
+import time
+
+from common.messaging.payloads import JSON, MSGPACK, ChatRequest, PayloadCodec
+
+CODECS = {
+    "json": PayloadCodec(JSON, compress_threshold=None),
+    "msgpack": PayloadCodec(MSGPACK, compress_threshold=None),
+    "msgpack+zstd": PayloadCodec(MSGPACK, compress_threshold=0),
+}
+SAMPLE = "Today I went for a run and skipped dessert, but I slept badly. "
+
+
+def payload(size: int) -> ChatRequest:
+    return ChatRequest(
+        chat_id="0192a8b4-4c5e-7d3f-9a1b-2c3d4e5f6a7b",
+        user_id="0192a8b4-4c5e-7d3f-9a1b-2c3d4e5f6a7c",
+        message_id="0192a8b4-4c5e-7d3f-9a1b-2c3d4e5f6a7d",
+        content=(SAMPLE * (size // len(SAMPLE) + 1))[:size],
+    )
+
+
+def bench(codec: PayloadCodec, request: ChatRequest, iterations: int) -> dict:
+    body, content_type, encoding = codec.encode(request)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        codec.encode(request)
+    encoded = time.perf_counter()
+    for _ in range(iterations):
+        ChatRequest.from_dict(codec.decode_data(body, content_type, encoding))
+    decoded = time.perf_counter()
+    return {
+        "bytes": len(body),
+        "encode us": (encoded - started) / iterations * 1e6,
+        "decode us": (decoded - encoded) / iterations * 1e6,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=10_000)
+    parser.add_argument(
+        "--sizes",
+        default="50,500,5000",
+        help="Comma-separated message content sizes in characters",
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'content':>8}  {'encoding':<14}{'bytes':>8}"
+        f"{'encode us':>12}{'decode us':>12}"
+    )
+    for size in (int(s) for s in args.sizes.split(",")):
+        request = payload(size)
+        for name, codec in CODECS.items():
+            result = bench(codec, request, args.iterations)
+            print(
+                f"{size:>8}  {name:<14}{result['bytes']:>8}"
+                f"{result['encode us']:>12.2f}{result['decode us']:>12.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Measure worker consumer throughput over a message transport.
+
+Publishes messages from a number of users to the interactive lane, runs the
+worker's Consumer with a handler that only sleeps for the simulated LLM call,
+and reports messages/second and queue-to-done latency. By default messages go
+through the in-process broker, so no RabbitMQ container is needed; with
+``--transport rabbitmq`` they go through the broker configured by the
+``RABBITMQ_*`` variables (use a scratch ``--queue``).
+
+Usage (from the repository root):
+    PYTHONPATH=src python scripts/bench_pipeline.py --messages 20000 --work-ms 5
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+# The consumer imports the DB engine module, which insists on a URL; the
+# benchmark never connects
+os.environ.setdefault("DATABASE_URL", "postgresql+asyncpg://bench@localhost/bench")
+
+from common.messaging.transport import OutgoingMessage, transport_from_env  # noqa: E402
+from worker.core.consumer import Consumer  # noqa: E402
+from worker.core.scheduling import lanes_from_env  # noqa: E402
+
+
+async def bench(args: argparse.Namespace) -> dict:
+    os.environ["TRANSPORT"] = args.transport
+    transport = transport_from_env()
+    lanes = lanes_from_env(args.queue, args.concurrency, ())
+    latencies: list[float] = []
+    done = asyncio.Event()
+
+    async def handle(message: dict) -> None:
+        await asyncio.sleep(args.work_ms / 1000)
+        latencies.append(time.perf_counter() - message["sent"])
+        if len(latencies) == args.messages:
+            done.set()
+
+    consumer = Consumer(
+        handle,
+        transport=transport,
+        lanes=lanes,
+        prefetch=args.prefetch,
+        concurrency=args.concurrency,
+        user_max_in_flight=args.user_max_in_flight,
+    )
+    await transport.connect()
+    await transport.declare_queue(args.queue)
+    started = time.perf_counter()
+    for i in range(args.messages):
+        body = {"user_id": f"user-{i % args.users}", "sent": time.perf_counter()}
+        await transport.publish(args.queue, OutgoingMessage(json.dumps(body).encode()))
+    published = time.perf_counter()
+
+    running = asyncio.create_task(consumer.run())
+    await done.wait()
+    elapsed = time.perf_counter() - started
+    consumer.stop()
+    await running
+
+    latencies.sort()
+    return {
+        "publish/s": args.messages / (published - started),
+        "messages/s": args.messages / elapsed,
+        "p50 ms": statistics.median(latencies) * 1000,
+        "p99 ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--transport", choices=("memory", "rabbitmq"), default="memory")
+    parser.add_argument("--queue", default="bench_queue")
+    parser.add_argument("--messages", type=int, default=10_000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--work-ms", type=float, default=0.0)
+    parser.add_argument("--prefetch", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--user-max-in-flight", type=int, default=2)
+    args = parser.parse_args()
+
+    result = await bench(args)
+
+    print(
+        f"{args.messages} messages from {args.users} users over {args.transport}, "
+        f"concurrency {args.concurrency}, {args.work_ms:g} ms per message"
+    )
+    for name, value in result.items():
+        print(f"{name:<12}{value:>12.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
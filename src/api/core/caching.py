@@ -0,0 +1,57 @@
+"""Conditional GET validators for chat history.
+
+The messages a history request returns depend only on the chat's message
+count and latest message time, which a trigger keeps on the ``chats`` row,
+and on the request's ``after`` and ``limit``. The ETag is derived from those,
+so a request carrying a matching ``If-None-Match`` is answered 304 after the
+chat's primary key lookup, without loading or serializing any message.
+
+The count is part of the tag because a message committed late with an older
+timestamp does not move ``last_message_at``. For the same reason
+``Last-Modified`` is sent for caches' freshness heuristics but never used to
+answer 304.
+"""
+
+import hashlib
+from datetime import timezone
+from email.utils import format_datetime
+from typing import Optional
+from uuid import UUID
+
+from common.db.models import Chat
+
+
+def history_etag(chat: Chat, after: Optional[UUID], limit: Optional[int]) -> str:
+    """A weak ETag for the history of ``chat`` as requested."""
+    state = f"{chat.chat_id}:{chat.message_count}:{chat.last_message_at.isoformat()}"
+    digest = hashlib.blake2b(
+        f"{state}:{after}:{limit}".encode(), digest_size=12
+    ).hexdigest()
+    # Weak: the same history is sent as JSON or MessagePack, compressed or not
+    return f'W/"{digest}"'
+
+
+def history_headers(chat: Chat, etag: str) -> dict[str, str]:
+    return {
+        "ETag": etag,
+        "Last-Modified": format_datetime(
+            chat.last_message_at.astimezone(timezone.utc), usegmt=True
+        ),
+        # Caches may store the history but must revalidate it on every use
+        "Cache-Control": "no-cache",
+        # JSON or MessagePack, by the request's Accept header
+        "Vary": "Accept",
+    }
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether ``If-None-Match`` lists ``etag``, by weak comparison."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(
+        candidate.strip().removeprefix("W/") == opaque
+        for candidate in if_none_match.split(",")
+    )
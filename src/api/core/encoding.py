@@ -0,0 +1,163 @@
+"""Response encodings: compression and MessagePack bodies.
+
+``CompressionMiddleware`` compresses responses of at least ``minimum_size``
+bytes with zstd, brotli or gzip, whichever the client's ``Accept-Encoding``
+ranks highest (ties go to that order: zstd is the fastest for a similar
+ratio). Bodies of ``thread_min_size`` bytes or more are compressed in a
+worker thread so a long chat history never stalls the event loop; the
+compressors release the GIL. Streaming responses, responses that already
+have a ``Content-Encoding`` and content that does not compress (images,
+archives) are passed through.
+
+Clients that list ``application/msgpack`` before JSON in ``Accept`` get
+history responses as MessagePack, which is smaller and cheaper to parse.
+"""
+
+import asyncio
+import gzip
+from typing import Callable, Optional
+
+import brotli
+import msgpack
+import zstandard
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from common.messaging.payloads import JSON, MSGPACK
+
+# Server preference among encodings the client ranks equally
+ENCODINGS = ("zstd", "br", "gzip")
+COMPRESSIBLE_TYPES = (
+    "text/",
+    JSON,
+    MSGPACK,
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+)
+
+
+def parse_qualities(header: Optional[str]) -> dict[str, float]:
+    """Map each value of an Accept-style header to its q-value."""
+    qualities = {}
+    for item in (header or "").split(","):
+        value, *params = (part.strip() for part in item.split(";"))
+        if not value:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, number = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        qualities[value.lower()] = quality
+    return qualities
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """The content coding to use for a response, None for identity."""
+    qualities = parse_qualities(accept_encoding)
+    wildcard = qualities.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        quality = qualities.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def prefers_msgpack(accept: Optional[str]) -> bool:
+    """Whether ``Accept`` ranks MessagePack above JSON."""
+    qualities = parse_qualities(accept)
+    msgpack_quality = max(
+        qualities.get(MSGPACK, 0.0), qualities.get("application/x-msgpack", 0.0)
+    )
+    json_quality = qualities.get(
+        JSON, qualities.get("application/*", qualities.get("*/*", 0.0))
+    )
+    return msgpack_quality > 0 and msgpack_quality >= json_quality
+
+
+def msgpack_response(content, **kwargs) -> Response:
+    return Response(msgpack.packb(content), media_type=MSGPACK, **kwargs)
+
+
+def _compressor(
+    encoding: str, gzip_level: int, brotli_quality: int, zstd_level: int
+) -> Callable[[bytes], bytes]:
+    if encoding == "gzip":
+        return lambda body: gzip.compress(body, compresslevel=gzip_level, mtime=0)
+    if encoding == "br":
+        return lambda body: brotli.compress(body, quality=brotli_quality)
+    # Compressor objects are not thread-safe; one per response is cheap
+    return lambda body: zstandard.ZstdCompressor(level=zstd_level).compress(body)
+
+
+class CompressionMiddleware:
+    """Compresses complete response bodies above a size threshold."""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        *,
+        minimum_size: int = 1024,
+        thread_min_size: int = 64 * 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+        zstd_level: int = 3,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.thread_min_size = thread_min_size
+        self.levels = (gzip_level, brotli_quality, zstd_level)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start
+            if message["type"] == "http.response.start":
+                # Held back until the body shows whether to compress
+                start = message
+                return
+            if start is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+            response_start, start = start, None
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=response_start["headers"])
+            if not self._compressible(headers, body, message):
+                await send(response_start)
+                await send(message)
+                return
+            compress = _compressor(encoding, *self.levels)
+            if len(body) >= self.thread_min_size:
+                body = await asyncio.to_thread(compress, body)
+            else:
+                body = compress(body)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send(response_start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
+
+    def _compressible(self, headers: MutableHeaders, body: bytes, message) -> bool:
+        if message.get("more_body", False) or len(body) < self.minimum_size:
+            return False
+        if "content-encoding" in headers:
+            return False
+        content_type = headers.get("content-type", "").lower()
+        return content_type.startswith(COMPRESSIBLE_TYPES)
@@ -1,26 +1,41 @@
+import asyncio
 import logging
 import os
 import uuid
+from typing import AsyncGenerator, Optional
 
 from dotenv import load_dotenv
-from fastapi import Depends, FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
 from openai import OpenAI
 
 # from stream_chat import StreamChat
+from prometheus_client import Histogram
 from prometheus_fastapi_instrumentator import Instrumentator
 from pydantic import BaseModel, Field
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from common.db.archive import archive_from_env, get_chat_history, has_new_messages
 from common.db.connect import get_db as get_db
-from common.db.connect import wait_for_db
+from common.db.connect import get_read_session, note_write, replica_router, wait_for_db
 from common.db.crud import chat as chat_crud
 from common.db.crud import log as log_crud
 from common.db.crud import message as message_crud
-from common.db.schemas import ChatCreate, LogCreate, MessageCreate
-
+from common.db.notify import chat_events_from_env
+from common.db.schemas import ChatCreate, ChatSummary, LogCreate, MessageCreate
+from common.loop_monitor import loop_monitor_from_env
+from common.messaging.outbox import enqueue, outbox_relay_from_env
+from common.messaging.payloads import ChatRequest
+
+from .caching import etag_matches, history_etag, history_headers
+from .encoding import CompressionMiddleware, msgpack_response, prefers_msgpack
 from .logging_config import configure_logging
+from .pagination import decode_chat_cursor, decode_search_cursor, encode_cursor
+from .profiling import ProfilerMiddleware
+from .query_metrics import QueryMetricsMiddleware
+from .rpc import rpc_from_env
 from .services import ChatService
 
 logger = configure_logging()
@@ -57,6 +72,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# gzip/brotli/zstd for responses above the threshold, large ones off the loop
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.getenv("COMPRESSION_MIN_SIZE", "1024")),
+    thread_min_size=int(os.getenv("COMPRESSION_THREAD_MIN_SIZE", "65536")),
+)
+
+# Query count, DB time and slow/repeated statements per request
+app.add_middleware(
+    QueryMetricsMiddleware,
+    repeat_threshold=int(os.getenv("QUERY_REPEAT_THRESHOLD", "5")),
+)
+
+# Off unless PROFILER_TOKEN or PROFILER_SAMPLE_RATE is set; outermost so
+# compression and the other middleware show up in profiles too
+app.add_middleware(
+    ProfilerMiddleware,
+    output_dir=os.getenv("PROFILER_DIR", "/var/lib/coach-bot/profiles"),
+    token=os.getenv("PROFILER_TOKEN"),
+    sample_rate=float(os.getenv("PROFILER_SAMPLE_RATE", "0")),
+    interval=float(os.getenv("PROFILER_INTERVAL", "0.001")),
+)
+
 
 # Dummy chat client to satisfy ChatService dependency while StreamChat is removed.
 class DummyChatClient:
@@ -80,10 +118,36 @@ class DummyChatClient:
 # chat_service = ChatService(client)
 chat_service = ChatService(client, DummyChatClient())
 
+# Cold storage for archived chats, read back transparently by history endpoints
+chat_archive = archive_from_env()
+
+# Chat messages are answered by the worker pool when RabbitMQ is configured
+chat_rpc = rpc_from_env()
+CHAT_RPC_TIMEOUT = float(os.getenv("CHAT_RPC_TIMEOUT", "25"))
+# Publishes the requests committed to the outbox; started with chat_rpc
+outbox_relay = None
+# Wakes history requests waiting for new messages (LISTEN/NOTIFY)
+chat_events = chat_events_from_env()
+# Longest a history request may wait for new messages
+CHAT_LONG_POLL_MAX = 60.0
+# Seconds of messages before `after` that history requests return again, to
+# catch replies committed after a newer message was read
+CHAT_CURSOR_OVERLAP = float(os.getenv("CHAT_CURSOR_OVERLAP", "5"))
+
+LOOP_LAG = Histogram(
+    "api_event_loop_lag_seconds",
+    "How late the event loop runs a callback that is due",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+# Lag histogram, plus the stack of whatever blocks the loop for too long
+loop_monitor = loop_monitor_from_env(on_lag=LOOP_LAG.observe)
+
 
 @app.on_event("startup")
 async def startup_event():
+    global outbox_relay
     logger.info("=== API Service Startup ===")
+    await loop_monitor.start()
     logger.info("Checking environment variables...")
 
     required_vars = ["DATABASE_URL", "OPENAI_API_KEY", "STREAM_API_KEY"]
@@ -102,9 +166,38 @@ async def startup_event():
         logger.error(f"✗ Database connection failed: {e}")
         raise
 
+    await chat_events.start()
+    if chat_events.listening:
+        logger.info("✓ Listening for new chat messages")
+    else:
+        # History requests that wait poll until the listener reconnects
+        logger.error("✗ Cannot LISTEN for new chat messages, long polls will poll")
+
+    if chat_rpc is not None:
+        try:
+            await chat_rpc.start()
+            logger.info("✓ Worker RPC connected")
+            outbox_relay = outbox_relay_from_env(chat_rpc.transport)
+            await outbox_relay.start()
+        except Exception as e:
+            # Messages are answered in-process until the API restarts
+            logger.error(f"✗ Worker RPC unavailable, answering inline: {e}")
+
     logger.info("=== Startup Complete ===")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await loop_monitor.stop()
+    await replica_router.stop()
+    await chat_events.stop()
+    if outbox_relay is not None:
+        await outbox_relay.stop()
+    if chat_rpc is not None:
+        # Also stops a consumer that is still restarting
+        await chat_rpc.close()
+
+
 @app.get("/")
 async def root():
     return {
@@ -114,8 +207,17 @@ async def root():
     }
 
 
+async def get_replica_db(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    """Read-only session on a replica, or on the primary right after a write.
+
+    The path parameters (chat_id, user_id) are the read-your-writes keys.
+    """
+    async with get_read_session(request.path_params.values()) as session:
+        yield session
+
+
 @app.get("/health")
-async def health_check(db: AsyncSession = Depends(get_db)):
+async def health_check(db: AsyncSession = Depends(get_replica_db)):
     # Quick db check using dependency injection
     await db.execute(text("SELECT 1"))
     return {"status": "healthy"}
@@ -172,6 +274,10 @@ async def send_message(message: MessageRequest, db: AsyncSession = Depends(get_d
             logger.error(f"Invalid UUID format for chat_id or user_id: {str(ve)}")
             raise HTTPException(status_code=400, detail="Invalid UUID format") from ve
 
+        # With the worker pool available, the request to it is committed to
+        # the outbox together with the message and published by the relay
+        dispatch = chat_rpc is not None and chat_rpc.started
+        pending = None
         try:
             # Persist in PostgreSQL (Saving full message details)
             db_message = await message_crud.create(
@@ -179,9 +285,25 @@ async def send_message(message: MessageRequest, db: AsyncSession = Depends(get_d
                 obj_in=MessageCreate(
                     chat_id=chat_id, user_id=user_id, content=message.content
                 ),
+                commit=not dispatch,
             )
+            if dispatch:
+                pending = chat_rpc.prepare(
+                    ChatRequest(
+                        chat_id=str(chat_id),
+                        user_id=str(user_id),
+                        message_id=str(db_message.message_id),
+                        content=message.content,
+                    ),
+                    message_id=str(db_message.message_id),
+                )
+                enqueue(db, chat_rpc.queue_name, pending.message)
+                await db.commit()
             logger.info(f"Message saved to database with ID: {db_message.message_id}")
+            note_write(user_id, chat_id)
         except Exception as db_error:
+            if pending is not None:
+                chat_rpc.discard(pending)
             logger.error(f"Database error: {str(db_error)}")
             raise HTTPException(status_code=500, detail="Database error") from db_error
 
@@ -200,15 +322,37 @@ async def send_message(message: MessageRequest, db: AsyncSession = Depends(get_d
             logger.error(f"Log creation error: {str(log_error)}")
             # Don't fail if logging fails
 
-        # Dispatch to Downstream Systems (e.g., forward to message queue)
-        logger.info(
-            f"Forwarding message to message queue - user_id: {user_id}, "
-            f"chat_id: {chat_id}, content: {message.content[:50]}..."
-        )
+        if pending is not None:
+            # Wait for the worker pool's committed reply
+            logger.info(
+                f"Waiting for the worker's reply - user_id: {user_id}, "
+                f"chat_id: {chat_id}, message_id: {db_message.message_id}"
+            )
+            reply = await chat_rpc.wait(pending, timeout=CHAT_RPC_TIMEOUT)
+            if reply is None:
+                # The worker is still on it; the reply lands in the history
+                return JSONResponse(
+                    status_code=202,
+                    content={
+                        "status": "pending",
+                        "message_id": str(db_message.message_id),
+                        "chat_id": str(chat_id),
+                        "user_id": str(user_id),
+                    },
+                )
+            note_write(user_id, chat_id)
+            return {
+                "status": "success",
+                "message_id": str(db_message.message_id),
+                "chat_id": str(chat_id),
+                "user_id": str(user_id),
+                "content": reply.content,
+            }
 
         try:
-            # Generate AI response
-            response = client.chat.completions.create(
+            # Generate AI response; the client is sync, keep it off the loop
+            response = await asyncio.to_thread(
+                client.chat.completions.create,
                 model="gpt-4o-mini",
                 messages=[{"role": "user", "content": message.content}],
             )
@@ -262,6 +406,7 @@ async def create_chat(chat_data: ChatCreate, db: AsyncSession = Depends(get_db))
     """
     try:
         new_chat = await chat_crud.create(db, obj_in=chat_data)
+        note_write(chat_data.user_id, new_chat.chat_id)
         logger.info(
             "Created new chat with chat_id: %s for user %s",
             new_chat.chat_id,
@@ -274,25 +419,179 @@ async def create_chat(chat_data: ChatCreate, db: AsyncSession = Depends(get_db))
 
 
 @app.get("/api/v1/chats/{chat_id}")
-async def get_chat(chat_id: str, db: AsyncSession = Depends(get_db)):
-    # Retrieve the chat instance. Ensure your chat_crud.get includes an eager load of messages.
+async def get_chat(
+    chat_id: str,
+    request: Request,
+    after: Optional[uuid.UUID] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    wait: float = Query(0, ge=0, le=CHAT_LONG_POLL_MAX),
+    db: AsyncSession = Depends(get_replica_db),
+):
+    """
+    Return the chat history, oldest first.
+
+    Pass the message_id of the last message already seen as `after` to fetch
+    only newer messages. Messages created up to CHAT_CURSOR_OVERLAP seconds
+    before `after` are sent again, as one of them may have committed only
+    after `after` was read; skip the ids you already have. With `wait`, a
+    request that finds no messages newer than `after` is held for up to that
+    many seconds and answered as soon as one is committed (long polling),
+    instead of the client polling repeatedly.
+
+    Responses carry an ETag; a request whose `If-None-Match` still matches
+    is answered 304 from the chat row alone (after `wait`, if given).
+    Clients preferring `application/msgpack` in `Accept` get MessagePack.
+    """
     chat = await chat_crud.get(db, id=uuid.UUID(chat_id))
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
 
+    if_none_match = request.headers.get("if-none-match")
+    etag = history_etag(chat, after, limit)
+    with chat_events.subscribe(chat.chat_id) as new_message:
+        # None while the client's copy is current
+        history = None
+        if not etag_matches(if_none_match, etag):
+            # Archived chats are rehydrated from cold storage (LRU-cached)
+            history = await get_chat_history(
+                db,
+                chat,
+                chat_archive,
+                after=after,
+                limit=limit,
+                overlap=CHAT_CURSOR_OVERLAP,
+            )
+        # Messages re-sent by the cursor overlap don't end the wait
+        if not has_new_messages(history, after) and wait:
+            # Don't hold a pooled connection while waiting
+            await db.close()
+            deadline = asyncio.get_running_loop().time() + wait
+            while not has_new_messages(history, after):
+                remaining = deadline - asyncio.get_running_loop().time()
+                if remaining <= 0 or not await chat_events.wait(new_message, remaining):
+                    break
+                # The message was committed on the primary; replicas may lag
+                note_write(chat.chat_id)
+                async with get_read_session([chat.chat_id]) as fresh:
+                    chat = await chat_crud.get(fresh, id=chat.chat_id)
+                    if not chat:
+                        raise HTTPException(status_code=404, detail="Chat not found")
+                    etag = history_etag(chat, after, limit)
+                    if etag_matches(if_none_match, etag):
+                        continue
+                    history = await get_chat_history(
+                        fresh,
+                        chat,
+                        chat_archive,
+                        after=after,
+                        limit=limit,
+                        overlap=CHAT_CURSOR_OVERLAP,
+                    )
+
+    headers = history_headers(chat, etag)
+    if history is None:
+        return Response(status_code=304, headers=headers)
+
     # Transform the messages to match the frontend expected format.
     messages = []
-    for msg in chat.messages:
+    for msg in history:
         # Determine role based on the user_message boolean
         role = "user" if msg.user_message else "assistant"
         messages.append(
             {
+                "message_id": str(msg.message_id),
                 "role": role,
                 "content": msg.content,
                 "timestamp": msg.timestamp.isoformat() if msg.timestamp else None,
             }
         )
-    return messages
+    if prefers_msgpack(request.headers.get("accept")):
+        return msgpack_response(messages, headers=headers)
+    return JSONResponse(content=messages, headers=headers)
+
+
+@app.get("/api/v1/users/{user_id}/chats")
+async def list_user_chats(
+    user_id: uuid.UUID,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_replica_db),
+):
+    """
+    List a user's chats, most recently active first.
+
+    Each entry carries the chat's message count and a preview of its latest
+    message, read from the chats table alone. Pass `next_cursor` from the
+    response as `cursor` to fetch the next page; it is null on the last page.
+    """
+    before = None
+    if cursor is not None:
+        try:
+            before = decode_chat_cursor(cursor)
+        except ValueError as ve:
+            raise HTTPException(status_code=400, detail="Invalid cursor") from ve
+
+    # One extra row tells us whether another page exists
+    chats = await chat_crud.list_for_user(
+        db, user_id=user_id, before=before, limit=limit + 1
+    )
+    page = chats[:limit]
+    next_cursor = None
+    if len(chats) > limit:
+        last = page[-1]
+        next_cursor = encode_cursor(last.last_message_at, last.chat_id)
+    return {
+        "chats": [
+            ChatSummary.model_validate(chat).model_dump(mode="json") for chat in page
+        ],
+        "next_cursor": next_cursor,
+    }
+
+
+@app.get("/api/v1/users/{user_id}/search")
+async def search_messages(
+    user_id: uuid.UUID,
+    q: str = Query(..., min_length=1, max_length=256),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_replica_db),
+):
+    """
+    Full-text search over a user's messages, best matches first.
+
+    `q` accepts web search syntax: "quoted phrases", `or`, and `-excluded`
+    words. Each result carries a snippet with matches wrapped in <mark> tags.
+    Pass `next_cursor` from the response as `cursor` for the next page.
+    """
+    before = None
+    if cursor is not None:
+        try:
+            before = decode_search_cursor(cursor)
+        except ValueError as ve:
+            raise HTTPException(status_code=400, detail="Invalid cursor") from ve
+
+    rows = await message_crud.search(
+        db, user_id=user_id, query=q, before=before, limit=limit + 1
+    )
+    page = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last = page[-1]
+        next_cursor = encode_cursor(last.rank, last.message_id)
+    return {
+        "results": [
+            {
+                "message_id": str(row.message_id),
+                "chat_id": str(row.chat_id),
+                "role": "user" if row.user_message else "assistant",
+                "timestamp": row.timestamp.isoformat(),
+                "rank": row.rank,
+                "snippet": row.snippet,
+            }
+            for row in page
+        ],
+        "next_cursor": next_cursor,
+    }
 
 
 logging.basicConfig(level=logging.INFO)
@@ -0,0 +1,51 @@
+"""Opaque cursors for keyset-paginated endpoints.
+
+A cursor is the sort key of the last row on a page, JSON-encoded and then
+base64url-encoded so clients treat it as an opaque token. Endpoints decode it
+back into typed values and continue strictly after that key.
+"""
+
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any
+from uuid import UUID
+
+
+def encode_cursor(*values: Any) -> str:
+    """Encode a row's sort key as an opaque cursor string."""
+    raw = json.dumps(
+        [v.isoformat() if isinstance(v, datetime) else str(v) for v in values],
+        separators=(",", ":"),
+    )
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> list[str]:
+    """Decode a cursor into its ``size`` raw string values.
+
+    Raises ValueError for anything that was not produced by encode_cursor.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError("Malformed cursor") from e
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Malformed cursor")
+    if not all(isinstance(v, str) for v in values):
+        raise ValueError("Malformed cursor")
+    return values
+
+
+def decode_chat_cursor(cursor: str) -> tuple[datetime, UUID]:
+    """Decode a chat list cursor into (last_message_at, chat_id)."""
+    last_message_at, chat_id = decode_cursor(cursor, 2)
+    return datetime.fromisoformat(last_message_at), UUID(chat_id)
+
+
+def decode_search_cursor(cursor: str) -> tuple[float, UUID]:
+    """Decode a search cursor into (rank, message_id)."""
+    rank, message_id = decode_cursor(cursor, 2)
+    return float(rank), UUID(message_id)
@@ -0,0 +1,141 @@
+"""Opt-in profiling of single requests.
+
+``ProfilerMiddleware`` is off unless configured. A request is profiled when
+it carries ``X-Profile`` set to ``PROFILER_TOKEN``, or at random with
+probability ``PROFILER_SAMPLE_RATE``. The request runs under pyinstrument, a
+statistical profiler that samples the stack every ``interval`` seconds and,
+in async mode, only counts time spent in this request's task, so concurrent
+requests don't pollute the profile. One request is profiled at a time;
+others arriving meanwhile run unprofiled.
+
+Each profile is written to ``output_dir`` as collapsed stacks
+(``<name>.folded``, one ``frame;frame;frame microseconds`` line per stack),
+which flamegraph.pl, inferno and speedscope read directly. The response
+names the file in ``X-Profile-Id``. Only the newest ``keep`` files are kept.
+Profiled requests are counted in ``api_profiled_requests_total`` by trigger.
+"""
+
+import asyncio
+import hmac
+import logging
+import random
+import re
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Optional
+
+from prometheus_client import Counter
+from pyinstrument import Profiler
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "x-profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+
+PROFILED_REQUESTS = Counter(
+    "api_profiled_requests",
+    "Requests profiled by the profiler middleware",
+    ["trigger"],
+)
+
+
+def collapsed_stacks(frame, prefix: str = "") -> list[str]:
+    """A pyinstrument frame tree as collapsed stack lines."""
+    if frame.is_synthetic or frame.file_path_short is None:
+        name = frame.function
+    else:
+        name = f"{frame.function} ({frame.file_path_short}:{frame.line_no})"
+    # ";" separates frames in the collapsed format
+    name = name.replace(";", ":")
+    stack = f"{prefix};{name}" if prefix else name
+    lines = []
+    own_time = frame.time - sum(child.time for child in frame.children)
+    if own_time > 0:
+        lines.append(f"{stack} {round(own_time * 1e6)}")
+    for child in frame.children:
+        lines.extend(collapsed_stacks(child, stack))
+    return lines
+
+
+class ProfilerMiddleware:
+    """Profiles requests that ask for it with the token, or a random sample."""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        *,
+        output_dir: str,
+        token: Optional[str] = None,
+        sample_rate: float = 0.0,
+        interval: float = 0.001,
+        keep: int = 200,
+        rng: Callable[[], float] = random.random,
+    ):
+        self.app = app
+        self.output_dir = Path(output_dir)
+        self.token = token or None
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.keep = keep
+        self.rng = rng
+        self._profiling = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.token is not None or self.sample_rate > 0
+
+    def trigger(self, scope: Scope) -> Optional[str]:
+        """Why this request should be profiled, or None."""
+        requested = Headers(scope=scope).get(PROFILE_HEADER)
+        if requested is not None and self.token is not None:
+            if hmac.compare_digest(requested.encode(), self.token.encode()):
+                return "header"
+            logger.warning("Ignoring X-Profile with a wrong token")
+        if self.sample_rate > 0 and self.rng() < self.sample_rate:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.enabled or self._profiling:
+            await self.app(scope, receive, send)
+            return
+        trigger = self.trigger(scope)
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        path = re.sub(r"[^A-Za-z0-9]+", "-", scope["path"]).strip("-") or "root"
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        name = f"{stamp}-{scope['method']}-{path}-{uuid.uuid4().hex[:8]}"
+
+        async def send_with_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                MutableHeaders(raw=message["headers"])[PROFILE_ID_HEADER] = name
+            await send(message)
+
+        self._profiling = True
+        profiler = Profiler(interval=self.interval, async_mode="enabled")
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            session = profiler.stop()
+            self._profiling = False
+            PROFILED_REQUESTS.labels(trigger).inc()
+            try:
+                await asyncio.to_thread(self._write, name, session)
+            except Exception as e:
+                logger.error(f"Could not write profile {name}: {e}")
+
+    def _write(self, name: str, session) -> None:
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        root = session.root_frame()
+        lines = collapsed_stacks(root) if root is not None else []
+        (self.output_dir / f"{name}.folded").write_text("\n".join(lines) + "\n")
+        profiles = sorted(self.output_dir.glob("*.folded"))
+        for old in profiles[: max(0, len(profiles) - self.keep)]:
+            old.unlink(missing_ok=True)
+        logger.info(f"Profiled request {name}: {session.duration * 1000:.1f} ms")
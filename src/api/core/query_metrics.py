@@ -0,0 +1,110 @@
+"""Database work per request.
+
+``QueryMetricsMiddleware`` runs every request inside
+``common.db.instrumentation.track_queries()`` and, once it is answered:
+
+- observes the number of statements and the time spent in the database in
+  ``api_db_queries_per_request`` and ``api_db_time_per_request_seconds``,
+  labelled by route template like the instrumentator's metrics;
+- counts slow statements (``SLOW_QUERY_MS``) in ``api_db_slow_queries_total``
+  and requests that ran one statement ``repeat_threshold`` or more times, the
+  usual sign of an N+1 query, in ``api_db_repeated_queries_total``;
+- logs the request with its query count and database time, at warning level
+  with the offending statements when any were slow or repeated.
+
+Responses also carry the figures in a ``Server-Timing`` header, so they show
+up in the browser's network panel.
+"""
+
+import logging
+import time
+
+from prometheus_client import Counter, Histogram
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from common.db.instrumentation import QueryStats, track_queries
+
+logger = logging.getLogger(__name__)
+
+QUERIES_PER_REQUEST = Histogram(
+    "api_db_queries_per_request",
+    "SQL statements run per request",
+    ["handler"],
+    buckets=(0, 1, 2, 3, 4, 5, 8, 13, 21, 34, 55, 89),
+)
+DB_TIME_PER_REQUEST = Histogram(
+    "api_db_time_per_request_seconds",
+    "Time spent in the database per request",
+    ["handler"],
+)
+SLOW_QUERIES = Counter(
+    "api_db_slow_queries",
+    "SQL statements slower than SLOW_QUERY_MS",
+    ["handler"],
+)
+REPEATED_QUERIES = Counter(
+    "api_db_repeated_queries",
+    "Requests that ran the same statement repeatedly (likely N+1)",
+    ["handler"],
+)
+
+
+def _handler(scope: Scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or "none"
+
+
+class QueryMetricsMiddleware:
+    """Measures, exports and logs the SQL each request runs."""
+
+    def __init__(self, app: ASGIApp, *, repeat_threshold: int = 5):
+        self.app = app
+        self.repeat_threshold = repeat_threshold
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        with track_queries() as stats:
+
+            async def send_with_timing(message: Message) -> None:
+                nonlocal status
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    MutableHeaders(raw=message["headers"]).append(
+                        "Server-Timing",
+                        f'db;dur={stats.duration * 1000:.1f};desc="{stats.count} '
+                        'queries"',
+                    )
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_timing)
+            finally:
+                self._report(scope, status, time.perf_counter() - started, stats)
+
+    def _report(
+        self, scope: Scope, status: int, elapsed: float, stats: QueryStats
+    ) -> None:
+        handler = _handler(scope)
+        QUERIES_PER_REQUEST.labels(handler).observe(stats.count)
+        DB_TIME_PER_REQUEST.labels(handler).observe(stats.duration)
+        if stats.slow:
+            SLOW_QUERIES.labels(handler).inc(len(stats.slow))
+        if stats.repeated(self.repeat_threshold):
+            REPEATED_QUERIES.labels(handler).inc()
+
+        line = (
+            f"{scope['method']} {scope['path']} {status} "
+            f"{elapsed * 1000:.1f} ms, db: {stats}"
+        )
+        warnings = stats.warnings(self.repeat_threshold)
+        if warnings:
+            logger.warning("\n  ".join([line, *warnings]))
+        else:
+            logger.info(line)
@@ -0,0 +1,230 @@
+"""Request/reply calls to the worker over the message transport.
+
+The API publishes a chat message to the worker queue with a unique
+``correlation_id`` and ``reply_to`` set to this process's callback queue, a
+private, uniquely named queue that lives as long as the connection. The
+worker publishes its result there once the reply is committed. Each call
+waits on a future registered under its correlation id; the callback queue's
+consumer resolves it when the matching reply arrives. Requests are encoded by
+a ``PayloadCodec`` and list the formats we read in ``x-accept``, so the worker
+answers in one of them; replies decode into ``reply_type``.
+
+The chat endpoint does not publish itself: it ``prepare()``s the request,
+writes it to the transactional outbox with the user message, and ``wait()``s
+for the reply once the transaction has committed; the outbox relay does the
+publishing. ``call()`` publishes directly.
+
+A call that times out returns ``None``; the worker still finishes the job and
+its reply is persisted as usual, so the caller can answer 202 and let the
+client pick the reply up from the chat history. Replies that arrive after
+their caller gave up are dropped.
+
+If the callback queue's consumer fails once started (the broker connection or
+channel dropped), the client stops reporting ``started``, so the API answers
+inline meanwhile, returns ``None`` to the calls waiting for a reply, and
+starts over with a new callback queue, retrying with backoff.
+
+On RabbitMQ, publishing uses the transport's pool of channels, so concurrent
+requests do not serialize on one channel. With ``TRANSPORT=memory`` the calls
+reach a worker running in the same process.
+"""
+
+import asyncio
+import logging
+import os
+import uuid
+from dataclasses import dataclass
+from typing import Any, Optional, Type
+
+from common.messaging.payloads import (
+    ChatReply,
+    Payload,
+    PayloadCodec,
+    payload_codec_from_env,
+)
+from common.messaging.transport import (
+    Delivery,
+    OutgoingMessage,
+    Transport,
+    transport_from_env,
+)
+
+logger = logging.getLogger(__name__)
+
+# Unacked replies the callback consumer holds at once
+REPLY_PREFETCH = 256
+# Longest wait between attempts to restart a failed callback consumer
+MAX_RECONNECT_DELAY = 30.0
+
+
+@dataclass
+class PendingCall:
+    """A request registered with the client, waiting to be sent and answered."""
+
+    message: OutgoingMessage
+    future: asyncio.Future
+
+
+class RpcClient:
+    """Publishes requests to a queue and awaits replies by correlation id."""
+
+    def __init__(
+        self,
+        transport: Transport,
+        *,
+        queue_name: str,
+        codec: Optional[PayloadCodec] = None,
+        reply_type: Optional[Type[Payload]] = None,
+        reconnect_delay: float = 1.0,
+    ):
+        self.transport = transport
+        self.queue_name = queue_name
+        self.codec = codec or PayloadCodec()
+        # Replies decode into this payload type, or into dicts without one
+        self.reply_type = reply_type
+        self.reconnect_delay = reconnect_delay
+        self._pending: dict[str, asyncio.Future] = {}
+        self._callback_queue: Optional[str] = None
+        self._listening: Optional[asyncio.Task] = None
+        self._restarting: Optional[asyncio.Task] = None
+
+    @property
+    def started(self) -> bool:
+        return self._callback_queue is not None
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def start(self) -> None:
+        await self.transport.connect()
+        queue = await self.transport.declare_callback_queue()
+        ready = asyncio.get_running_loop().create_future()
+        self._listening = asyncio.create_task(self._listen(queue, ready))
+        await ready
+        self._callback_queue = queue
+        logger.info("RPC client ready, replies on %s", queue)
+
+    async def close(self) -> None:
+        self._callback_queue = None
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+        for task in (self._restarting, self._listening):
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._restarting = self._listening = None
+        await self.transport.close()
+
+    def prepare(
+        self, payload: Payload | dict[str, Any], *, message_id: Optional[str] = None
+    ) -> PendingCall:
+        """Register a request; its reply resolves the call once it is published."""
+        if not self.started:
+            raise RuntimeError("RpcClient.start() has not been called")
+        correlation_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._pending[correlation_id] = future
+        message = self.codec.request(
+            payload,
+            correlation_id=correlation_id,
+            reply_to=self._callback_queue,
+            message_id=message_id,
+        )
+        return PendingCall(message, future)
+
+    async def wait(self, call: PendingCall, *, timeout: float) -> Optional[Any]:
+        """Wait up to ``timeout`` seconds for the reply to a prepared call."""
+        try:
+            return await asyncio.wait_for(call.future, timeout)
+        except asyncio.TimeoutError:
+            logger.info(
+                "No reply for %s within %.1fs", call.message.correlation_id, timeout
+            )
+            return None
+        finally:
+            self.discard(call)
+
+    def discard(self, call: PendingCall) -> None:
+        """Forget a call; a reply arriving later is dropped."""
+        self._pending.pop(call.message.correlation_id, None)
+
+    async def call(
+        self,
+        payload: Payload | dict[str, Any],
+        *,
+        timeout: float,
+        message_id: Optional[str] = None,
+    ) -> Optional[Any]:
+        """Publish ``payload`` and wait up to ``timeout`` seconds for the reply."""
+        pending = self.prepare(payload, message_id=message_id)
+        try:
+            await self.transport.publish(self.queue_name, pending.message)
+        except Exception:
+            self.discard(pending)
+            raise
+        return await self.wait(pending, timeout=timeout)
+
+    async def _listen(self, queue: str, ready: asyncio.Future) -> None:
+        try:
+            async with self.transport.consume(
+                queue, prefetch=REPLY_PREFETCH
+            ) as replies:
+                ready.set_result(None)
+                async for reply in replies:
+                    self._on_reply(reply)
+                    await reply.ack()
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+                return
+            logger.error("RPC reply consumer on %s failed: %s", queue, e)
+            self._callback_queue = None
+            # Their replies went to the lost queue; answer them as timed out
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_result(None)
+            self._pending.clear()
+            self._restarting = asyncio.create_task(self._restart())
+
+    async def _restart(self) -> None:
+        delay = self.reconnect_delay
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self.start()
+                return
+            except Exception as e:
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+                logger.warning(
+                    "RPC client restart failed, retrying in %.0fs: %s", delay, e
+                )
+
+    def _on_reply(self, message: Delivery) -> None:
+        future = self._pending.get(message.correlation_id)
+        if future is None or future.done():
+            logger.debug("Dropping late reply %s", message.correlation_id)
+            return
+        try:
+            future.set_result(self.codec.decode(message, self.reply_type))
+        except ValueError as e:
+            # PayloadError: the caller sees why the reply was unreadable
+            future.set_exception(e)
+
+
+def rpc_from_env() -> Optional[RpcClient]:
+    """The worker RPC client, or None to answer chat messages in the API."""
+    uses_broker = os.getenv("TRANSPORT", "rabbitmq") == "rabbitmq"
+    if uses_broker and not os.getenv("RABBITMQ_HOST"):
+        return None
+    return RpcClient(
+        transport_from_env(),
+        queue_name=os.getenv("QUEUE_NAME", "chat_queue"),
+        codec=payload_codec_from_env(),
+        reply_type=ChatReply,
+    )
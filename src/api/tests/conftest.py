@@ -2,6 +2,7 @@ import os
 import sys
 from unittest.mock import AsyncMock, Mock, patch
 
+import httpx
 import pytest
 from dotenv import load_dotenv
 
@@ -52,6 +53,13 @@ with (
     from core.main import app
 
 
+def api_client(app) -> httpx.AsyncClient:
+    """A client calling ``app`` in process; use it as ``async with``."""
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://api"
+    )
+
+
 @pytest.fixture
 def test_app():
     return app
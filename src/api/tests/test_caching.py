@@ -0,0 +1,152 @@
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import msgpack
+import pytest
+from core import main
+from core.caching import etag_matches, history_etag
+from tests.conftest import api_client
+
+from common.db.ids import uuid7, uuid7_floor, uuid7_time
+
+
+def chat(**changes):
+    fields = {
+        "chat_id": uuid.UUID("0192a8b4-4c5e-7d3f-9a1b-2c3d4e5f6a7b"),
+        "message_count": 3,
+        "last_message_at": datetime(2026, 10, 19, 12, 0, tzinfo=timezone.utc),
+        "archive_path": None,
+    }
+    return SimpleNamespace(**{**fields, **changes})
+
+
+def message(content="Keep going!"):
+    return SimpleNamespace(
+        message_id=uuid.uuid4(),
+        user_message=False,
+        content=content,
+        timestamp=datetime(2026, 10, 19, 12, 0, tzinfo=timezone.utc),
+    )
+
+
+def test_etag_follows_the_chat_state_and_the_request():
+    etag = history_etag(chat(), None, None)
+
+    assert etag.startswith('W/"') and etag == history_etag(chat(), None, None)
+    # A late message with an older timestamp still changes the count
+    assert etag != history_etag(chat(message_count=4), None, None)
+    assert etag != history_etag(
+        chat(last_message_at=datetime(2026, 10, 19, 12, 1, tzinfo=timezone.utc)),
+        None,
+        None,
+    )
+    assert etag != history_etag(chat(), uuid.uuid4(), None)
+    assert etag != history_etag(chat(), None, 10)
+    # Archiving moves messages without changing the history
+    assert etag == history_etag(chat(archive_path="chats/01/x.jsonl.gz"), None, None)
+
+
+@pytest.mark.parametrize(
+    "if_none_match, matches",
+    [
+        (None, False),
+        ('W/"abc"', True),
+        ('"abc"', True),
+        ('W/"old", W/"abc"', True),
+        ("*", True),
+        ('W/"old"', False),
+    ],
+)
+def test_if_none_match_uses_weak_comparison(if_none_match, matches):
+    assert etag_matches(if_none_match, 'W/"abc"') is matches
+
+
+@pytest.fixture
+def history(monkeypatch):
+    """The history endpoint over a fake chat; returns the history loader."""
+    monkeypatch.setattr(main.chat_crud, "get", AsyncMock(return_value=chat()))
+    load = AsyncMock(return_value=[message()])
+    monkeypatch.setattr(main, "get_chat_history", load)
+    main.app.dependency_overrides[main.get_replica_db] = lambda: AsyncMock()
+    yield load
+    main.app.dependency_overrides.clear()
+
+
+async def get_history(**headers):
+    async with api_client(main.app) as c:
+        return await c.get(f"/api/v1/chats/{chat().chat_id}", headers=headers)
+
+
+@pytest.mark.asyncio
+async def test_matching_if_none_match_skips_loading_messages(history):
+    first = await get_history()
+    assert first.status_code == 200
+    assert first.json()[0]["content"] == "Keep going!"
+    assert first.headers["cache-control"] == "no-cache"
+    assert first.headers["last-modified"] == "Mon, 19 Oct 2026 12:00:00 GMT"
+
+    again = await get_history(**{"If-None-Match": first.headers["etag"]})
+
+    assert again.status_code == 304
+    assert again.content == b""
+    assert again.headers["etag"] == first.headers["etag"]
+    assert history.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_stale_etag_gets_the_history(history):
+    response = await get_history(**{"If-None-Match": 'W/"stale"'})
+    assert response.status_code == 200
+    assert history.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_history_is_sent_as_msgpack_on_request(history):
+    json_response = await get_history()
+    response = await get_history(Accept="application/msgpack, application/json")
+
+    assert response.headers["content-type"] == "application/msgpack"
+    assert msgpack.unpackb(response.content) == json_response.json()
+    assert response.headers["etag"] == json_response.headers["etag"]
+    assert response.headers["vary"] == "Accept"
+
+
+@pytest.mark.asyncio
+async def test_history_after_a_cursor_rereads_the_overlap(history):
+    after = uuid.uuid4()
+    async with api_client(main.app) as c:
+        await c.get(f"/api/v1/chats/{chat().chat_id}", params={"after": str(after)})
+
+    kwargs = history.await_args.kwargs
+    assert kwargs["after"] == after
+    assert kwargs["overlap"] == main.CHAT_CURSOR_OVERLAP > 0
+
+
+@pytest.mark.asyncio
+async def test_long_poll_waits_past_messages_resent_by_the_overlap(
+    history, monkeypatch
+):
+    after = uuid7()
+    resent, newer = message("Already seen"), message("New")
+    resent.message_id = uuid7_floor(uuid7_time(after) - timedelta(seconds=1))
+    newer.message_id = uuid7()
+    history.side_effect = [[resent], [resent, newer]]
+
+    @asynccontextmanager
+    async def read_session(keys):
+        yield AsyncMock()
+
+    monkeypatch.setattr(main, "get_read_session", read_session)
+    monkeypatch.setattr(main.chat_events, "poll_interval", 0.01)
+    async with api_client(main.app) as c:
+        response = await c.get(
+            f"/api/v1/chats/{chat().chat_id}",
+            params={"after": str(after), "wait": 5},
+        )
+
+    # The first read only re-sent the overlap, so the request kept waiting
+    assert history.await_count == 2
+    assert [m["content"] for m in response.json()] == ["Already seen", "New"]
@@ -0,0 +1,145 @@
+import asyncio
+import gzip
+import json
+
+import brotli
+import pytest
+import zstandard
+from core.encoding import CompressionMiddleware, choose_encoding, prefers_msgpack
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from tests.conftest import api_client
+
+HISTORY = [
+    {"role": "assistant", "content": f"Keep going, day {i}!"} for i in range(200)
+]
+DECOMPRESS = {
+    "gzip": gzip.decompress,
+    "br": brotli.decompress,
+    "zstd": lambda body: zstandard.ZstdDecompressor().decompressobj().decompress(body),
+}
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, encoding",
+    [
+        (None, None),
+        ("identity", None),
+        ("gzip", "gzip"),
+        ("gzip, deflate, br", "br"),
+        ("gzip, br, zstd", "zstd"),
+        ("zstd;q=0.5, gzip", "gzip"),
+        ("*", "zstd"),
+        ("*, zstd;q=0", "br"),
+        ("gzip;q=0, deflate", None),
+    ],
+)
+def test_encoding_negotiation(accept_encoding, encoding):
+    assert choose_encoding(accept_encoding) == encoding
+
+
+@pytest.mark.parametrize(
+    "accept, msgpack",
+    [
+        (None, False),
+        ("*/*", False),
+        ("application/json", False),
+        ("application/msgpack", True),
+        ("application/msgpack, application/json;q=0.9", True),
+        ("application/json, application/msgpack;q=0.5", False),
+        ("application/x-msgpack, */*;q=0.1", True),
+    ],
+)
+def test_msgpack_negotiation(accept, msgpack):
+    assert prefers_msgpack(accept) is msgpack
+
+
+@pytest.fixture
+def app():
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=500, thread_min_size=4096)
+
+    @app.get("/history")
+    async def history(size: int = 200):
+        return JSONResponse(HISTORY[:size])
+
+    @app.get("/stream")
+    async def stream():
+        async def chunks():
+            for message in HISTORY:
+                yield json.dumps(message).encode()
+
+        return StreamingResponse(chunks(), media_type="application/json")
+
+    @app.get("/encoded")
+    async def encoded():
+        body = gzip.compress(json.dumps(HISTORY).encode())
+        return Response(
+            body, media_type="application/json", headers={"Content-Encoding": "gzip"}
+        )
+
+    @app.get("/image")
+    async def image():
+        return Response(b"\x89PNG" + bytes(4000), media_type="image/png")
+
+    return app
+
+
+async def get_raw(app, path, accept_encoding):
+    async with api_client(app) as c:
+        headers = {"Accept-Encoding": accept_encoding}
+        async with c.stream("GET", path, headers=headers) as response:
+            body = b"".join([chunk async for chunk in response.aiter_raw()])
+            return response, body
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("encoding", ["gzip", "br", "zstd"])
+async def test_large_responses_are_compressed(app, encoding):
+    response, body = await get_raw(app, "/history", encoding)
+
+    assert response.headers["content-encoding"] == encoding
+    assert response.headers["content-length"] == str(len(body))
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert len(body) < len(json.dumps(HISTORY))
+    assert json.loads(DECOMPRESS[encoding](body)) == HISTORY
+
+
+@pytest.mark.asyncio
+async def test_large_bodies_are_compressed_off_the_event_loop(app, monkeypatch):
+    threaded = []
+    to_thread = asyncio.to_thread
+
+    async def record(function, *args):
+        threaded.append(len(args[0]))
+        return await to_thread(function, *args)
+
+    monkeypatch.setattr(asyncio, "to_thread", record)
+
+    await get_raw(app, "/history?size=20", "zstd")
+    assert threaded == []
+    response, body = await get_raw(app, "/history", "zstd")
+    assert threaded == [len(json.dumps(HISTORY, separators=(",", ":")))]
+    assert json.loads(DECOMPRESS["zstd"](body)) == HISTORY
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "path, accept_encoding",
+    [
+        ("/history?size=2", "gzip"),
+        ("/history", "identity"),
+        ("/stream", "gzip"),
+        ("/image", "gzip"),
+    ],
+)
+async def test_responses_passed_through(app, path, accept_encoding):
+    response, _ = await get_raw(app, path, accept_encoding)
+    assert "content-encoding" not in response.headers
+
+
+@pytest.mark.asyncio
+async def test_already_encoded_responses_are_left_alone(app):
+    response, body = await get_raw(app, "/encoded", "zstd")
+    assert response.headers["content-encoding"] == "gzip"
+    assert json.loads(gzip.decompress(body)) == HISTORY
@@ -0,0 +1,40 @@
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+from core.pagination import (
+    decode_chat_cursor,
+    decode_cursor,
+    decode_search_cursor,
+    encode_cursor,
+)
+
+
+def test_chat_cursor_round_trip():
+    last_message_at = datetime(2026, 10, 19, 12, 30, 5, 123456, tzinfo=timezone.utc)
+    chat_id = uuid.uuid4()
+
+    cursor = encode_cursor(last_message_at, chat_id)
+
+    assert "=" not in cursor
+    assert decode_chat_cursor(cursor) == (last_message_at, chat_id)
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    ["not base64!", "", encode_cursor("only-one"), "W1sxXSwgMl0"],
+)
+def test_decode_cursor_rejects_malformed(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, 2)
+
+
+def test_chat_cursor_rejects_bad_values():
+    with pytest.raises(ValueError):
+        decode_chat_cursor(encode_cursor("yesterday", "not-a-uuid"))
+
+
+def test_search_cursor_round_trip():
+    rank, message_id = 0.1 + 0.2, uuid.uuid4()
+
+    assert decode_search_cursor(encode_cursor(rank, message_id)) == (rank, message_id)
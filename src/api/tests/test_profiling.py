@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+from core.profiling import PROFILED_REQUESTS, ProfilerMiddleware
+from fastapi import FastAPI
+from tests.conftest import api_client
+
+
+def busy_work():
+    return sum(i * i for i in range(200_000))
+
+
+def make_app(tmp_path, **options):
+    app = FastAPI()
+
+    @app.get("/slow")
+    async def slow():
+        busy_work()
+        await asyncio.sleep(0.01)
+        return {"ok": True}
+
+    app.add_middleware(
+        ProfilerMiddleware, output_dir=str(tmp_path), interval=0.0005, **options
+    )
+    return app
+
+
+async def get(app, **headers):
+    async with api_client(app) as c:
+        return await c.get("/slow", headers=headers)
+
+
+def profiled(trigger):
+    return PROFILED_REQUESTS.labels(trigger)._value.get()
+
+
+@pytest.mark.asyncio
+async def test_requests_with_the_token_are_profiled(tmp_path):
+    app = make_app(tmp_path, token="s3cret")
+    before = profiled("header")
+
+    response = await get(app, **{"X-Profile": "s3cret"})
+
+    assert response.status_code == 200
+    profile = tmp_path / f"{response.headers['x-profile-id']}.folded"
+    lines = profile.read_text().splitlines()
+    assert any("busy_work" in line for line in lines)
+    for line in lines:
+        stack, micros = line.rsplit(" ", 1)
+        assert stack and int(micros) > 0
+    assert profiled("header") == before + 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "options, headers",
+    [
+        ({}, {"X-Profile": "s3cret"}),
+        ({"token": "s3cret"}, {}),
+        ({"token": "s3cret"}, {"X-Profile": "guess"}),
+        ({"sample_rate": 0.1, "rng": lambda: 0.5}, {}),
+    ],
+)
+async def test_other_requests_are_not_profiled(tmp_path, options, headers):
+    response = await get(make_app(tmp_path, **options), **headers)
+
+    assert response.status_code == 200
+    assert "x-profile-id" not in response.headers
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.asyncio
+async def test_sampled_requests_are_profiled_and_old_profiles_pruned(tmp_path):
+    app = make_app(tmp_path, sample_rate=0.1, rng=lambda: 0.05, keep=2)
+    before = profiled("sampled")
+
+    ids = [(await get(app)).headers["x-profile-id"] for _ in range(3)]
+
+    assert sorted(p.stem for p in tmp_path.iterdir()) == ids[1:]
+    assert profiled("sampled") == before + 3
@@ -0,0 +1,88 @@
+import logging
+import re
+
+import pytest
+from core.query_metrics import (
+    QUERIES_PER_REQUEST,
+    REPEATED_QUERIES,
+    SLOW_QUERIES,
+    QueryMetricsMiddleware,
+)
+from fastapi import FastAPI
+from tests.conftest import api_client
+
+from common.db.instrumentation import record_query
+
+
+@pytest.fixture
+def app():
+    app = FastAPI()
+    app.add_middleware(QueryMetricsMiddleware, repeat_threshold=3)
+
+    @app.get("/chats/{chat_id}")
+    async def chat(chat_id: str):
+        record_query("SELECT * FROM chats WHERE chat_id = $1", 0.002)
+        record_query("SELECT * FROM messages WHERE chat_id = $1", 0.003)
+        return {"chat_id": chat_id}
+
+    @app.get("/lazy")
+    async def lazy():
+        for _ in range(4):
+            record_query("SELECT * FROM users WHERE user_id = $1", 0.001)
+        record_query("SELECT pg_sleep($1)", 0.5, slow=True)
+        return []
+
+    return app
+
+
+async def get(app, path):
+    async with api_client(app) as c:
+        return await c.get(path)
+
+
+def sample(metric, handler):
+    return metric.labels(handler)._value.get()
+
+
+def request_logs(caplog):
+    return [r for r in caplog.records if r.name == "core.query_metrics"]
+
+
+def observations(handler):
+    metric = QUERIES_PER_REQUEST.labels(handler)
+    return metric._sum.get(), sum(bucket.get() for bucket in metric._buckets)
+
+
+@pytest.mark.asyncio
+async def test_queries_are_counted_per_route(app, caplog):
+    total, requests = observations("/chats/{chat_id}")
+
+    with caplog.at_level(logging.INFO, logger="core.query_metrics"):
+        response = await get(app, "/chats/abc")
+
+    assert response.status_code == 200
+    assert response.headers["server-timing"] == 'db;dur=5.0;desc="2 queries"'
+    assert observations("/chats/{chat_id}") == (total + 2, requests + 1)
+    (record,) = request_logs(caplog)
+    assert record.levelno == logging.INFO
+    assert re.fullmatch(
+        r"GET /chats/abc 200 [\d.]+ ms, db: 2 queries in 5.0 ms", record.message
+    )
+
+
+@pytest.mark.asyncio
+async def test_slow_and_repeated_statements_are_reported(app, caplog):
+    slow = sample(SLOW_QUERIES, "/lazy")
+    repeated = sample(REPEATED_QUERIES, "/lazy")
+
+    with caplog.at_level(logging.INFO, logger="core.query_metrics"):
+        await get(app, "/lazy")
+
+    assert sample(SLOW_QUERIES, "/lazy") == slow + 1
+    assert sample(REPEATED_QUERIES, "/lazy") == repeated + 1
+    (record,) = request_logs(caplog)
+    assert record.levelno == logging.WARNING
+    assert record.message.splitlines()[1:] == [
+        "  slow (500.0 ms): SELECT pg_sleep(?)",
+        "  repeated 4x: SELECT * FROM users WHERE user_id = ?",
+    ]
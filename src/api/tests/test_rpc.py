@@ -0,0 +1,202 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from unittest.mock import AsyncMock
+
+import pytest
+import pytest_asyncio
+from core.rpc import RpcClient
+
+from common.messaging.memory import InMemoryTransport
+from common.messaging.payloads import JSON, ChatReply, PayloadCodec
+
+
+async def echo_worker(transport, answer=True):
+    """Answers each chat_queue request with its own content, or stays silent."""
+    codec = PayloadCodec()
+    async with transport.consume("chat_queue", prefetch=10) as requests:
+        async for request in requests:
+            if answer:
+                body = codec.decode(request)
+                await transport.publish(
+                    request.reply_to,
+                    codec.message(
+                        {"content": body["content"]},
+                        content_type=codec.reply_format(request),
+                        correlation_id=request.correlation_id,
+                    ),
+                )
+            await request.ack()
+
+
+@pytest_asyncio.fixture
+async def started():
+    transport = InMemoryTransport()
+    client = RpcClient(transport, queue_name="chat_queue")
+    await client.start()
+    workers = []
+
+    def run_worker(answer=True):
+        workers.append(asyncio.create_task(echo_worker(transport, answer)))
+
+    yield client, transport, run_worker
+    for worker in workers:
+        worker.cancel()
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_call_returns_the_matching_reply(started):
+    client, transport, run_worker = started
+    run_worker()
+
+    results = await asyncio.gather(
+        *(client.call({"content": f"hi {i}"}, timeout=1) for i in range(5))
+    )
+
+    assert [r["content"] for r in results] == [f"hi {i}" for i in range(5)]
+    assert client.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_timeout_returns_none_and_late_replies_are_dropped(started):
+    client, transport, run_worker = started
+
+    assert await client.call({"content": "slow"}, timeout=0.01) is None
+    assert client.pending == 0
+
+    # The worker answers after the caller gave up
+    run_worker()
+    for _ in range(50):
+        await asyncio.sleep(0.005)
+        if not transport.broker.depth("chat_queue"):
+            break
+    assert transport.broker.depth("chat_queue") == 0
+    assert client.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_call_requires_start():
+    client = RpcClient(InMemoryTransport(), queue_name="chat_queue")
+    with pytest.raises(RuntimeError):
+        await client.call({}, timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_publish_errors_reach_the_caller(started):
+    client, transport, _ = started
+    transport.publish = AsyncMock(side_effect=ConnectionError("broker gone"))
+
+    with pytest.raises(ConnectionError):
+        await client.call({"content": "hi"}, timeout=1)
+    assert client.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_start_fails_when_the_callback_queue_cannot_be_consumed():
+    transport = InMemoryTransport()
+    transport.consume = lambda *a, **kw: (_ for _ in ()).throw(
+        ConnectionError("channel closed")
+    )
+    client = RpcClient(transport, queue_name="chat_queue")
+
+    with pytest.raises(ConnectionError):
+        await client.start()
+    assert not client.started
+
+
+@pytest.mark.asyncio
+async def test_prepared_call_is_answered_once_published(started):
+    client, transport, run_worker = started
+    run_worker()
+
+    pending = client.prepare({"content": "via outbox"}, message_id="m-1")
+    assert pending.message.reply_to and pending.message.message_id == "m-1"
+    # Published later, e.g. by the outbox relay
+    await transport.publish("chat_queue", pending.message)
+
+    assert await client.wait(pending, timeout=1) == {"content": "via outbox"}
+    assert client.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_discarded_call_drops_its_reply(started):
+    client, transport, run_worker = started
+    pending = client.prepare({"content": "rolled back"})
+
+    client.discard(pending)
+
+    assert client.pending == 0
+    assert not pending.future.done()
+
+
+@pytest.mark.asyncio
+async def test_replies_decode_into_the_reply_type(started):
+    client, transport, _ = started
+    client.codec = PayloadCodec(JSON)
+    client.reply_type = ChatReply
+    pending = client.prepare({"content": "hi"})
+
+    # A worker answering in the format the request accepts first
+    reply = ChatReply(message_id="m", chat_id="c", content="hello")
+    await transport.publish(
+        pending.message.reply_to,
+        client.codec.message(
+            reply,
+            content_type=client.codec.reply_format(pending.message),
+            correlation_id=pending.message.correlation_id,
+        ),
+    )
+
+    assert await client.wait(pending, timeout=1) == reply
+
+
+@pytest.mark.asyncio
+async def test_consumer_failure_after_start_is_logged_and_recovered(caplog):
+    transport = InMemoryTransport()
+    consume = transport.consume
+    dropped = asyncio.Event()
+
+    @asynccontextmanager
+    async def flaky_consume(queue, *, prefetch):
+        if queue == "chat_queue" or dropped.is_set():
+            async with consume(queue, prefetch=prefetch) as deliveries:
+                yield deliveries
+            return
+
+        async def lost():
+            await dropped.wait()
+            raise ConnectionError("channel closed")
+            yield
+
+        yield lost()
+
+    transport.consume = flaky_consume
+    client = RpcClient(transport, queue_name="chat_queue", reconnect_delay=0.01)
+    await client.start()
+    first_queue = client._callback_queue
+    worker = asyncio.create_task(echo_worker(transport, answer=False))
+    try:
+        pending = client.prepare({"content": "in flight"})
+
+        with caplog.at_level(logging.ERROR, logger="core.rpc"):
+            dropped.set()
+            # The waiting caller gets the timeout answer rather than hanging
+            assert await client.wait(pending, timeout=1) is None
+        assert not client.started
+        assert "RPC reply consumer" in caplog.text
+        assert "channel closed" in caplog.text
+
+        for _ in range(100):
+            if client.started:
+                break
+            await asyncio.sleep(0.005)
+        assert client.started
+        assert client._callback_queue != first_queue
+
+        worker.cancel()
+        worker = asyncio.create_task(echo_worker(transport))
+        assert await client.call({"content": "back"}, timeout=1) == {"content": "back"}
+    finally:
+        worker.cancel()
+        await client.close()
@@ -0,0 +1,282 @@
+"""Cold-storage archival of inactive chats.
+
+Chats with no messages for ``inactive_days`` have their messages written to a
+gzip-compressed JSONL file and deleted from the hot ``messages`` table. The
+chat row stays behind as a stub recording when it was archived and where the
+file lives. Reads go through ``get_chat_history``, which stitches archived and
+hot messages back together, so callers never need to know a chat was archived.
+
+Archive files are immutable (re-archiving a chat writes a new file), which is
+what makes the in-process LRU cache of parsed archives safe.
+
+Run the archiver periodically:
+
+    python -m common.db.archive
+"""
+
+import asyncio
+import gzip
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Iterable, Optional
+from uuid import UUID
+
+from sqlalchemy import delete, exists, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from common.db.crud import message as message_crud
+from common.db.models import Chat, Message
+from common.db.schemas import MessageRead
+
+logger = logging.getLogger(__name__)
+
+
+class ArchiveStore(ABC):
+    """Where archive files live. Keys are relative, slash-separated paths."""
+
+    @abstractmethod
+    def write(self, key: str, data: bytes) -> None: ...
+
+    @abstractmethod
+    def read(self, key: str) -> bytes: ...
+
+    @abstractmethod
+    def delete(self, key: str) -> None: ...
+
+
+class LocalArchiveStore(ArchiveStore):
+    """Archive files in a local directory, or a mounted object-store bucket."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def write(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def read(self, key: str) -> bytes:
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+def archive_key(chat_id: UUID, archived_at: datetime) -> str:
+    # Spread files over 256 directories to keep directory listings short
+    return f"chats/{chat_id.hex[:2]}/{chat_id}-{archived_at:%Y%m%dT%H%M%S%f}.jsonl.gz"
+
+
+def serialize_messages(messages: Iterable[MessageRead]) -> bytes:
+    lines = (message.model_dump_json() for message in messages)
+    return gzip.compress("\n".join(lines).encode(), compresslevel=6)
+
+
+def deserialize_messages(data: bytes) -> list[MessageRead]:
+    text = gzip.decompress(data).decode()
+    return [MessageRead.model_validate(json.loads(line)) for line in text.splitlines()]
+
+
+class ChatArchive:
+    """Reads and writes chat archives, caching parsed archives in an LRU."""
+
+    def __init__(self, store: ArchiveStore, cache_size: int = 128):
+        self.store = store
+        self._load = lru_cache(maxsize=cache_size)(self._load_uncached)
+
+    def _load_uncached(self, key: str) -> tuple[MessageRead, ...]:
+        return tuple(deserialize_messages(self.store.read(key)))
+
+    async def load(self, key: str) -> tuple[MessageRead, ...]:
+        """Return the messages in an archive file, reading it off-loop on a miss."""
+        return await asyncio.to_thread(self._load, key)
+
+    def cache_info(self):
+        return self._load.cache_info()
+
+
+async def get_chat_history(
+    db: AsyncSession,
+    chat: Chat,
+    archive: ChatArchive,
+    *,
+    after: Optional[UUID] = None,
+    limit: Optional[int] = None,
+    overlap: float = 0,
+) -> list[MessageRead]:
+    """Return a chat's messages oldest first, archived ones before hot ones.
+
+    ``after`` is the id of the last message the caller has already seen.
+    Archives may hold pre-UUIDv7 ids, so the cursor is located by position in
+    the archive instead of being compared. ``overlap`` re-reads hot messages
+    committed late (see ``CRUDMessage.get_chat_messages``); archives are
+    written once a chat is inactive and need none.
+    """
+    archived = list(await archive.load(chat.archive_path)) if chat.archive_path else []
+    hot_after = after
+    if after is not None and archived:
+        ids = [message.message_id for message in archived]
+        if after in ids:
+            archived = archived[ids.index(after) + 1 :]
+            hot_after = None
+        else:
+            archived = []
+    if limit is not None:
+        archived = archived[:limit]
+        if len(archived) == limit:
+            return archived
+        limit -= len(archived)
+
+    hot = await message_crud.get_chat_messages(
+        db, chat_id=chat.chat_id, after=hot_after, limit=limit, overlap=overlap
+    )
+    return archived + [MessageRead.model_validate(message) for message in hot]
+
+
+def has_new_messages(
+    messages: Optional[list[MessageRead]], after: Optional[UUID]
+) -> bool:
+    """Whether a history page goes past ``after``, not just re-sends the overlap.
+
+    A message committed late, with an id before ``after``, does not count:
+    it is indistinguishable from one the caller already has.
+    """
+    if not messages:
+        return False
+    if after is None or after.version != 7:
+        return True
+    return any(message.message_id > after for message in messages)
+
+
+class ChatArchiver:
+    """Moves the messages of inactive chats from the hot table to an archive."""
+
+    def __init__(self, archive: ChatArchive, inactive_days: int, batch_size: int = 100):
+        self.archive = archive
+        self.inactive_days = inactive_days
+        self.batch_size = batch_size
+
+    def cutoff(self) -> datetime:
+        return datetime.now(timezone.utc) - timedelta(days=self.inactive_days)
+
+    async def find_inactive(self, db: AsyncSession, cutoff: datetime) -> list[UUID]:
+        """Return chats that still have hot messages, none of them recent."""
+        has_messages = exists().where(Message.chat_id == Chat.chat_id)
+        has_recent = exists().where(
+            Message.chat_id == Chat.chat_id, Message.timestamp >= cutoff
+        )
+        result = await db.execute(
+            select(Chat.chat_id)
+            .where(Chat.created_at < cutoff, has_messages, ~has_recent)
+            .limit(self.batch_size)
+        )
+        return list(result.scalars().all())
+
+    async def archive_chat(
+        self, db: AsyncSession, chat_id: UUID, cutoff: datetime
+    ) -> bool:
+        """Archive one chat in its own transaction; return False if skipped."""
+        # Locking the chat row blocks concurrent message inserts for this chat,
+        # which take a KEY SHARE lock on it through the foreign key.
+        chat = (
+            await db.execute(
+                select(Chat).where(Chat.chat_id == chat_id).with_for_update()
+            )
+        ).scalar_one_or_none()
+        if chat is None:
+            await db.rollback()
+            return False
+
+        hot = await message_crud.get_chat_messages(db, chat_id=chat_id)
+        if not hot or any(m.timestamp >= cutoff for m in hot):
+            await db.rollback()
+            return False
+
+        messages = [MessageRead.model_validate(m) for m in hot]
+        previous_key = chat.archive_path
+        if previous_key:
+            messages = list(await self.archive.load(previous_key)) + messages
+
+        archived_at = datetime.now(timezone.utc)
+        key = archive_key(chat_id, archived_at)
+        data = serialize_messages(messages)
+        await asyncio.to_thread(self.archive.store.write, key, data)
+
+        try:
+            await db.execute(delete(Message).where(Message.chat_id == chat_id))
+            chat.archived_at = archived_at
+            chat.archive_path = key
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            await asyncio.to_thread(self.archive.store.delete, key)
+            raise
+
+        if previous_key:
+            await asyncio.to_thread(self.archive.store.delete, previous_key)
+        logger.info(
+            "Archived %d messages of chat %s to %s (%d bytes)",
+            len(messages),
+            chat_id,
+            key,
+            len(data),
+        )
+        return True
+
+    async def run(self, db: AsyncSession) -> int:
+        """Archive every inactive chat; return how many were archived."""
+        cutoff = self.cutoff()
+        archived = 0
+        while True:
+            chat_ids = await self.find_inactive(db, cutoff)
+            await db.rollback()
+            if not chat_ids:
+                return archived
+            batch = 0
+            for chat_id in chat_ids:
+                if await self.archive_chat(db, chat_id, cutoff):
+                    batch += 1
+            if not batch:
+                return archived
+            archived += batch
+
+
+def archive_from_env() -> ChatArchive:
+    return ChatArchive(
+        LocalArchiveStore(os.getenv("ARCHIVE_DIR", "/var/lib/coach-bot/archive")),
+        cache_size=int(os.getenv("ARCHIVE_CACHE_SIZE", "128")),
+    )
+
+
+async def main(inactive_days: Optional[int] = None) -> None:
+    from common.db.connect import AsyncSessionLocal
+
+    logging.basicConfig(level=logging.INFO)
+    archiver = ChatArchiver(
+        archive_from_env(),
+        inactive_days=inactive_days or int(os.getenv("ARCHIVE_INACTIVE_DAYS", "30")),
+        batch_size=int(os.getenv("ARCHIVE_BATCH_SIZE", "100")),
+    )
+    async with AsyncSessionLocal() as session:
+        archived = await archiver.run(session)
+    logger.info("Archived %d chats", archived)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,13 +1,21 @@
 import asyncio
 import logging
 import os
+import time
 from contextlib import asynccontextmanager
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Callable, Iterable, Optional
 
 from dotenv import load_dotenv
 from sqlalchemy import text
 from sqlalchemy.exc import OperationalError
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+
+from common.db.instrumentation import instrument
 
 load_dotenv()
 
@@ -15,6 +23,23 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL is not set. Please check your .env file.")
 
+# Optional comma-separated read replicas, used by get_read_session/get_read_db
+DATABASE_REPLICA_URLS = [
+    url.strip()
+    for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",")
+    if url.strip()
+]
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv("REPLICA_LAG_CHECK_INTERVAL", "5"))
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "10"))
+
+# Connections per engine; the worker supervisor sets these for each child
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
+# Statements slower than this are logged (see common.db.instrumentation)
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+
 
 def get_sync_url(url: str) -> str:
     """Convert an async URL to a sync URL for migrations."""
@@ -36,19 +61,149 @@ def get_async_url(url: str) -> str:
     return url
 
 
-engine = create_async_engine(
-    get_async_url(DATABASE_URL),
-    echo=True,
-    pool_pre_ping=True,
-    pool_recycle=300,
-    pool_size=5,
-    max_overflow=10,
-)
+def create_engine(url: str) -> AsyncEngine:
+    engine = create_async_engine(
+        get_async_url(url),
+        echo=True,
+        pool_pre_ping=True,
+        pool_recycle=300,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+    )
+    instrument(engine, slow_threshold=SLOW_QUERY_MS / 1000)
+    return engine
+
+
+engine = create_engine(DATABASE_URL)
+replica_engines = [create_engine(url) for url in DATABASE_REPLICA_URLS]
 
 AsyncSessionLocal = async_sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False
 )
 
+# Unbound: each read session is bound to whichever engine the router picks
+ReadSessionLocal = async_sessionmaker(class_=AsyncSession, expire_on_commit=False)
+
+# Replay lag in seconds; 0 on a primary or a fully caught-up replica
+REPLICA_LAG_SQL = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) "
+    "END"
+)
+
+
+class _Replica:
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+        self.lag: float = float("inf")
+
+
+class ReplicaRouter:
+    """Chooses the engine for read-only sessions.
+
+    Replicas are used round-robin while their replay lag stays under
+    max_lag; otherwise reads fall back to the primary. Lag is measured every
+    check_interval by a background task started on the first choose(), so
+    reads only look at the last measurement and never wait on a replica; until
+    the first check completes they go to the primary. Keys passed to note_write
+    (a user or chat id) pin reads for those keys to the primary for
+    sticky_seconds, so a client always sees its own writes.
+    """
+
+    def __init__(
+        self,
+        primary: AsyncEngine,
+        replicas: Iterable[AsyncEngine],
+        max_lag: float = REPLICA_MAX_LAG_SECONDS,
+        check_interval: float = REPLICA_LAG_CHECK_INTERVAL,
+        sticky_seconds: float = READ_YOUR_WRITES_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.primary = primary
+        self.replicas = [_Replica(replica) for replica in replicas]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.sticky_seconds = sticky_seconds
+        self.clock = clock
+        self._next = 0
+        self._recent_writes: dict[str, float] = {}
+        self._checker: Optional[asyncio.Task] = None
+
+    def note_write(self, *keys) -> None:
+        """Pin reads for these keys to the primary for the stickiness window."""
+        now = self.clock()
+        if len(self._recent_writes) > 10_000:
+            self._recent_writes = {
+                key: until for key, until in self._recent_writes.items() if until > now
+            }
+        for key in keys:
+            self._recent_writes[str(key)] = now + self.sticky_seconds
+
+    def is_sticky(self, keys: Iterable) -> bool:
+        now = self.clock()
+        return any(self._recent_writes.get(str(key), 0) > now for key in keys)
+
+    async def measure_lag(self, replica: AsyncEngine) -> float:
+        async with replica.connect() as conn:
+            return float((await conn.execute(REPLICA_LAG_SQL)).scalar_one())
+
+    async def _check(self, replica: _Replica) -> None:
+        try:
+            replica.lag = await asyncio.wait_for(
+                self.measure_lag(replica.engine), timeout=self.max_lag
+            )
+        except Exception as e:
+            logging.warning(f"Replica lag check failed: {e}")
+            replica.lag = float("inf")
+
+    async def check_lag(self) -> None:
+        """Measure every replica's lag once."""
+        await asyncio.gather(*(self._check(replica) for replica in self.replicas))
+
+    async def _check_periodically(self) -> None:
+        while True:
+            await self.check_lag()
+            await asyncio.sleep(self.check_interval)
+
+    def _ensure_checking(self) -> None:
+        # A task left over from a loop that has since closed never runs again
+        if (
+            self._checker is None
+            or self._checker.done()
+            or self._checker.get_loop() is not asyncio.get_running_loop()
+        ):
+            self._checker = asyncio.create_task(self._check_periodically())
+
+    async def stop(self) -> None:
+        if self._checker is None:
+            return
+        self._checker.cancel()
+        try:
+            await self._checker
+        except asyncio.CancelledError:
+            pass
+        self._checker = None
+
+    async def choose(self, sticky_keys: Iterable = ()) -> AsyncEngine:
+        if not self.replicas or self.is_sticky(sticky_keys):
+            return self.primary
+        self._ensure_checking()
+        start = self._next
+        self._next = (self._next + 1) % len(self.replicas)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            if replica.lag <= self.max_lag:
+                return replica.engine
+        return self.primary
+
+
+replica_router = ReplicaRouter(engine, replica_engines)
+
+
+def note_write(*keys) -> None:
+    """Record that the given user/chat ids were just written to."""
+    replica_router.note_write(*keys)
+
 
 @asynccontextmanager
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
@@ -64,6 +219,19 @@ async def get_session() -> AsyncGenerator[AsyncSession, None]:
         await session.close()
 
 
+@asynccontextmanager
+async def get_read_session(
+    sticky_keys: Iterable = (),
+) -> AsyncGenerator[AsyncSession, None]:
+    """Context manager that yields a read-only session on a replica if possible."""
+    bind = await replica_router.choose(sticky_keys)
+    session = ReadSessionLocal(bind=bind.execution_options(postgresql_readonly=True))
+    try:
+        yield session
+    finally:
+        await session.close()
+
+
 # Dependency function to use with FastAPI
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
     """Dependency function that yields a database session."""
@@ -71,6 +239,12 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
         yield session
 
 
+async def get_read_db() -> AsyncGenerator[AsyncSession, None]:
+    """Dependency function that yields a read-only (replica) session."""
+    async with get_read_session() as session:
+        yield session
+
+
 async def wait_for_db(max_retries: int = 5, retry_interval: int = 5):
     """Wait for the database to become available."""
     for attempt in range(max_retries):
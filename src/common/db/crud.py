@@ -1,11 +1,22 @@
-from typing import Any, Generic, Optional, Type, TypeVar
+from datetime import datetime, timedelta
+from typing import Generic, Optional, Type, TypeVar
 from uuid import UUID
 
 from pydantic import BaseModel
-from sqlalchemy import select
+from sqlalchemy import REAL, Row, cast, delete, func, literal_column, select, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from common.db.models import Base, Chat, Log, Message, User
+from common.db.ids import uuid7_floor, uuid7_time
+from common.db.models import (
+    SEARCH_CONFIG,
+    Base,
+    Chat,
+    Log,
+    Message,
+    OutboxMessage,
+    ProcessedMessage,
+    User,
+)
 from common.db.schemas import (
     ChatCreate,
     ChatRead,
@@ -13,6 +24,10 @@ from common.db.schemas import (
     LogRead,
     MessageCreate,
     MessageRead,
+    OutboxMessageCreate,
+    OutboxMessageRead,
+    ProcessedMessageCreate,
+    ProcessedMessageRead,
     UserCreate,
     UserRead,
 )
@@ -27,12 +42,20 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, ReadSchemaType]):
         self.model = model
 
     async def get(self, db: AsyncSession, *, id: UUID) -> Optional[ModelType]:
-        result = await db.execute(select(self.model).where(self.model.user_id == id))
+        primary_key = self.model.__mapper__.primary_key[0]
+        result = await db.execute(select(self.model).where(primary_key == id))
         return result.scalar_one_or_none()
 
-    async def create(self, db: AsyncSession, *, obj_in: CreateSchemaType) -> ModelType:
+    async def create(
+        self, db: AsyncSession, *, obj_in: CreateSchemaType, commit: bool = True
+    ) -> ModelType:
+        """Insert a row. With ``commit=False`` it is only flushed, so the caller
+        can add more rows to the same transaction and commit them together."""
         db_obj = self.model(**obj_in.model_dump())
         db.add(db_obj)
+        if not commit:
+            await db.flush()
+            return db_obj
         await db.commit()
         await db.refresh(db_obj)
         return db_obj
@@ -45,11 +68,131 @@ class CRUDUser(CRUDBase[User, UserCreate, UserRead]):
 
 
 class CRUDChat(CRUDBase[Chat, ChatCreate, ChatRead]):
-    pass
+    async def list_for_user(
+        self,
+        db: AsyncSession,
+        *,
+        user_id: UUID,
+        before: Optional[tuple[datetime, UUID]] = None,
+        limit: int = 20,
+    ) -> list[Chat]:
+        """A user's chats, most recently active first.
+
+        Keyset pagination on (last_message_at, chat_id): pass the last row of
+        the previous page as ``before``. Reads only the chats table.
+        """
+        query = select(self.model).where(self.model.user_id == user_id)
+        if before is not None:
+            query = query.where(
+                tuple_(self.model.last_message_at, self.model.chat_id) < before
+            )
+        query = query.order_by(
+            self.model.last_message_at.desc(), self.model.chat_id.desc()
+        ).limit(limit)
+        result = await db.execute(query)
+        return list(result.scalars().all())
 
 
 class CRUDMessage(CRUDBase[Message, MessageCreate, MessageRead]):
-    pass
+    async def get_chat_messages(
+        self,
+        db: AsyncSession,
+        *,
+        chat_id: UUID,
+        after: Optional[UUID] = None,
+        limit: Optional[int] = None,
+        overlap: float = 0,
+    ) -> list[Message]:
+        """Messages of a chat in order, optionally only those after a cursor.
+
+        Message ids are UUIDv7, so the primary key alone gives the order. Ids
+        are generated before their row commits, though, so a message can show
+        up after a newer one was read. With ``overlap``, messages created up
+        to that many seconds before ``after`` are returned again (``after``
+        itself excepted), for callers that skip ids they already have.
+        """
+        query = select(self.model).where(self.model.chat_id == chat_id)
+        if after is not None and overlap > 0 and after.version == 7:
+            since = uuid7_floor(uuid7_time(after) - timedelta(seconds=overlap))
+            query = query.where(
+                self.model.message_id >= since, self.model.message_id != after
+            )
+        elif after is not None:
+            query = query.where(self.model.message_id > after)
+        query = query.order_by(self.model.message_id).limit(limit)
+        result = await db.execute(query)
+        return list(result.scalars().all())
+
+    async def get_many(self, db: AsyncSession, *, ids: list[UUID]) -> list[Message]:
+        """Messages with the given ids, in id order; missing ids are skipped."""
+        if not ids:
+            return []
+        result = await db.execute(
+            select(self.model)
+            .where(self.model.message_id.in_(ids))
+            .order_by(self.model.message_id)
+        )
+        return list(result.scalars().all())
+
+    async def search(
+        self,
+        db: AsyncSession,
+        *,
+        user_id: UUID,
+        query: str,
+        before: Optional[tuple[float, UUID]] = None,
+        limit: int = 20,
+    ) -> list[Row]:
+        """Full-text search over a user's messages, best matches first.
+
+        ``query`` uses web search syntax ("quoted phrases", or, -exclusions).
+        Rows carry message_id, chat_id, user_message, timestamp, rank and a
+        highlighted snippet; headlines are only built for the returned page.
+        Keyset pagination on (rank, message_id): pass the last row's values as
+        ``before``. Archived chats are not searchable.
+        """
+        config = literal_column(f"'{SEARCH_CONFIG}'::regconfig")
+        tsquery = func.websearch_to_tsquery(config, query)
+        rank = func.ts_rank_cd(self.model.search_vector, tsquery).label("rank")
+        matches = select(
+            self.model.message_id,
+            self.model.chat_id,
+            self.model.user_message,
+            self.model.timestamp,
+            self.model.content,
+            rank,
+        ).where(
+            self.model.user_id == user_id,
+            self.model.search_vector.op("@@")(tsquery),
+        )
+        if before is not None:
+            rank_before, message_before = before
+            matches = matches.where(
+                tuple_(rank, self.model.message_id)
+                < tuple_(cast(rank_before, REAL), message_before)
+            )
+        page = (
+            matches.order_by(rank.desc(), self.model.message_id.desc())
+            .limit(limit)
+            .subquery()
+        )
+        snippet = func.ts_headline(
+            config,
+            page.c.content,
+            tsquery,
+            "StartSel=<mark>, StopSel=</mark>, MaxFragments=2, MaxWords=20",
+        ).label("snippet")
+        result = await db.execute(
+            select(
+                page.c.message_id,
+                page.c.chat_id,
+                page.c.user_message,
+                page.c.timestamp,
+                page.c.rank,
+                snippet,
+            ).order_by(page.c.rank.desc(), page.c.message_id.desc())
+        )
+        return list(result.all())
 
 
 class CRUDLog(CRUDBase[Log, LogCreate, LogRead]):
@@ -62,8 +205,42 @@ class CRUDLog(CRUDBase[Log, LogCreate, LogRead]):
         return list(result.scalars().all())
 
 
+class CRUDProcessedMessage(
+    CRUDBase[ProcessedMessage, ProcessedMessageCreate, ProcessedMessageRead]
+):
+    async def seen(self, db: AsyncSession, *, key: str) -> bool:
+        """Whether a reply for this idempotency key has been committed."""
+        result = await db.execute(
+            select(self.model.idempotency_key).where(self.model.idempotency_key == key)
+        )
+        return result.scalar_one_or_none() is not None
+
+
+class CRUDOutbox(CRUDBase[OutboxMessage, OutboxMessageCreate, OutboxMessageRead]):
+    async def next_batch(
+        self, db: AsyncSession, *, limit: int = 100
+    ) -> list[OutboxMessage]:
+        """The oldest unpublished messages, locked until the transaction ends.
+
+        Rows another relay has locked are skipped, so relays in several
+        processes drain the outbox without publishing a row twice.
+        """
+        result = await db.execute(
+            select(self.model)
+            .order_by(self.model.outbox_id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        return list(result.scalars().all())
+
+    async def delete_many(self, db: AsyncSession, *, ids: list[int]) -> None:
+        await db.execute(delete(self.model).where(self.model.outbox_id.in_(ids)))
+
+
 # Instantiate the CRUD objects for shared use
 user = CRUDUser(User)
 chat = CRUDChat(Chat)
 message = CRUDMessage(Message)
 log = CRUDLog(Log)
+processed_message = CRUDProcessedMessage(ProcessedMessage)
+outbox = CRUDOutbox(OutboxMessage)
@@ -0,0 +1,185 @@
+"""Counting and timing the SQL statements run on behalf of one unit of work.
+
+``instrument(engine)`` hooks an engine's cursor events; ``common.db.connect``
+instruments every engine it creates. Statements run inside a
+``track_queries()`` block, in the same task or tasks it starts, are recorded
+in the block's ``QueryStats``: how many, the total time spent in the
+database, how often each distinct statement ran and which were slow. The API
+opens one block per request and the worker one per message. Blocks nest;
+a statement counts towards every enclosing block.
+
+Statements are recorded normalized and never with their parameters: bind
+placeholders and literals become ``?`` and expanded ``IN`` lists collapse to
+``(...)``, so the same query shape is always recorded as the same string.
+
+A statement repeated many times in one unit of work usually means an N+1
+pattern, such as lazily loading a relationship per row; ``repeated()`` lists
+them. ``query_budget()`` fails a block that runs more statements than
+allowed, which is how tests pin the number of queries a code path makes.
+"""
+
+import contextvars
+import logging
+import re
+import time
+import weakref
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Iterator
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+# Slow statements kept per unit of work; all of them are logged
+MAX_SLOW_KEPT = 20
+
+_COMMENTS = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+# asyncpg ($1), psycopg2 (%(name)s, %s) and named (:name, not ::casts)
+_PLACEHOLDERS = re.compile(r"\$\d+|%\(\w+\)s|%s|(?<!:):(?!:)\w+")
+_NUMBERS = re.compile(r"(?<![\w$.])\d+(?:\.\d+)?(?![\w.])")
+# IN lists, and the rows of a multi-row VALUES, of any length
+_LISTS = re.compile(
+    r"\b(IN|VALUES)\s*\(\s*\?(?:\s*,\s*\?)*\s*\)"
+    r"(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))*",
+    re.IGNORECASE,
+)
+_SPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def normalize(statement: str) -> str:
+    """The shape of a statement, without comments, parameters or literals."""
+    statement = _COMMENTS.sub(" ", statement)
+    statement = _STRINGS.sub("?", statement)
+    statement = _PLACEHOLDERS.sub("?", statement)
+    statement = _NUMBERS.sub("?", statement)
+    statement = _LISTS.sub(r"\1 (...)", statement)
+    return _SPACE.sub(" ", statement).strip()
+
+
+@dataclass
+class QueryStats:
+    """The statements one unit of work ran."""
+
+    count: int = 0
+    duration: float = 0.0
+    statements: Counter = field(default_factory=Counter)
+    slow: list[tuple[str, float]] = field(default_factory=list)
+
+    def record(self, statement: str, duration: float, slow: bool) -> None:
+        self.count += 1
+        self.duration += duration
+        self.statements[statement] += 1
+        if slow and len(self.slow) < MAX_SLOW_KEPT:
+            self.slow.append((statement, duration))
+
+    def repeated(self, threshold: int) -> dict[str, int]:
+        """Statements run at least ``threshold`` times, most frequent first."""
+        return {
+            statement: times
+            for statement, times in self.statements.most_common()
+            if times >= threshold
+        }
+
+    def warnings(self, repeat_threshold: int) -> list[str]:
+        """A line for each slow statement and each repeated one."""
+        return [
+            f"slow ({duration * 1000:.1f} ms): {statement}"
+            for statement, duration in self.slow
+        ] + [
+            f"repeated {times}x: {statement}"
+            for statement, times in self.repeated(repeat_threshold).items()
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.count} queries in {self.duration * 1000:.1f} ms"
+
+
+# The QueryStats of every open track_queries() block, innermost last
+_scopes: contextvars.ContextVar[tuple[QueryStats, ...]] = contextvars.ContextVar(
+    "query_scopes", default=()
+)
+
+
+@contextmanager
+def track_queries() -> Iterator[QueryStats]:
+    """Record the statements run inside the block."""
+    stats = QueryStats()
+    token = _scopes.set(_scopes.get() + (stats,))
+    try:
+        yield stats
+    finally:
+        _scopes.reset(token)
+
+
+def record_query(statement: str, duration: float, slow: bool = False) -> None:
+    """Record a statement in every open ``track_queries()`` block."""
+    scopes = _scopes.get()
+    if scopes:
+        shape = normalize(statement)
+        for stats in scopes:
+            stats.record(shape, duration, slow)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@contextmanager
+def query_budget(max_queries: int) -> Iterator[QueryStats]:
+    """Fail if the block runs more than ``max_queries`` statements."""
+    with track_queries() as stats:
+        yield stats
+    if stats.count > max_queries:
+        ran = "\n".join(
+            f"  {times}x {statement}"
+            for statement, times in stats.statements.most_common()
+        )
+        raise QueryBudgetExceeded(
+            f"{stats.count} queries, more than the {max_queries} allowed:\n{ran}"
+        )
+
+
+_instrumented: weakref.WeakSet = weakref.WeakSet()
+
+
+def instrument(engine: AsyncEngine, *, slow_threshold: float) -> None:
+    """Record the statements ``engine`` runs; log those slower than the threshold.
+
+    ``slow_threshold`` is in seconds. Instrumenting an engine twice is a no-op.
+    """
+    sync_engine = engine.sync_engine
+    if sync_engine in _instrumented:
+        return
+    _instrumented.add(sync_engine)
+
+    # Start times live on the connection: statements on one connection never
+    # overlap, while the engine serves many concurrently
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        started = conn.info.get("query_started")
+        if not started:
+            return
+        duration = time.perf_counter() - started.pop()
+        slow = duration >= slow_threshold
+        if slow:
+            logger.warning(
+                f"Slow query ({duration * 1000:.1f} ms): {normalize(statement)}"
+            )
+        record_query(statement, duration, slow)
+
+    def handle_error(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("query_started"):
+            connection.info["query_started"].pop()
+
+    event.listen(sync_engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(sync_engine, "handle_error", handle_error)
@@ -1,11 +1,39 @@
 import uuid
 from datetime import datetime
+from typing import Optional
 
-from sqlalchemy import UUID, Boolean, DateTime, ForeignKey, String, Text
+from sqlalchemy import (
+    DDL,
+    UUID,
+    BigInteger,
+    Boolean,
+    Computed,
+    DateTime,
+    ForeignKey,
+    Identity,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+    Text,
+    event,
+)
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from sqlalchemy.sql import func
 
+from common.db.ids import uuid7
+
+PREVIEW_LENGTH = 200
+IDEMPOTENCY_KEY_LENGTH = 255
+# Text search configuration baked into messages.search_vector
+SEARCH_CONFIG = "english"
+# Notified on every outbox insert; the relay LISTENs on it
+OUTBOX_CHANNEL = "outbox"
+# Notified with the chat id on every message insert; see common.db.notify
+MESSAGES_CHANNEL = "chat_messages"
+
 
 class Base(AsyncAttrs, DeclarativeBase):
     """Base class for all models."""
@@ -35,16 +63,34 @@ class Chat(Base):
     """Chat model."""
 
     __tablename__ = "chats"
-
-    chat_id: Mapped[uuid.UUID] = mapped_column(
-        UUID, primary_key=True, default=uuid.uuid4
+    __table_args__ = (
+        Index("ix_chats_user_id_created_at", "user_id", "created_at"),
+        Index(
+            "ix_chats_user_id_last_message_at", "user_id", "last_message_at", "chat_id"
+        ),
     )
+
+    chat_id: Mapped[uuid.UUID] = mapped_column(UUID, primary_key=True, default=uuid7)
     user_id: Mapped[uuid.UUID] = mapped_column(
         ForeignKey("users.user_id", ondelete="CASCADE")
     )
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), server_default=func.now()
     )
+    # Set once the chat's messages have been moved to cold storage
+    archived_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+    archive_path: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    # Summary of the chat's messages, kept current by the
+    # messages_update_chat_summary trigger on every message insert
+    last_message_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+    message_count: Mapped[int] = mapped_column(Integer, server_default="0")
+    last_message_preview: Mapped[Optional[str]] = mapped_column(
+        String(length=PREVIEW_LENGTH), nullable=True
+    )
 
     # Relationships
     user: Mapped[User] = relationship(back_populates="chats")
@@ -56,10 +102,20 @@ class Message(Base):
     """Message model."""
 
     __tablename__ = "messages"
-
-    message_id: Mapped[uuid.UUID] = mapped_column(
-        UUID, primary_key=True, default=uuid.uuid4
+    __table_args__ = (
+        Index("ix_messages_chat_id_timestamp", "chat_id", "timestamp"),
+        Index("ix_messages_chat_id_message_id", "chat_id", "message_id"),
+        Index("ix_messages_user_id", "user_id"),
+        # GIN on user_id needs btree_gin, created below as in migration 012
+        Index(
+            "ix_messages_user_id_search_vector",
+            "user_id",
+            "search_vector",
+            postgresql_using="gin",
+        ),
     )
+
+    message_id: Mapped[uuid.UUID] = mapped_column(UUID, primary_key=True, default=uuid7)
     chat_id: Mapped[uuid.UUID] = mapped_column(
         ForeignKey("chats.chat_id", ondelete="CASCADE")
     )
@@ -71,6 +127,11 @@ class Message(Base):
     timestamp: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), server_default=func.now()
     )
+    search_vector: Mapped[Optional[str]] = mapped_column(
+        TSVECTOR,
+        Computed(f"to_tsvector('{SEARCH_CONFIG}'::regconfig, content)", persisted=True),
+        deferred=True,
+    )
 
     # Relationships
     chat: Mapped["Chat"] = relationship("Chat", back_populates="messages")
@@ -81,10 +142,12 @@ class Log(Base):
     """Log model for audit trail."""
 
     __tablename__ = "logs"
-
-    log_id: Mapped[uuid.UUID] = mapped_column(
-        UUID, primary_key=True, default=uuid.uuid4
+    __table_args__ = (
+        Index("ix_logs_chat_id_timestamp", "chat_id", "timestamp"),
+        Index("ix_logs_user_id", "user_id"),
     )
+
+    log_id: Mapped[uuid.UUID] = mapped_column(UUID, primary_key=True, default=uuid7)
     user_id: Mapped[uuid.UUID] = mapped_column(
         ForeignKey("users.user_id", ondelete="CASCADE")
     )
@@ -100,3 +163,144 @@ class Log(Base):
     # Relationships
     user: Mapped[User] = relationship(back_populates="logs")
     chat: Mapped[Chat] = relationship(back_populates="logs")
+
+
+class ProcessedMessage(Base):
+    """Inbox of queue messages the worker has already answered.
+
+    A row is written in the same transaction as the reply, so its presence
+    means the reply is committed and a redelivery can be acked without
+    processing it again.
+    """
+
+    __tablename__ = "processed_messages"
+    __table_args__ = (Index("ix_processed_messages_chat_id", "chat_id"),)
+
+    idempotency_key: Mapped[str] = mapped_column(
+        String(length=IDEMPOTENCY_KEY_LENGTH), primary_key=True
+    )
+    chat_id: Mapped[uuid.UUID] = mapped_column(
+        ForeignKey("chats.chat_id", ondelete="CASCADE")
+    )
+    # The assistant message written for it; messages is partitioned, so no FK
+    reply_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID, nullable=True)
+    processed_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+
+
+class OutboxMessage(Base):
+    """Queue message waiting to be published.
+
+    Written in the same transaction as the change that produced it, so the
+    message is published if and only if the change commits. The outbox relay
+    publishes rows in ``outbox_id`` order and deletes them once the broker has
+    confirmed them.
+    """
+
+    __tablename__ = "outbox"
+
+    outbox_id: Mapped[int] = mapped_column(BigInteger, Identity(), primary_key=True)
+    queue: Mapped[str] = mapped_column(String(length=255), nullable=False)
+    body: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    headers: Mapped[dict] = mapped_column(JSONB, nullable=False, default=dict)
+    content_type: Mapped[Optional[str]] = mapped_column(String(length=255))
+    content_encoding: Mapped[Optional[str]] = mapped_column(String(length=255))
+    correlation_id: Mapped[Optional[str]] = mapped_column(String(length=255))
+    reply_to: Mapped[Optional[str]] = mapped_column(String(length=255))
+    message_id: Mapped[Optional[str]] = mapped_column(String(length=255))
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+
+
+# Mirrors migration 006 so schemas created from metadata behave the same
+event.listen(
+    Message.__table__,
+    "after_create",
+    DDL(
+        f"""
+        CREATE OR REPLACE FUNCTION chats_on_message_insert() RETURNS trigger AS $$
+        BEGIN
+            UPDATE chats SET
+                message_count = message_count + 1,
+                last_message_preview = CASE
+                    WHEN NEW."timestamp" >= last_message_at
+                    THEN left(NEW.content, {PREVIEW_LENGTH})
+                    ELSE last_message_preview
+                END,
+                last_message_at = GREATEST(last_message_at, NEW."timestamp")
+            WHERE chat_id = NEW.chat_id;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    ).execute_if(dialect="postgresql"),
+)
+# A separate statement: asyncpg cannot run several commands in one
+event.listen(
+    Message.__table__,
+    "after_create",
+    DDL(
+        """
+        CREATE TRIGGER messages_update_chat_summary AFTER INSERT ON messages
+        FOR EACH ROW EXECUTE FUNCTION chats_on_message_insert()
+        """
+    ).execute_if(dialect="postgresql"),
+)
+# Mirrors migration 011: wakes ChatEvents listeners when the insert commits
+event.listen(
+    Message.__table__,
+    "after_create",
+    DDL(
+        f"""
+        CREATE OR REPLACE FUNCTION messages_notify() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('{MESSAGES_CHANNEL}', NEW.chat_id::text);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    ).execute_if(dialect="postgresql"),
+)
+event.listen(
+    Message.__table__,
+    "after_create",
+    DDL(
+        """
+        CREATE TRIGGER messages_notify AFTER INSERT ON messages
+        FOR EACH ROW EXECUTE FUNCTION messages_notify()
+        """
+    ).execute_if(dialect="postgresql"),
+)
+# Mirrors migration 012
+event.listen(
+    Message.__table__,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS btree_gin").execute_if(dialect="postgresql"),
+)
+# Mirrors migration 009
+event.listen(
+    OutboxMessage.__table__,
+    "after_create",
+    DDL(
+        f"""
+        CREATE OR REPLACE FUNCTION outbox_notify() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('{OUTBOX_CHANNEL}', '');
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    ).execute_if(dialect="postgresql"),
+)
+event.listen(
+    OutboxMessage.__table__,
+    "after_create",
+    DDL(
+        """
+        CREATE TRIGGER outbox_notify AFTER INSERT ON outbox
+        FOR EACH STATEMENT EXECUTE FUNCTION outbox_notify()
+        """
+    ).execute_if(dialect="postgresql"),
+)
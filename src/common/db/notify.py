@@ -0,0 +1,176 @@
+"""Postgres LISTEN/NOTIFY: a listening connection and chat message fan-out.
+
+An insert trigger on ``messages`` NOTIFYs the ``chat_messages`` channel with
+the chat id when the inserting transaction commits. Each API process holds
+one LISTEN connection (``ChatEvents``) and wakes the requests waiting on that
+chat, so a client long-polling for new messages costs nothing while the chat
+is idle and sees a reply as soon as it is committed.
+
+Notifications are not queued while the LISTEN connection is down. Waiters
+then fall back to checking every ``poll_interval`` seconds until the
+connection is back.
+"""
+
+import asyncio
+import logging
+import os
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from common.db.models import MESSAGES_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+
+class Listener:
+    """A dedicated connection LISTENing on one channel.
+
+    ``callback`` gets each notification's payload string.
+    """
+
+    def __init__(
+        self, engine: AsyncEngine, channel: str, callback: Callable[[str], Any]
+    ):
+        self.engine = engine
+        self.channel = channel
+        self.callback = callback
+        self._connection: Optional[AsyncConnection] = None
+        self._driver: Any = None
+
+    @property
+    def listening(self) -> bool:
+        return self._driver is not None and not self._driver.is_closed()
+
+    async def start(self) -> bool:
+        """(Re)connect and LISTEN; returns whether that succeeded."""
+        await self.stop()
+        connection = None
+        try:
+            connection = await self.engine.connect()
+            raw = await connection.get_raw_connection()
+            await raw.driver_connection.add_listener(self.channel, self._notified)
+        except Exception as e:
+            logger.warning(f"Cannot LISTEN on {self.channel}: {e}")
+            if connection is not None:
+                await connection.invalidate()
+            return False
+        self._connection, self._driver = connection, raw.driver_connection
+        return True
+
+    async def stop(self) -> None:
+        if self._connection is None:
+            return
+        connection, driver = self._connection, self._driver
+        self._connection = self._driver = None
+        if driver.is_closed():
+            await connection.invalidate()
+            return
+        await driver.remove_listener(self.channel, self._notified)
+        await connection.close()
+
+    def _notified(self, connection: Any, pid: int, channel: str, payload: str):
+        self.callback(payload)
+
+
+class ChatEvents:
+    """Wakes requests waiting for new messages in a chat."""
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        *,
+        poll_interval: float = 1.0,
+        reconnect_interval: float = 5.0,
+    ):
+        self.poll_interval = poll_interval
+        self.reconnect_interval = reconnect_interval
+        self._listener = Listener(engine, MESSAGES_CHANNEL, self.publish)
+        self._waiters: dict[str, set[asyncio.Event]] = {}
+        self._watching: Optional[asyncio.Task] = None
+
+    @property
+    def listening(self) -> bool:
+        return self._listener.listening
+
+    @property
+    def waiting(self) -> int:
+        """Requests currently subscribed to some chat."""
+        return sum(len(events) for events in self._waiters.values())
+
+    async def start(self) -> None:
+        await self._listener.start()
+        self._watching = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        if self._watching is not None:
+            self._watching.cancel()
+            try:
+                await self._watching
+            except asyncio.CancelledError:
+                pass
+            self._watching = None
+        await self._listener.stop()
+        self._wake_all()
+
+    @contextmanager
+    def subscribe(self, chat_id: Any) -> Iterator[asyncio.Event]:
+        """An event set whenever a message is committed to ``chat_id``.
+
+        Subscribe before reading the chat, so a message committed between the
+        read and the wait is not missed.
+        """
+        key = str(chat_id)
+        event = asyncio.Event()
+        self._waiters.setdefault(key, set()).add(event)
+        try:
+            yield event
+        finally:
+            events = self._waiters.get(key)
+            if events is not None:
+                events.discard(event)
+                if not events:
+                    del self._waiters[key]
+
+    async def wait(self, event: asyncio.Event, timeout: float) -> bool:
+        """Wait up to ``timeout`` seconds; returns whether to read the chat again.
+
+        Without a LISTEN connection this returns after ``poll_interval``
+        seconds at most, so callers fall back to polling.
+        """
+        listening = self.listening
+        if not listening:
+            timeout = min(timeout, self.poll_interval)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return not listening
+        event.clear()
+        return True
+
+    def publish(self, chat_id: str) -> None:
+        """Wake the waiters of ``chat_id``; called for every notification."""
+        for event in self._waiters.get(chat_id, ()):
+            event.set()
+
+    def _wake_all(self) -> None:
+        for events in self._waiters.values():
+            for event in events:
+                event.set()
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.reconnect_interval)
+            if not self.listening:
+                # Anything committed while disconnected was not notified
+                self._wake_all()
+                await self._listener.start()
+
+
+def chat_events_from_env() -> ChatEvents:
+    from common.db.connect import engine
+
+    return ChatEvents(
+        engine, poll_interval=float(os.getenv("CHAT_EVENTS_POLL_INTERVAL", "1.0"))
+    )
@@ -39,6 +39,12 @@ class ChatRead(ChatBase):
         from_attributes = True
 
 
+class ChatSummary(ChatRead):
+    last_message_at: datetime
+    message_count: int
+    last_message_preview: Optional[str] = None
+
+
 # ----- Message Schemas -----
 class MessageBase(BaseModel):
     chat_id: UUID
@@ -77,3 +83,45 @@ class LogRead(LogBase):
 
     class Config:
         from_attributes = True
+
+
+# ----- Processed Message Schemas -----
+class ProcessedMessageBase(BaseModel):
+    idempotency_key: str
+    chat_id: UUID
+    reply_id: Optional[UUID] = None
+
+
+class ProcessedMessageCreate(ProcessedMessageBase):
+    pass
+
+
+class ProcessedMessageRead(ProcessedMessageBase):
+    processed_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+# ----- Outbox Schemas -----
+class OutboxMessageBase(BaseModel):
+    queue: str
+    body: bytes
+    headers: dict = Field(default_factory=dict)
+    content_type: Optional[str] = None
+    content_encoding: Optional[str] = None
+    correlation_id: Optional[str] = None
+    reply_to: Optional[str] = None
+    message_id: Optional[str] = None
+
+
+class OutboxMessageCreate(OutboxMessageBase):
+    pass
+
+
+class OutboxMessageRead(OutboxMessageBase):
+    outbox_id: int
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
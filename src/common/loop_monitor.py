@@ -0,0 +1,131 @@
+"""Event loop lag measurement and blocking-call detection.
+
+A ``LoopMonitor`` runs a task that sleeps ``interval`` seconds at a time and
+measures how late each wakeup is: the loop's scheduling lag, i.e. how long a
+ready callback waits behind whatever else the loop is running. Each
+measurement is passed to ``on_lag`` (the API observes it into a histogram).
+
+A watchdog thread checks that the task keeps waking up. When it has not for
+``block_threshold`` seconds past its due time, the loop is stuck in a single
+callback, typically a blocking call (a sync HTTP client, ``time.sleep``,
+heavy CPU work) made from async code. The watchdog then logs the loop
+thread's current stack, which points at the offending code while it is
+still running, and the monitor logs the total stall once the loop is back.
+Like asyncio's debug mode, but with the culprit's stack rather than just the
+handle, and cheap enough for production: one short sleep on the loop and
+one thread wakeup per ``interval``.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Where the loop runs each ready callback (Handle._run)
+_EVENTS_FILE = os.path.join("asyncio", "events.py")
+
+
+class LoopMonitor:
+    """Measures the running loop's lag and reports where it blocks."""
+
+    def __init__(
+        self,
+        *,
+        interval: float = 0.1,
+        block_threshold: float = 0.25,
+        on_lag: Optional[Callable[[float], None]] = None,
+    ):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.on_lag = on_lag
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._loop_thread: Optional[int] = None
+        # When the monitor task is next due to wake up, and the stall of that
+        # wakeup the watchdog already reported, if any
+        self._due = 0.0
+        self._reported_due: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._due = time.monotonic() + self.interval
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._measure())
+        if self.block_threshold > 0:
+            self._watchdog = threading.Thread(
+                target=self._watch, name="loop-watchdog", daemon=True
+            )
+            self._watchdog.start()
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._stopping.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._watchdog is not None:
+            await asyncio.to_thread(self._watchdog.join)
+            self._watchdog = None
+
+    async def _measure(self) -> None:
+        while True:
+            self._due = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - self._due)
+            if self.block_threshold > 0 and lag >= self.block_threshold:
+                logger.warning(f"Event loop was blocked for {lag * 1000:.0f} ms")
+            if self.on_lag is not None:
+                self.on_lag(lag)
+
+    def _watch(self) -> None:
+        # Checking at half the threshold reports a stall within 1.5 thresholds
+        check_interval = min(self.interval, self.block_threshold / 2)
+        while not self._stopping.wait(check_interval):
+            due = self._due
+            stalled = time.monotonic() - due
+            if stalled < self.block_threshold or self._reported_due == due:
+                continue
+            self._reported_due = due
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stack = "".join(traceback.format_list(_callback_stack(frame)))
+            logger.warning(
+                f"Event loop blocked for {stalled * 1000:.0f} ms so far, in:\n{stack}"
+            )
+
+
+def _callback_stack(frame) -> traceback.StackSummary:
+    """The stack of the running callback, without the loop machinery above it."""
+    stack = traceback.extract_stack(frame)
+    for i in range(len(stack) - 1, -1, -1):
+        if stack[i].name == "_run" and stack[i].filename.endswith(_EVENTS_FILE):
+            return traceback.StackSummary.from_list(stack[i + 1 :])
+    return stack
+
+
+def loop_monitor_from_env(
+    on_lag: Optional[Callable[[float], None]] = None,
+) -> LoopMonitor:
+    return LoopMonitor(
+        interval=float(os.getenv("LOOP_MONITOR_INTERVAL", "0.1")),
+        block_threshold=float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "250")) / 1000,
+        on_lag=on_lag,
+    )
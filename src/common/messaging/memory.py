@@ -0,0 +1,157 @@
+"""In-process asyncio message broker.
+
+Queues are plain asyncio queues in a ``Broker``. Every ``InMemoryTransport``
+made by ``transport_from_env()`` shares one module-level broker, so an API and
+a worker running in the same process and event loop reach each other. The
+semantics follow RabbitMQ where the code here depends on them:
+
+- A consumer holds at most ``prefetch`` unsettled deliveries.
+- ``nack(requeue=True)`` puts the message back with ``redelivered`` set.
+- Leaving a consumer's context returns its unsettled deliveries to the queue.
+  Settling them afterwards raises, as it would on a closed channel.
+- Delayed messages are held by loop timers.
+
+Unlike RabbitMQ, publishing to an unknown queue creates it. Messages live
+only as long as the process.
+"""
+
+import asyncio
+import logging
+import uuid
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Optional
+
+from common.messaging.transport import Delivery, OutgoingMessage, Transport
+
+logger = logging.getLogger(__name__)
+
+
+class MessageSettled(RuntimeError):
+    """The delivery was already acked, nacked or returned to its queue."""
+
+
+class MemoryDelivery(Delivery):
+    def __init__(
+        self,
+        message: OutgoingMessage,
+        redelivered: bool,
+        requeue: Callable[[OutgoingMessage], None],
+    ):
+        self.message = message
+        self.body = message.body
+        self.headers = message.headers
+        self.content_type = message.content_type
+        self.content_encoding = message.content_encoding
+        self.correlation_id = message.correlation_id
+        self.reply_to = message.reply_to
+        self.message_id = message.message_id
+        self.priority = message.priority
+        self.redelivered = redelivered
+        self.settled = False
+        self._requeue = requeue
+        self._on_settle: Optional[Callable[["MemoryDelivery"], None]] = None
+
+    def _settle(self) -> None:
+        if self.settled:
+            raise MessageSettled("Delivery already settled")
+        self.settled = True
+        if self._on_settle is not None:
+            self._on_settle(self)
+
+    async def ack(self) -> None:
+        self._settle()
+
+    async def nack(self, requeue: bool = True) -> None:
+        self._settle()
+        if requeue:
+            self._requeue(self.message)
+
+
+class Broker:
+    """Named queues of (message, redelivered) pairs."""
+
+    def __init__(self):
+        self.queues: dict[str, asyncio.Queue] = {}
+
+    def queue(self, name: str) -> asyncio.Queue:
+        if name not in self.queues:
+            self.queues[name] = asyncio.Queue()
+        return self.queues[name]
+
+    def put(self, name: str, message: OutgoingMessage, redelivered=False) -> None:
+        self.queue(name).put_nowait((message, redelivered))
+
+    def delivery(self, name: str, message, redelivered) -> MemoryDelivery:
+        return MemoryDelivery(
+            message, redelivered, lambda m: self.put(name, m, redelivered=True)
+        )
+
+    def depth(self, name: str) -> int:
+        return self.queue(name).qsize()
+
+
+shared_broker = Broker()
+
+
+class InMemoryTransport(Transport):
+    def __init__(self, broker: Optional[Broker] = None):
+        self.broker = broker if broker is not None else Broker()
+
+    async def connect(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def declare_queue(self, name: str) -> None:
+        self.broker.queue(name)
+
+    async def declare_callback_queue(self) -> str:
+        name = f"amq.gen-{uuid.uuid4().hex}"
+        self.broker.queue(name)
+        return name
+
+    async def publish(
+        self, queue: str, message: OutgoingMessage, *, delay: float = 0
+    ) -> None:
+        if delay > 0:
+            asyncio.get_running_loop().call_later(
+                delay, self.broker.put, queue, message
+            )
+        else:
+            self.broker.put(queue, message)
+
+    @asynccontextmanager
+    async def consume(
+        self, queue: str, *, prefetch: int
+    ) -> AsyncIterator[AsyncIterator[MemoryDelivery]]:
+        source = self.broker.queue(queue)
+        credit = asyncio.Semaphore(prefetch)
+        unsettled: set[MemoryDelivery] = set()
+
+        def settled(delivery: MemoryDelivery) -> None:
+            unsettled.discard(delivery)
+            credit.release()
+
+        async def deliveries() -> AsyncIterator[MemoryDelivery]:
+            while True:
+                await credit.acquire()
+                message, redelivered = await source.get()
+                delivery = self.broker.delivery(queue, message, redelivered)
+                delivery._on_settle = settled
+                unsettled.add(delivery)
+                yield delivery
+
+        try:
+            yield deliveries()
+        finally:
+            for delivery in list(unsettled):
+                delivery.settled = True
+                self.broker.put(queue, delivery.message, redelivered=True)
+
+    async def get(self, queue: str) -> Optional[MemoryDelivery]:
+        try:
+            message, redelivered = self.broker.queue(queue).get_nowait()
+        except asyncio.QueueEmpty:
+            return None
+        return self.broker.delivery(queue, message, redelivered)
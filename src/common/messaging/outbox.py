@@ -0,0 +1,176 @@
+"""Transactional outbox: queue messages committed with the rows they announce.
+
+Publishing to the broker from a request handler after a commit can lose the
+message (the process dies, the broker is down) and makes the request wait on
+the broker. Instead the handler adds the message to the ``outbox`` table with
+``enqueue()`` in the same transaction as its other writes, and an
+``OutboxRelay`` publishes it afterwards:
+
+1. Lock the oldest ``batch_size`` rows (``FOR UPDATE SKIP LOCKED``, so relays
+   in several processes share the work).
+2. Publish them and wait for the broker's publisher confirms.
+3. Delete them and commit.
+
+A relay that dies between 2 and 3 publishes the batch again after restart.
+Consumers deduplicate by ``message_id`` (the worker's inbox does), so each
+message is handed off exactly once in effect.
+
+The relay sleeps until an insert trigger NOTIFYs the ``outbox`` channel on
+commit, checking every ``LISTENING_POLL_INTERVAL`` seconds anyway in case a
+notification was missed while reconnecting. Without a LISTEN connection it
+polls every ``poll_interval`` seconds and tries to listen again.
+"""
+
+import asyncio
+import logging
+import os
+from typing import Any, Optional
+
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+
+from common.db import crud
+from common.db.models import OUTBOX_CHANNEL, OutboxMessage
+from common.db.notify import Listener
+from common.messaging.transport import OutgoingMessage, Transport
+
+logger = logging.getLogger(__name__)
+
+LISTENING_POLL_INTERVAL = 30.0
+
+
+def enqueue(db: AsyncSession, queue: str, message: OutgoingMessage) -> OutboxMessage:
+    """Add a message to the outbox; it is published once ``db`` commits."""
+    row = OutboxMessage(
+        queue=queue,
+        body=message.body,
+        headers=message.headers,
+        content_type=message.content_type,
+        content_encoding=message.content_encoding,
+        correlation_id=message.correlation_id,
+        reply_to=message.reply_to,
+        message_id=message.message_id,
+    )
+    db.add(row)
+    return row
+
+
+def outgoing(row: OutboxMessage) -> OutgoingMessage:
+    return OutgoingMessage(
+        row.body,
+        headers=dict(row.headers or {}),
+        content_type=row.content_type,
+        content_encoding=row.content_encoding,
+        correlation_id=row.correlation_id,
+        reply_to=row.reply_to,
+        message_id=row.message_id,
+    )
+
+
+class OutboxRelay:
+    """Moves committed outbox rows to the transport in batches."""
+
+    def __init__(
+        self,
+        transport: Transport,
+        engine: AsyncEngine,
+        *,
+        batch_size: int = 100,
+        poll_interval: float = 1.0,
+    ):
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self.transport = transport
+        self.engine = engine
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._sessions = async_sessionmaker(engine, expire_on_commit=False)
+        self._wakeup = asyncio.Event()
+        self._listener = Listener(engine, OUTBOX_CHANNEL, self._notified)
+        self._running: Optional[asyncio.Task] = None
+
+    @property
+    def listening(self) -> bool:
+        return self._listener.listening
+
+    async def start(self) -> None:
+        await self.transport.connect()
+        await self._listen()
+        self._running = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._running is not None:
+            self._running.cancel()
+            try:
+                await self._running
+            except asyncio.CancelledError:
+                pass
+            self._running = None
+        await self._unlisten()
+
+    def wake(self) -> None:
+        """Look for new rows now instead of waiting for a notification."""
+        self._wakeup.set()
+
+    async def relay_once(self) -> int:
+        """Publish and delete one batch; returns how many rows it held."""
+        async with self._sessions() as db:
+            rows = await crud.outbox.next_batch(db, limit=self.batch_size)
+            if not rows:
+                return 0
+            await self.transport.publish_batch(
+                [(row.queue, outgoing(row)) for row in rows]
+            )
+            await crud.outbox.delete_many(db, ids=[row.outbox_id for row in rows])
+            await db.commit()
+        return len(rows)
+
+    async def drain(self) -> int:
+        """Relay batches until the outbox is empty; returns rows published."""
+        total = 0
+        while True:
+            published = await self.relay_once()
+            total += published
+            if published < self.batch_size:
+                return total
+
+    async def _run(self) -> None:
+        while True:
+            # Cleared before draining: a commit notified mid-drain runs again
+            self._wakeup.clear()
+            try:
+                published = await self.drain()
+                if published:
+                    logger.debug("Relayed %d outbox messages", published)
+            except Exception as e:
+                # The rows stay in the outbox; retry after the poll interval
+                logger.error(f"Outbox relay failed: {e}")
+            if not self.listening:
+                await self._listen()
+            timeout = self.poll_interval
+            if self.listening:
+                timeout = max(timeout, LISTENING_POLL_INTERVAL)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _notified(self, *args: Any) -> None:
+        self._wakeup.set()
+
+    async def _listen(self) -> None:
+        if not await self._listener.start():
+            logger.warning("Polling the outbox until LISTEN succeeds")
+
+    async def _unlisten(self) -> None:
+        await self._listener.stop()
+
+
+def outbox_relay_from_env(transport: Transport) -> OutboxRelay:
+    from common.db.connect import engine
+
+    return OutboxRelay(
+        transport,
+        engine,
+        batch_size=int(os.getenv("OUTBOX_BATCH_SIZE", "100")),
+        poll_interval=float(os.getenv("OUTBOX_POLL_INTERVAL", "1.0")),
+    )
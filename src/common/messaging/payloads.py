@@ -0,0 +1,265 @@
+"""Versioned queue payloads and their wire encoding.
+
+Payloads are dataclasses (``ChatRequest``, ``ChatReply``). On the wire each is
+a map of its fields plus ``"v"``, the schema version; fields that are ``None``
+are left out. A consumer decodes the body straight into the dataclass it
+expects, with fields type-checked, unknown fields ignored and a version it
+does not know rejected. Bodies without ``"v"`` are version 1, which is what
+producers sent before payloads were versioned.
+
+The encoding travels in the AMQP properties:
+
+- ``content_type`` is ``application/msgpack`` or ``application/json``.
+  Messages without one are JSON, as older producers sent them.
+- ``content_encoding`` is ``zstd`` when the body was compressed. Bodies of at
+  least ``compress_threshold`` bytes are compressed if that makes them
+  smaller.
+- A request lists the formats its sender reads, preferred first, in the
+  ``x-accept`` header; the reply uses the first one the replier can write,
+  otherwise the request's own format.
+
+MessagePack is smaller and faster to encode than JSON for these payloads (see
+``scripts/bench_payloads.py``). Producers write ``PAYLOAD_FORMAT``; during a
+rolling upgrade keep it at ``json`` until every consumer can read MessagePack.
+"""
+
+import dataclasses
+import functools
+import json
+import os
+from typing import (
+    Any,
+    ClassVar,
+    Optional,
+    Type,
+    TypeVar,
+    Union,
+    get_args,
+    get_origin,
+    get_type_hints,
+)
+
+import msgpack
+import zstandard
+
+from common.messaging.transport import OutgoingMessage
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+FORMATS = {"json": JSON, "msgpack": MSGPACK}
+ZSTD = "zstd"
+ACCEPT_HEADER = "x-accept"
+VERSION_KEY = "v"
+
+P = TypeVar("P", bound="Payload")
+
+
+class PayloadError(ValueError):
+    """A message body that cannot be decoded into the expected payload."""
+
+
+class Payload:
+    """Base class for payload dataclasses."""
+
+    VERSION: ClassVar[int] = 1
+
+    def to_dict(self) -> dict[str, Any]:
+        data: dict[str, Any] = {VERSION_KEY: self.VERSION}
+        for field in dataclasses.fields(self):
+            value = getattr(self, field.name)
+            if value is not None:
+                data[field.name] = value
+        return data
+
+    @classmethod
+    def from_dict(cls: Type[P], data: Any) -> P:
+        if not isinstance(data, dict):
+            raise PayloadError(f"{cls.__name__} payload is not a map")
+        version = data.get(VERSION_KEY, 1)
+        if version != cls.VERSION:
+            raise PayloadError(f"Unsupported {cls.__name__} version: {version!r}")
+        hints = _type_hints(cls)
+        values = {}
+        for field in dataclasses.fields(cls):
+            if field.name not in data:
+                if (
+                    field.default is dataclasses.MISSING
+                    and field.default_factory is dataclasses.MISSING
+                ):
+                    raise PayloadError(f"{cls.__name__} is missing {field.name!r}")
+                continue
+            value = data[field.name]
+            if not _matches(value, hints[field.name]):
+                raise PayloadError(
+                    f"{cls.__name__}.{field.name} has the wrong type: "
+                    f"{type(value).__name__}"
+                )
+            values[field.name] = value
+        return cls(**values)
+
+
+@functools.lru_cache(maxsize=None)
+def _type_hints(cls: type) -> dict[str, Any]:
+    return get_type_hints(cls)
+
+
+def _matches(value: Any, hint: Any) -> bool:
+    if get_origin(hint) is Union:
+        return any(_matches(value, arg) for arg in get_args(hint))
+    if hint is type(None):
+        return value is None
+    if hint is bool:
+        return isinstance(value, bool)
+    # bool is an int, but an int field must not accept True
+    return isinstance(value, hint) and not isinstance(value, bool)
+
+
+@dataclasses.dataclass
+class ChatRequest(Payload):
+    """A chat message for the worker to answer."""
+
+    chat_id: str
+    content: str
+    user_id: Optional[str] = None
+    message_id: Optional[str] = None
+    user_message: bool = True
+    idempotency_key: Optional[str] = None
+
+
+@dataclasses.dataclass
+class ChatReply(Payload):
+    """The worker's committed answer to a ChatRequest."""
+
+    message_id: str
+    chat_id: str
+    content: str
+
+
+def _media_type(content_type: Optional[str]) -> str:
+    if not content_type:
+        return JSON
+    return content_type.split(";")[0].strip().lower()
+
+
+class PayloadCodec:
+    """Encodes payloads as ``content_type`` and decodes any supported format."""
+
+    def __init__(
+        self,
+        content_type: str = MSGPACK,
+        *,
+        compress_threshold: Optional[int] = 1024,
+        compression_level: int = 3,
+    ):
+        if content_type not in FORMATS.values():
+            raise ValueError(f"Unsupported content type: {content_type}")
+        self.content_type = content_type
+        self.compress_threshold = compress_threshold
+        self._compressor = zstandard.ZstdCompressor(level=compression_level)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    @property
+    def accept(self) -> str:
+        """The ``x-accept`` header value: this codec's format first."""
+        others = [t for t in FORMATS.values() if t != self.content_type]
+        return ", ".join([self.content_type, *others])
+
+    def encode(
+        self,
+        payload: Union[Payload, dict[str, Any]],
+        content_type: Optional[str] = None,
+    ) -> tuple[bytes, str, Optional[str]]:
+        """The body, content type and content encoding for a payload."""
+        data = payload.to_dict() if isinstance(payload, Payload) else payload
+        content_type = content_type or self.content_type
+        if content_type == MSGPACK:
+            body = msgpack.packb(data, use_bin_type=True, default=str)
+        elif content_type == JSON:
+            body = json.dumps(data, separators=(",", ":"), default=str).encode()
+        else:
+            raise ValueError(f"Unsupported content type: {content_type}")
+        if self.compress_threshold is not None and len(body) >= self.compress_threshold:
+            compressed = self._compressor.compress(body)
+            if len(compressed) < len(body):
+                return compressed, content_type, ZSTD
+        return body, content_type, None
+
+    def message(
+        self,
+        payload: Union[Payload, dict[str, Any]],
+        *,
+        content_type: Optional[str] = None,
+        **properties: Any,
+    ) -> OutgoingMessage:
+        """An OutgoingMessage carrying ``payload`` and its encoding properties."""
+        body, content_type, content_encoding = self.encode(payload, content_type)
+        return OutgoingMessage(
+            body,
+            content_type=content_type,
+            content_encoding=content_encoding,
+            **properties,
+        )
+
+    def request(
+        self, payload: Union[Payload, dict[str, Any]], **properties: Any
+    ) -> OutgoingMessage:
+        """Like ``message``, also telling the replier which formats we read."""
+        message = self.message(payload, **properties)
+        message.headers[ACCEPT_HEADER] = self.accept
+        return message
+
+    def decode_data(
+        self,
+        body: bytes,
+        content_type: Optional[str],
+        content_encoding: Optional[str] = None,
+    ) -> Any:
+        """The decoded body as plain data (maps, lists, strings, numbers)."""
+        if content_encoding == ZSTD:
+            try:
+                body = self._decompressor.decompress(body)
+            except zstandard.ZstdError as e:
+                raise PayloadError(f"Corrupt zstd body: {e}") from e
+        elif content_encoding not in (None, "", "identity"):
+            raise PayloadError(f"Unsupported content encoding: {content_encoding}")
+        media_type = _media_type(content_type)
+        try:
+            if media_type == MSGPACK:
+                return msgpack.unpackb(body, raw=False)
+            if media_type == JSON:
+                return json.loads(body.decode())
+        except (ValueError, msgpack.UnpackException) as e:
+            # JSONDecodeError, UnicodeDecodeError and msgpack's errors
+            raise PayloadError(f"Unreadable {media_type} body: {e}") from e
+        raise PayloadError(f"Unsupported content type: {content_type}")
+
+    def decode(self, message: Any, payload_type: Optional[Type[P]] = None) -> Any:
+        """Decode a delivery's body, into ``payload_type`` if given."""
+        data = self.decode_data(
+            message.body,
+            getattr(message, "content_type", None),
+            getattr(message, "content_encoding", None),
+        )
+        return data if payload_type is None else payload_type.from_dict(data)
+
+    def reply_format(self, request: Any) -> str:
+        """The content type to answer ``request`` in."""
+        headers = getattr(request, "headers", None) or {}
+        accepted = str(headers.get(ACCEPT_HEADER) or "").split(",")
+        for content_type in map(_media_type, filter(str.strip, accepted)):
+            if content_type in FORMATS.values():
+                return content_type
+        content_type = _media_type(getattr(request, "content_type", None))
+        return content_type if content_type in FORMATS.values() else JSON
+
+
+def payload_codec_from_env() -> PayloadCodec:
+    name = os.getenv("PAYLOAD_FORMAT", "msgpack")
+    if name not in FORMATS:
+        raise ValueError(f"Unknown PAYLOAD_FORMAT: {name}")
+    threshold = int(os.getenv("PAYLOAD_COMPRESS_THRESHOLD", "1024"))
+    return PayloadCodec(
+        FORMATS[name],
+        compress_threshold=threshold if threshold > 0 else None,
+        compression_level=int(os.getenv("PAYLOAD_ZSTD_LEVEL", "3")),
+    )
@@ -0,0 +1,149 @@
+"""RabbitMQ transport on aio-pika.
+
+Publishing goes through a small pool of channels, so concurrent publishers do
+not serialize on one channel. Channels use publisher confirms: ``publish``
+returns once the broker has taken responsibility for the message, and a batch
+is published on one channel with its confirms awaited together. Each consumer
+gets a channel of its own, with its own prefetch limit.
+
+Delayed messages go to a TTL queue per queue and delay,
+``<queue>.retry.<delay>s``. It has no consumers and dead-letters each message
+back to ``<queue>`` when the TTL expires. These queues are declared on first
+use, so keep the set of delays small and fixed.
+"""
+
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Sequence
+
+import aio_pika
+from aio_pika.abc import AbstractChannel, AbstractRobustConnection
+from aio_pika.pool import Pool
+
+from common.messaging.transport import Delivery, OutgoingMessage, Transport
+
+logger = logging.getLogger(__name__)
+
+
+def rabbitmq_url_from_env() -> str:
+    host = os.getenv("RABBITMQ_HOST", "localhost")
+    port = os.getenv("RABBITMQ_PORT", "5672")
+    user = os.getenv("RABBITMQ_USER", "guest")
+    password = os.getenv("RABBITMQ_PASS", "guest")
+    return f"amqp://{user}:{password}@{host}:{port}/"
+
+
+def delay_queue(queue: str, delay: float) -> str:
+    return f"{queue}.retry.{delay:g}s"
+
+
+def _amqp_message(message: OutgoingMessage) -> aio_pika.Message:
+    return aio_pika.Message(
+        message.body,
+        headers=message.headers,
+        content_type=message.content_type,
+        content_encoding=message.content_encoding,
+        correlation_id=message.correlation_id,
+        reply_to=message.reply_to,
+        message_id=message.message_id,
+        priority=message.priority,
+        delivery_mode=(
+            aio_pika.DeliveryMode.PERSISTENT
+            if message.persistent
+            else aio_pika.DeliveryMode.NOT_PERSISTENT
+        ),
+    )
+
+
+class RabbitMQTransport(Transport):
+    def __init__(self, url: str, *, channel_pool_size: int = 4):
+        self.url = url
+        self.channel_pool_size = channel_pool_size
+        self._connection: Optional[AbstractRobustConnection] = None
+        self._channels: Optional[Pool[AbstractChannel]] = None
+        self._delay_queues: set[str] = set()
+
+    async def connect(self) -> None:
+        if self._connection is not None:
+            return
+        self._connection = await aio_pika.connect_robust(self.url)
+        self._channels = Pool(self._channel, max_size=self.channel_pool_size)
+
+    async def _channel(self) -> AbstractChannel:
+        return await self._connection.channel(publisher_confirms=True)
+
+    async def close(self) -> None:
+        if self._connection is None:
+            return
+        await self._channels.close()
+        await self._connection.close()
+        self._connection = self._channels = None
+        self._delay_queues.clear()
+
+    async def declare_queue(self, name: str) -> None:
+        async with self._channels.acquire() as channel:
+            await channel.declare_queue(name, durable=True)
+
+    async def declare_callback_queue(self) -> str:
+        async with self._channels.acquire() as channel:
+            queue = await channel.declare_queue(exclusive=True, auto_delete=True)
+        return queue.name
+
+    async def _delay_queue(self, queue: str, delay: float) -> str:
+        name = delay_queue(queue, delay)
+        if name not in self._delay_queues:
+            async with self._channels.acquire() as channel:
+                await channel.declare_queue(
+                    name,
+                    durable=True,
+                    arguments={
+                        "x-message-ttl": int(delay * 1000),
+                        "x-dead-letter-exchange": "",
+                        "x-dead-letter-routing-key": queue,
+                    },
+                )
+            self._delay_queues.add(name)
+        return name
+
+    async def publish(
+        self, queue: str, message: OutgoingMessage, *, delay: float = 0
+    ) -> None:
+        routing_key = await self._delay_queue(queue, delay) if delay > 0 else queue
+        async with self._channels.acquire() as channel:
+            await channel.default_exchange.publish(
+                _amqp_message(message), routing_key=routing_key
+            )
+
+    async def publish_batch(
+        self, messages: Sequence[tuple[str, OutgoingMessage]]
+    ) -> None:
+        async with self._channels.acquire() as channel:
+            await asyncio.gather(
+                *(
+                    channel.default_exchange.publish(
+                        _amqp_message(message), routing_key=queue
+                    )
+                    for queue, message in messages
+                )
+            )
+
+    @asynccontextmanager
+    async def consume(
+        self, queue: str, *, prefetch: int
+    ) -> AsyncIterator[AsyncIterator[Delivery]]:
+        channel = await self._connection.channel()
+        try:
+            await channel.set_qos(prefetch_count=prefetch)
+            source = await channel.declare_queue(queue, durable=True, passive=True)
+            async with source.iterator() as deliveries:
+                yield deliveries
+        finally:
+            # Unacked deliveries go back to the queue with the channel
+            await channel.close()
+
+    async def get(self, queue: str) -> Optional[Delivery]:
+        async with self._channels.acquire() as channel:
+            source = await channel.declare_queue(queue, durable=True, passive=True)
+            return await source.get(no_ack=False, fail=False)
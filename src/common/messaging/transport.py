@@ -0,0 +1,142 @@
+"""Message transport shared by the API and the worker.
+
+Code that sends or receives queue messages talks to a ``Transport`` rather
+than to a broker client. Two implementations exist:
+
+- ``RabbitMQTransport`` (``common.messaging.rabbitmq``) for deployments with
+  a broker. Durable queues, pooled publishing channels and TTL queues for
+  delayed delivery.
+- ``InMemoryTransport`` (``common.messaging.memory``), an asyncio broker
+  inside the process. The API and the worker can share it when they run in
+  one process, and tests and benchmarks use it instead of a broker container.
+  Nothing survives a restart.
+
+``TRANSPORT`` selects one (``rabbitmq`` by default, or ``memory``).
+
+Received messages follow the shape of aio-pika's ``IncomingMessage``, so
+RabbitMQ deliveries are passed through as they are: the payload and
+properties as attributes, and ``ack()``/``nack(requeue=...)`` to settle.
+"""
+
+import asyncio
+import os
+from abc import ABC, abstractmethod
+from contextlib import AbstractAsyncContextManager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Optional, Sequence
+
+
+@dataclass
+class OutgoingMessage:
+    body: bytes
+    headers: dict[str, Any] = field(default_factory=dict)
+    content_type: Optional[str] = None
+    content_encoding: Optional[str] = None
+    correlation_id: Optional[str] = None
+    reply_to: Optional[str] = None
+    message_id: Optional[str] = None
+    priority: Optional[int] = None
+    # Written to disk by the broker; replies to RPC calls need not be
+    persistent: bool = True
+
+    @classmethod
+    def copy_of(
+        cls, delivery: "Delivery", headers: Optional[dict[str, Any]] = None
+    ) -> "OutgoingMessage":
+        """A message republishing a delivery, optionally with new headers."""
+        return cls(
+            delivery.body,
+            headers=dict(delivery.headers or {}) if headers is None else headers,
+            content_type=delivery.content_type,
+            content_encoding=delivery.content_encoding,
+            correlation_id=delivery.correlation_id,
+            reply_to=delivery.reply_to,
+            message_id=delivery.message_id,
+            priority=delivery.priority,
+        )
+
+
+class Delivery(ABC):
+    """A received message. Settle it exactly once, with ack() or nack()."""
+
+    body: bytes
+    headers: dict[str, Any]
+    content_type: Optional[str]
+    content_encoding: Optional[str]
+    correlation_id: Optional[str]
+    reply_to: Optional[str]
+    message_id: Optional[str]
+    priority: Optional[int]
+    redelivered: bool
+
+    @abstractmethod
+    async def ack(self) -> None: ...
+
+    @abstractmethod
+    async def nack(self, requeue: bool = True) -> None: ...
+
+
+class Transport(ABC):
+    """Base class for message transports."""
+
+    @abstractmethod
+    async def connect(self) -> None: ...
+
+    @abstractmethod
+    async def close(self) -> None: ...
+
+    @abstractmethod
+    async def declare_queue(self, name: str) -> None:
+        """Make sure a durable work queue exists."""
+
+    @abstractmethod
+    async def declare_callback_queue(self) -> str:
+        """Create a private, uniquely named queue for replies; returns its name.
+
+        The queue lives as long as this transport's connection.
+        """
+
+    @abstractmethod
+    async def publish(
+        self, queue: str, message: OutgoingMessage, *, delay: float = 0
+    ) -> None:
+        """Send a message to a queue, delivered after ``delay`` seconds."""
+
+    async def publish_batch(
+        self, messages: Sequence[tuple[str, OutgoingMessage]]
+    ) -> None:
+        """Send (queue, message) pairs; returns once the broker accepted all.
+
+        If it raises, some of the messages may have been sent.
+        """
+        await asyncio.gather(*(self.publish(queue, m) for queue, m in messages))
+
+    @abstractmethod
+    def consume(
+        self, queue: str, *, prefetch: int
+    ) -> AbstractAsyncContextManager[AsyncIterator[Delivery]]:
+        """Iterate over a queue's deliveries, at most ``prefetch`` unsettled.
+
+        Leaving the context stops the consumer and returns deliveries that
+        are still unsettled to the queue.
+        """
+
+    @abstractmethod
+    async def get(self, queue: str) -> Optional[Delivery]:
+        """Take one message off a queue without waiting, for tools."""
+
+
+def transport_from_env() -> Transport:
+    kind = os.getenv("TRANSPORT", "rabbitmq")
+    if kind == "memory":
+        from common.messaging.memory import InMemoryTransport, shared_broker
+
+        return InMemoryTransport(shared_broker)
+    if kind == "rabbitmq":
+        from common.messaging.rabbitmq import RabbitMQTransport, rabbitmq_url_from_env
+
+        return RabbitMQTransport(
+            rabbitmq_url_from_env(),
+            channel_pool_size=int(os.getenv("RABBITMQ_CHANNELS", "4")),
+        )
+    raise ValueError(f"Unknown TRANSPORT: {kind}")
@@ -0,0 +1,305 @@
+"""Monthly range partitioning helpers and the partition-maintenance job.
+
+``messages`` and ``logs`` are partitioned by month on ``timestamp``. Each
+table has one partition per month named ``<table>_pYYYY_MM`` plus a
+``<table>_default`` partition that catches rows outside every range, so a late
+maintenance run never makes inserts fail.
+
+Run the maintenance job daily (cron, a Kubernetes CronJob, ...):
+
+    python -m db.core.partitions
+"""
+
+import logging
+import os
+import re
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+logger = logging.getLogger(__name__)
+
+PARTITIONED_TABLES = ("messages", "logs")
+
+_PARTITION_RE = re.compile(r"^(?P<table>\w+)_p(?P<year>\d{4})_(?P<month>\d{2})$")
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    """How long to keep monthly partitions of a table, and what to do after."""
+
+    table: str
+    keep_months: int
+    mode: str = "detach"  # "detach" keeps the data as a standalone table
+
+    def __post_init__(self):
+        if self.mode not in ("detach", "drop"):
+            raise ValueError(f"Unknown retention mode: {self.mode}")
+        if self.keep_months < 1:
+            raise ValueError("keep_months must be at least 1")
+
+
+def month_start(value: date) -> date:
+    """Return the first day of the month containing value."""
+    return date(value.year, value.month, 1)
+
+
+def add_months(value: date, months: int) -> date:
+    """Return the first day of the month `months` after the month of value."""
+    index = value.year * 12 + (value.month - 1) + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month.year:04d}_{month.month:02d}"
+
+
+def parse_partition_name(name: str) -> Optional[tuple[str, date]]:
+    """Return (table, month) for a monthly partition name, or None."""
+    match = _PARTITION_RE.match(name)
+    if not match:
+        return None
+    return match["table"], date(int(match["year"]), int(match["month"]), 1)
+
+
+def list_partitions(conn: Connection, table: str) -> dict[date, str]:
+    """Return the monthly partitions currently attached to table, by month."""
+    rows = conn.execute(
+        text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = :table"
+        ),
+        {"table": table},
+    ).scalars()
+    partitions = {}
+    for name in rows:
+        parsed = parse_partition_name(name)
+        if parsed and parsed[0] == table:
+            partitions[parsed[1]] = name
+    return partitions
+
+
+def list_child_tables(conn: Connection, table: str) -> list[str]:
+    """Return every partition attached to table, including the default one."""
+    return list(
+        conn.execute(
+            text(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                "WHERE parent.relname = :table AND child.relkind = 'r'"
+            ),
+            {"table": table},
+        ).scalars()
+    )
+
+
+def create_partitioned_index(
+    conn: Connection, name: str, table: str, columns: str, using: str = "btree"
+) -> None:
+    """Build an index on a partitioned table without blocking writes.
+
+    CREATE INDEX CONCURRENTLY is not supported on a partitioned table, so the
+    parent index is created ON ONLY the parent (instant, initially invalid),
+    then each partition's index is built concurrently and attached; the parent
+    index becomes valid once every partition is attached. Partitions created
+    later inherit it automatically. Must run on an autocommit connection.
+    """
+    conn.execute(
+        text(
+            f"CREATE INDEX IF NOT EXISTS {name} "
+            f"ON ONLY {table} USING {using} ({columns})"
+        )
+    )
+    suffix = name.removeprefix(f"ix_{table}_")
+    for child in list_child_tables(conn, table):
+        child_index = f"{child}_{suffix}_idx"[:63]
+        conn.execute(
+            text(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {child_index} "
+                f"ON {child} USING {using} ({columns})"
+            )
+        )
+        attached = conn.execute(
+            text(
+                "SELECT EXISTS (SELECT 1 FROM pg_inherits "
+                "JOIN pg_class idx ON idx.oid = pg_inherits.inhrelid "
+                "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+                "WHERE idx.relname = :child AND parent.relname = :parent)"
+            ),
+            {"child": child_index, "parent": name},
+        ).scalar_one()
+        if not attached:
+            conn.execute(text(f"ALTER INDEX {name} ATTACH PARTITION {child_index}"))
+
+
+def stored_columns(conn: Connection, table: str) -> list[str]:
+    """The columns of table a copy can write, i.e. all but generated ones."""
+    return list(
+        conn.execute(
+            text(
+                "SELECT attname FROM pg_attribute "
+                "WHERE attrelid = CAST(:table AS regclass) AND attnum > 0 "
+                "AND NOT attisdropped AND attgenerated = '' ORDER BY attnum"
+            ),
+            {"table": table},
+        ).scalars()
+    )
+
+
+def create_default_partition(conn: Connection, table: str) -> None:
+    conn.execute(
+        text(
+            f"CREATE TABLE IF NOT EXISTS {table}_default "
+            f"PARTITION OF {table} DEFAULT"
+        )
+    )
+
+
+def create_month_partition(conn: Connection, table: str, month: date) -> str:
+    """Create the partition for one month, moving matching rows out of default.
+
+    PostgreSQL refuses to create a partition while the default partition holds
+    rows in its range, so those rows are moved across with the default
+    partition briefly detached. Generated columns are recomputed rather than
+    copied, and the new partition's triggers are off during the move: the rows
+    were already counted by the chat summary trigger when first inserted.
+    Callers are expected to run this in a transaction.
+    """
+    name = partition_name(table, month)
+    lower, upper = month.isoformat(), add_months(month, 1).isoformat()
+    bounds = f"FROM ('{lower}') TO ('{upper}')"
+    default = f"{table}_default"
+    in_range = f"\"timestamp\" >= '{lower}' AND \"timestamp\" < '{upper}'"
+
+    has_default = conn.execute(
+        text("SELECT to_regclass(:name) IS NOT NULL"), {"name": default}
+    ).scalar_one()
+    stranded = (
+        has_default
+        and conn.execute(
+            text(f"SELECT EXISTS (SELECT 1 FROM {default} WHERE {in_range})")
+        ).scalar_one()
+    )
+
+    if not stranded:
+        conn.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} "
+                f"FOR VALUES {bounds}"
+            )
+        )
+        return name
+
+    logger.warning("Moving rows for %s out of %s", name, default)
+    conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {default}"))
+    conn.execute(text(f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES {bounds}"))
+    columns = ", ".join(f'"{column}"' for column in stored_columns(conn, table))
+    conn.execute(text(f"ALTER TABLE {name} DISABLE TRIGGER USER"))
+    conn.execute(
+        text(
+            f"INSERT INTO {name} ({columns}) "
+            f"SELECT {columns} FROM {default} WHERE {in_range}"
+        )
+    )
+    conn.execute(text(f"ALTER TABLE {name} ENABLE TRIGGER USER"))
+    conn.execute(text(f"DELETE FROM {default} WHERE {in_range}"))
+    conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT"))
+    return name
+
+
+def ensure_partitions(
+    conn: Connection, table: str, first: date, last: date
+) -> list[str]:
+    """Create any missing monthly partitions for the months first..last."""
+    existing = list_partitions(conn, table)
+    created = []
+    month = month_start(first)
+    while month <= month_start(last):
+        if month not in existing:
+            created.append(create_month_partition(conn, table, month))
+        month = add_months(month, 1)
+    return created
+
+
+def expired_partitions(
+    partitions: dict[date, str], keep_months: int, today: date
+) -> list[str]:
+    """Return partitions whose whole month is older than the retention window."""
+    cutoff = add_months(month_start(today), -keep_months + 1)
+    return [name for month, name in sorted(partitions.items()) if month < cutoff]
+
+
+def apply_retention(
+    conn: Connection, policy: RetentionPolicy, today: date
+) -> list[str]:
+    """Detach or drop the partitions of a table that fall outside its policy."""
+    expired = expired_partitions(
+        list_partitions(conn, policy.table), policy.keep_months, today
+    )
+    for name in expired:
+        if policy.mode == "drop":
+            conn.execute(text(f"DROP TABLE {name}"))
+        else:
+            conn.execute(text(f"ALTER TABLE {policy.table} DETACH PARTITION {name}"))
+        logger.info("Retention (%s): %s", policy.mode, name)
+    return expired
+
+
+def maintain(
+    conn: Connection,
+    months_ahead: int,
+    policies: list[RetentionPolicy],
+    today: Optional[date] = None,
+) -> None:
+    """Pre-create future partitions and enforce retention policies."""
+    today = today or datetime.now(timezone.utc).date()
+    for table in PARTITIONED_TABLES:
+        created = ensure_partitions(
+            conn, table, today, add_months(month_start(today), months_ahead)
+        )
+        if created:
+            logger.info("Created partitions: %s", ", ".join(created))
+    for policy in policies:
+        apply_retention(conn, policy, today)
+
+
+def policies_from_env() -> list[RetentionPolicy]:
+    """Build retention policies from LOG_RETENTION_MONTHS / LOG_RETENTION_MODE.
+
+    Only logs expire; chat messages are kept until archived.
+    """
+    months = os.getenv("LOG_RETENTION_MONTHS")
+    if not months:
+        return []
+    return [
+        RetentionPolicy(
+            table="logs",
+            keep_months=int(months),
+            mode=os.getenv("LOG_RETENTION_MODE", "detach"),
+        )
+    ]
+
+
+def main() -> None:
+    from sqlalchemy import create_engine
+
+    from db.core.database import DATABASE_URL, get_sync_url
+
+    logging.basicConfig(level=logging.INFO)
+    months_ahead = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+    engine = create_engine(get_sync_url(DATABASE_URL))
+    try:
+        with engine.begin() as conn:
+            maintain(conn, months_ahead, policies_from_env())
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
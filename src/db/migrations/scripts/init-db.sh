@@ -49,6 +49,9 @@ set +x
 
 echo "Migrations completed successfully"
 
+echo "Running partition maintenance..."
+python -m db.core.partitions
+
 echo "Inserting test user..."
 psql -v ON_ERROR_STOP=1 --username "$POSTGRES_USER" --dbname "$POSTGRES_DB" <<-'EOSQL'
     INSERT INTO users (user_id, username, email, created_at)
@@ -0,0 +1,54 @@
+"""add access path indexes
+
+Revision ID: 002
+Revises: 001
+Create Date: 2026-10-19 09:00:00.000000
+
+Adds the composite indexes used by chat history, chat listing and audit log
+lookups, plus indexes on the user_id foreign keys so ON DELETE CASCADE from
+users does not scan messages and logs. Indexes are built CONCURRENTLY so the
+migration can run against a live database without blocking writes.
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "002"
+down_revision: Union[str, None] = "001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = [
+    ("ix_chats_user_id_created_at", "chats", ["user_id", "created_at"]),
+    ("ix_messages_chat_id_timestamp", "messages", ["chat_id", "timestamp"]),
+    ("ix_messages_user_id", "messages", ["user_id"]),
+    ("ix_logs_chat_id_timestamp", "logs", ["chat_id", "timestamp"]),
+    ("ix_logs_user_id", "logs", ["user_id"]),
+]
+
+
+def upgrade() -> None:
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block.
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(
+                name,
+                table,
+                columns,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(
+                name,
+                table_name=table,
+                postgresql_concurrently=True,
+                if_exists=True,
+            )
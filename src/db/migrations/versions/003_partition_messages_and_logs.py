@@ -0,0 +1,142 @@
+"""partition messages and logs by month
+
+Revision ID: 003
+Revises: 002
+Create Date: 2026-10-19 10:00:00.000000
+
+Rebuilds messages and logs as tables range-partitioned by month on
+"timestamp". Existing rows are copied into the new partitions, so expect the
+upgrade to hold an exclusive lock on both tables for the duration of the copy.
+
+The primary keys become (id, "timestamp") because PostgreSQL requires unique
+constraints on a partitioned table to include the partition key. Nothing
+references messages or logs by foreign key, and the ORM keeps treating the id
+column alone as the identity.
+
+"""
+
+from datetime import datetime, timezone
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+from db.core.partitions import (
+    add_months,
+    create_default_partition,
+    ensure_partitions,
+    month_start,
+)
+
+# revision identifiers, used by Alembic.
+revision: str = "003"
+down_revision: Union[str, None] = "002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MONTHS_AHEAD = 3
+
+TABLES = {
+    "messages": {
+        "pk": "message_id",
+        "copy": [
+            "message_id",
+            "chat_id",
+            "user_id",
+            "content",
+            "user_message",
+            "timestamp",
+        ],
+        "columns": """
+            message_id uuid NOT NULL,
+            chat_id uuid NOT NULL CONSTRAINT messages_chat_id_fkey
+                REFERENCES chats (chat_id) ON DELETE CASCADE,
+            user_id uuid NOT NULL CONSTRAINT messages_user_id_fkey
+                REFERENCES users (user_id) ON DELETE CASCADE,
+            content text NOT NULL,
+            user_message boolean NOT NULL,
+            "timestamp" timestamptz NOT NULL DEFAULT now()
+        """,
+        "indexes": {
+            "ix_messages_chat_id_timestamp": 'chat_id, "timestamp"',
+            "ix_messages_user_id": "user_id",
+        },
+    },
+    "logs": {
+        "pk": "log_id",
+        "copy": ["log_id", "user_id", "chat_id", "action", "details", "timestamp"],
+        "columns": """
+            log_id uuid NOT NULL,
+            user_id uuid NOT NULL CONSTRAINT logs_user_id_fkey
+                REFERENCES users (user_id) ON DELETE CASCADE,
+            chat_id uuid NOT NULL CONSTRAINT logs_chat_id_fkey
+                REFERENCES chats (chat_id) ON DELETE CASCADE,
+            action varchar(255) NOT NULL,
+            details text,
+            "timestamp" timestamptz NOT NULL DEFAULT now()
+        """,
+        "indexes": {
+            "ix_logs_chat_id_timestamp": 'chat_id, "timestamp"',
+            "ix_logs_user_id": "user_id",
+        },
+    },
+}
+
+
+def _retire(table: str, spec: dict) -> str:
+    """Rename a table and its indexes out of the way; return the new name."""
+    old = f"{table}_old"
+    op.execute(f"ALTER TABLE {table} RENAME TO {old}")
+    op.execute(f"ALTER TABLE {old} RENAME CONSTRAINT {table}_pkey TO {old}_pkey")
+    for index in spec["indexes"]:
+        op.execute(f"ALTER INDEX IF EXISTS {index} RENAME TO {index}_old")
+    return old
+
+
+def _copy_columns(spec: dict) -> str:
+    return ", ".join(f'"{name}"' for name in spec["copy"])
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    today = datetime.now(timezone.utc).date()
+
+    for table, spec in TABLES.items():
+        old = _retire(table, spec)
+
+        op.execute(
+            f"CREATE TABLE {table} ({spec['columns']}, "
+            f"CONSTRAINT {table}_pkey PRIMARY KEY ({spec['pk']}, \"timestamp\")) "
+            f'PARTITION BY RANGE ("timestamp")'
+        )
+        for index, columns in spec["indexes"].items():
+            op.execute(f"CREATE INDEX {index} ON {table} ({columns})")
+
+        oldest = conn.execute(sa.text(f'SELECT min("timestamp") FROM {old}')).scalar()
+        first = month_start(oldest.date()) if oldest else month_start(today)
+        ensure_partitions(conn, table, first, add_months(today, MONTHS_AHEAD))
+        create_default_partition(conn, table)
+
+        columns = _copy_columns(spec)
+        op.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {old}")
+        op.execute(f"DROP TABLE {old}")
+
+
+def downgrade() -> None:
+    for table, spec in TABLES.items():
+        old = f"{table}_partitioned"
+        op.execute(f"ALTER TABLE {table} RENAME TO {old}")
+        op.execute(f"ALTER TABLE {old} RENAME CONSTRAINT {table}_pkey TO {old}_pkey")
+        for index in spec["indexes"]:
+            op.execute(f"ALTER INDEX {index} RENAME TO {index}_partitioned")
+
+        op.execute(
+            f"CREATE TABLE {table} ({spec['columns']}, "
+            f"CONSTRAINT {table}_pkey PRIMARY KEY ({spec['pk']}))"
+        )
+        for index, columns in spec["indexes"].items():
+            op.execute(f"CREATE INDEX {index} ON {table} ({columns})")
+
+        columns = _copy_columns(spec)
+        op.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {old}")
+        op.execute(f"DROP TABLE {old}")
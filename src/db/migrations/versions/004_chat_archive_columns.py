@@ -0,0 +1,33 @@
+"""add chat archive columns
+
+Revision ID: 004
+Revises: 003
+Create Date: 2026-10-19 11:00:00.000000
+
+Chats whose messages have been moved to cold storage keep a stub row with the
+archive timestamp and the path of the archive file.
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "004"
+down_revision: Union[str, None] = "003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "chats", sa.Column("archived_at", sa.DateTime(timezone=True), nullable=True)
+    )
+    op.add_column("chats", sa.Column("archive_path", sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("chats", "archive_path")
+    op.drop_column("chats", "archived_at")
@@ -0,0 +1,62 @@
+"""re-key messages with UUIDv7 ids
+
+Revision ID: 005
+Revises: 004
+Create Date: 2026-10-19 12:00:00.000000
+
+New chats, messages and logs get time-ordered UUIDv7 primary keys from the
+ORM. Existing messages are re-keyed with UUIDv7 ids derived from their
+timestamps, so ordering by message_id matches chronological order for old and
+new rows alike and history can be paginated on (chat_id, message_id). Nothing
+references messages by foreign key. Chats keep their ids because clients hold
+them.
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+from db.core.partitions import create_partitioned_index
+
+# revision identifiers, used by Alembic.
+revision: str = "005"
+down_revision: Union[str, None] = "004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# 48-bit millisecond timestamp over a random UUID, version nibble set to 7
+UUID7_FROM_TIMESTAMP = """
+    encode(
+        set_bit(set_bit(
+            overlay(
+                uuid_send(gen_random_uuid())
+                placing substring(
+                    int8send(floor(extract(epoch FROM "timestamp") * 1000)::bigint)
+                    FROM 3
+                )
+                FROM 1 FOR 6
+            ),
+        52, 1), 53, 1),
+        'hex'
+    )::uuid
+"""
+
+
+def upgrade() -> None:
+    op.execute(
+        f"UPDATE messages SET message_id = {UUID7_FROM_TIMESTAMP} "
+        "WHERE substring(message_id::text, 15, 1) <> '7'"
+    )
+    with op.get_context().autocommit_block():
+        create_partitioned_index(
+            op.get_bind(),
+            "ix_messages_chat_id_message_id",
+            "messages",
+            "chat_id, message_id",
+        )
+
+
+def downgrade() -> None:
+    # Re-keyed ids are kept; they are valid UUIDs either way.
+    op.execute("DROP INDEX IF EXISTS ix_messages_chat_id_message_id")
@@ -0,0 +1,117 @@
+"""add denormalized chat summary columns
+
+Revision ID: 006
+Revises: 005
+Create Date: 2026-10-19 13:00:00.000000
+
+Adds last_message_at, message_count and last_message_preview to chats so a
+user's chat list can be served from chats alone. A trigger on messages keeps
+them current in the same transaction as every insert, whichever service does
+the insert. Counts include archived messages because the archiver only
+deletes; the backfill can only count what is still in the hot table.
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "006"
+down_revision: Union[str, None] = "005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PREVIEW_LENGTH = 200
+
+
+def upgrade() -> None:
+    op.add_column(
+        "chats",
+        sa.Column("last_message_at", sa.DateTime(timezone=True), nullable=True),
+    )
+    op.add_column(
+        "chats",
+        sa.Column(
+            "message_count", sa.Integer(), server_default=sa.text("0"), nullable=False
+        ),
+    )
+    op.add_column(
+        "chats",
+        sa.Column(
+            "last_message_preview", sa.String(length=PREVIEW_LENGTH), nullable=True
+        ),
+    )
+
+    op.execute(
+        f"""
+        UPDATE chats SET
+            last_message_at = COALESCE(latest."timestamp", chats.created_at),
+            message_count = COALESCE(counts.total, 0),
+            last_message_preview = left(latest.content, {PREVIEW_LENGTH})
+        FROM chats c
+        LEFT JOIN LATERAL (
+            SELECT m."timestamp", m.content FROM messages m
+            WHERE m.chat_id = c.chat_id
+            ORDER BY m."timestamp" DESC, m.message_id DESC LIMIT 1
+        ) latest ON true
+        LEFT JOIN LATERAL (
+            SELECT count(*) AS total FROM messages m WHERE m.chat_id = c.chat_id
+        ) counts ON true
+        WHERE chats.chat_id = c.chat_id
+        """
+    )
+    op.alter_column(
+        "chats",
+        "last_message_at",
+        server_default=sa.text("now()"),
+        nullable=False,
+    )
+
+    op.execute(
+        f"""
+        CREATE OR REPLACE FUNCTION chats_on_message_insert() RETURNS trigger AS $$
+        BEGIN
+            UPDATE chats SET
+                message_count = message_count + 1,
+                last_message_preview = CASE
+                    WHEN NEW."timestamp" >= last_message_at
+                    THEN left(NEW.content, {PREVIEW_LENGTH})
+                    ELSE last_message_preview
+                END,
+                last_message_at = GREATEST(last_message_at, NEW."timestamp")
+            WHERE chat_id = NEW.chat_id;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        "CREATE TRIGGER messages_update_chat_summary AFTER INSERT ON messages "
+        "FOR EACH ROW EXECUTE FUNCTION chats_on_message_insert()"
+    )
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_chats_user_id_last_message_at",
+            "chats",
+            ["user_id", "last_message_at", "chat_id"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_chats_user_id_last_message_at",
+            table_name="chats",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+    op.execute("DROP TRIGGER IF EXISTS messages_update_chat_summary ON messages")
+    op.execute("DROP FUNCTION IF EXISTS chats_on_message_insert()")
+    op.drop_column("chats", "last_message_preview")
+    op.drop_column("chats", "message_count")
+    op.drop_column("chats", "last_message_at")
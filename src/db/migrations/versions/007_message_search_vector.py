@@ -0,0 +1,44 @@
+"""add full-text search vector to messages
+
+Revision ID: 007
+Revises: 006
+Create Date: 2026-10-19 14:00:00.000000
+
+Adds a stored generated tsvector over messages.content and a GIN index on it,
+so searches match through the index instead of scanning every message with
+ILIKE. Adding a stored column rewrites each partition; the GIN index is then
+built concurrently partition by partition.
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+from db.core.partitions import create_partitioned_index
+
+# revision identifiers, used by Alembic.
+revision: str = "007"
+down_revision: Union[str, None] = "006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        "ALTER TABLE messages ADD COLUMN search_vector tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('english'::regconfig, content)) STORED"
+    )
+    with op.get_context().autocommit_block():
+        create_partitioned_index(
+            op.get_bind(),
+            "ix_messages_search_vector",
+            "messages",
+            "search_vector",
+            using="gin",
+        )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_messages_search_vector")
+    op.drop_column("messages", "search_vector")
@@ -0,0 +1,47 @@
+"""add processed_messages inbox
+
+Revision ID: 008
+Revises: 007
+Create Date: 2026-10-19 15:00:00.000000
+
+One row per queue message the worker has answered, keyed by the message's
+idempotency key and written in the same transaction as the reply. The primary
+key is the deduplication constraint: a redelivered message finds its key and
+is acked without calling the LLM again, and two racing copies cannot both
+commit a reply.
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "008"
+down_revision: Union[str, None] = "007"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "processed_messages",
+        sa.Column("idempotency_key", sa.String(length=255), nullable=False),
+        sa.Column("chat_id", sa.UUID(), nullable=False),
+        sa.Column("reply_id", sa.UUID(), nullable=True),
+        sa.Column(
+            "processed_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=True,
+        ),
+        sa.ForeignKeyConstraint(["chat_id"], ["chats.chat_id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("idempotency_key"),
+    )
+    op.create_index("ix_processed_messages_chat_id", "processed_messages", ["chat_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_processed_messages_chat_id", table_name="processed_messages")
+    op.drop_table("processed_messages")
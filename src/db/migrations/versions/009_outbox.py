@@ -0,0 +1,67 @@
+"""add outbox for transactional queue publishing
+
+Revision ID: 009
+Revises: 008
+Create Date: 2026-10-19 17:00:00.000000
+
+Queue messages are written to ``outbox`` in the same transaction as the rows
+they announce, and a relay publishes and deletes them. A statement-level
+trigger notifies the ``outbox`` channel on every insert so a listening relay
+wakes as soon as the transaction commits.
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = "009"
+down_revision: Union[str, None] = "008"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "outbox",
+        sa.Column("outbox_id", sa.BigInteger(), sa.Identity(), nullable=False),
+        sa.Column("queue", sa.String(length=255), nullable=False),
+        sa.Column("body", sa.LargeBinary(), nullable=False),
+        sa.Column("headers", postgresql.JSONB(), nullable=False),
+        sa.Column("content_type", sa.String(length=255), nullable=True),
+        sa.Column("correlation_id", sa.String(length=255), nullable=True),
+        sa.Column("reply_to", sa.String(length=255), nullable=True),
+        sa.Column("message_id", sa.String(length=255), nullable=True),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=True,
+        ),
+        sa.PrimaryKeyConstraint("outbox_id"),
+    )
+    op.execute(
+        """
+        CREATE FUNCTION outbox_notify() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('outbox', '');
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER outbox_notify AFTER INSERT ON outbox
+        FOR EACH STATEMENT EXECUTE FUNCTION outbox_notify()
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER outbox_notify ON outbox")
+    op.execute("DROP FUNCTION outbox_notify()")
+    op.drop_table("outbox")
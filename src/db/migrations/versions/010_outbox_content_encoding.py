@@ -0,0 +1,32 @@
+"""add content_encoding to outbox
+
+Revision ID: 010
+Revises: 009
+Create Date: 2026-10-19 19:00:00.000000
+
+Queue payloads above a size threshold are zstd-compressed, which the message's
+``content_encoding`` property records; the outbox keeps it so relayed
+messages can still be decoded.
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "010"
+down_revision: Union[str, None] = "009"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "outbox", sa.Column("content_encoding", sa.String(length=255), nullable=True)
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("outbox", "content_encoding")
@@ -0,0 +1,46 @@
+"""notify listeners of new chat messages
+
+Revision ID: 011
+Revises: 010
+Create Date: 2026-10-19 20:00:00.000000
+
+A row trigger on messages NOTIFYs the ``chat_messages`` channel with the chat
+id. PostgreSQL delivers the notification when the inserting transaction
+commits and folds duplicates within one transaction, so a batch of replies to
+one chat wakes its listeners once.
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "011"
+down_revision: Union[str, None] = "010"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE FUNCTION messages_notify() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('chat_messages', NEW.chat_id::text);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER messages_notify AFTER INSERT ON messages
+        FOR EACH ROW EXECUTE FUNCTION messages_notify()
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER messages_notify ON messages")
+    op.execute("DROP FUNCTION messages_notify()")
@@ -0,0 +1,51 @@
+"""index message search by user
+
+Revision ID: 012
+Revises: 011
+Create Date: 2026-10-19 21:00:00.000000
+
+Searches always filter by user, but the GIN index from 007 covers only
+search_vector: a common word matched every user's messages in the index and
+the user filter was applied to each row afterwards. The btree_gin extension
+lets a GIN index hold user_id next to the vector, so the composite index
+answers both conditions at once. It replaces the single-column index.
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+from db.core.partitions import create_partitioned_index
+
+# revision identifiers, used by Alembic.
+revision: str = "012"
+down_revision: Union[str, None] = "011"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS btree_gin")
+    with op.get_context().autocommit_block():
+        create_partitioned_index(
+            op.get_bind(),
+            "ix_messages_user_id_search_vector",
+            "messages",
+            "user_id, search_vector",
+            using="gin",
+        )
+    op.execute("DROP INDEX IF EXISTS ix_messages_search_vector")
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        create_partitioned_index(
+            op.get_bind(),
+            "ix_messages_search_vector",
+            "messages",
+            "search_vector",
+            using="gin",
+        )
+    op.execute("DROP INDEX IF EXISTS ix_messages_user_id_search_vector")
+    op.execute("DROP EXTENSION IF EXISTS btree_gin")
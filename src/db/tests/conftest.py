@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+from dotenv import load_dotenv
+
+# Add the src directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../")))
+
+# Load environment variables from .env file
+load_dotenv()
+
+# common.db.connect refuses to import without a URL; engines connect lazily
+os.environ.setdefault("DATABASE_URL", "postgresql+asyncpg://user:password@db/test")
+
+# Tests that need a real PostgreSQL server read its URL from here. The database
+# is dropped and recreated table by table, so never point this at real data.
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+
+def to_sync_url(url: str) -> str:
+    """Force the psycopg2 driver without touching the host (unlike get_sync_url)."""
+    if "postgresql+asyncpg://" in url:
+        return url.replace("postgresql+asyncpg://", "postgresql+psycopg2://")
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+psycopg2://")
+    return url
+
+
+@pytest.fixture(scope="session")
+def pg_url():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    return to_sync_url(TEST_DATABASE_URL)
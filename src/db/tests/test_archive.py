@@ -0,0 +1,183 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import create_engine, func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from common.db.archive import (
+    ChatArchive,
+    ChatArchiver,
+    LocalArchiveStore,
+    deserialize_messages,
+    get_chat_history,
+    serialize_messages,
+)
+from common.db.ids import uuid7, uuid7_floor
+from common.db.models import Base, Chat, Message
+from common.db.schemas import MessageRead
+
+
+def make_message(content: str, minutes_ago: int = 0) -> MessageRead:
+    return MessageRead(
+        message_id=uuid.uuid4(),
+        chat_id=uuid.uuid4(),
+        user_id=uuid.uuid4(),
+        content=content,
+        user_message=True,
+        timestamp=datetime.now(timezone.utc) - timedelta(minutes=minutes_ago),
+    )
+
+
+def test_serialization_round_trip():
+    messages = [make_message("hello"), make_message("ünïcødé\nnewline")]
+    assert deserialize_messages(serialize_messages(messages)) == messages
+
+
+def test_chat_archive_caches_parsed_archives(tmp_path):
+    store = LocalArchiveStore(str(tmp_path))
+    store.write("chats/ab/one.jsonl.gz", serialize_messages([make_message("hi")]))
+    archive = ChatArchive(store, cache_size=4)
+
+    first = archive._load("chats/ab/one.jsonl.gz")
+    second = archive._load("chats/ab/one.jsonl.gz")
+
+    assert first is second
+    assert archive.cache_info().hits == 1
+    assert not list(tmp_path.rglob("*.tmp"))
+
+
+@pytest.fixture
+def async_pg_url(pg_url):
+    return pg_url.replace("postgresql+psycopg2://", "postgresql+asyncpg://")
+
+
+@pytest.fixture
+def archive_tables(pg_url):
+    engine = create_engine(pg_url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    yield engine
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+
+
+async def test_archiver_moves_inactive_chats(tmp_path, archive_tables, async_pg_url):
+    user_id, stale_chat, active_chat = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    with archive_tables.begin() as conn:
+        conn.execute(
+            text("INSERT INTO users (user_id, username, email) VALUES (:u, 'u', 'e')"),
+            {"u": user_id},
+        )
+        for chat_id in (stale_chat, active_chat):
+            conn.execute(
+                text(
+                    "INSERT INTO chats (chat_id, user_id, created_at) "
+                    "VALUES (:c, :u, now() - interval '90 days')"
+                ),
+                {"c": chat_id, "u": user_id},
+            )
+        conn.execute(
+            text(
+                "INSERT INTO messages "
+                "(message_id, chat_id, user_id, content, user_message, timestamp) "
+                "VALUES (:m, :c, :u, :content, true, "
+                "now() - make_interval(days => 60 - :i))"
+            ),
+            [
+                {
+                    "m": uuid7(),
+                    "c": stale_chat,
+                    "u": user_id,
+                    "content": f"old {i}",
+                    "i": i,
+                }
+                for i in range(1, 6)
+            ],
+        )
+        conn.execute(
+            text(
+                "INSERT INTO messages "
+                "(message_id, chat_id, user_id, content, user_message) "
+                "VALUES (gen_random_uuid(), :c, :u, 'recent', true)"
+            ),
+            {"c": active_chat, "u": user_id},
+        )
+
+    engine = create_async_engine(async_pg_url)
+    archive = ChatArchive(LocalArchiveStore(str(tmp_path)))
+    try:
+        async with AsyncSession(engine, expire_on_commit=False) as db:
+            archived = await ChatArchiver(archive, inactive_days=30).run(db)
+            assert archived == 1
+
+            hot = await db.scalar(
+                select(func.count())
+                .select_from(Message)
+                .where(Message.chat_id == stale_chat)
+            )
+            assert hot == 0
+
+            chat = await db.get(Chat, stale_chat)
+            assert chat.archived_at is not None
+            history = await get_chat_history(db, chat, archive)
+            assert [m.content for m in history] == [f"old {i}" for i in range(1, 6)]
+
+            # The cursor is located inside the archive and paging continues
+            page = await get_chat_history(
+                db, chat, archive, after=history[1].message_id, limit=2
+            )
+            assert [m.content for m in page] == ["old 3", "old 4"]
+
+            active = await db.get(Chat, active_chat)
+            assert active.archive_path is None
+    finally:
+        await engine.dispose()
+
+
+async def test_history_overlap_returns_messages_committed_late(
+    tmp_path, archive_tables, async_pg_url
+):
+    user_id, chat_id = uuid.uuid4(), uuid.uuid4()
+    with archive_tables.begin() as conn:
+        conn.execute(
+            text("INSERT INTO users (user_id, username, email) VALUES (:u, 'u', 'e')"),
+            {"u": user_id},
+        )
+        conn.execute(
+            text("INSERT INTO chats (chat_id, user_id) VALUES (:c, :u)"),
+            {"c": chat_id, "u": user_id},
+        )
+    insert = text(
+        "INSERT INTO messages (message_id, chat_id, user_id, content, user_message) "
+        "VALUES (:m, :c, :u, :content, false)"
+    )
+
+    def commit(message_id, content):
+        with archive_tables.begin() as conn:
+            conn.execute(
+                insert,
+                {"m": message_id, "c": chat_id, "u": user_id, "content": content},
+            )
+
+    old = uuid7_floor(datetime.now(timezone.utc) - timedelta(minutes=1))
+    commit(old, "a minute ago")
+    # The reply's id is taken first but it commits after a newer message
+    late, newer = uuid7(), uuid7()
+    commit(newer, "newer")
+
+    engine = create_async_engine(async_pg_url)
+    archive = ChatArchive(LocalArchiveStore(str(tmp_path)))
+    try:
+        async with AsyncSession(engine) as db:
+            chat = await db.get(Chat, chat_id)
+            seen = await get_chat_history(db, chat, archive, after=old)
+            assert [m.content for m in seen] == ["newer"]
+
+            commit(late, "late reply")
+
+            assert not await get_chat_history(db, chat, archive, after=newer)
+            again = await get_chat_history(db, chat, archive, after=newer, overlap=5)
+            assert [m.content for m in again] == ["late reply"]
+    finally:
+        await engine.dispose()
@@ -0,0 +1,56 @@
+import uuid
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from common.db.models import PREVIEW_LENGTH, Base
+
+
+@pytest.fixture
+def summary_engine(pg_url):
+    engine = create_engine(pg_url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    yield engine
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+
+
+def test_message_insert_updates_chat_summary(summary_engine):
+    user_id, chat_id = uuid.uuid4(), uuid.uuid4()
+    insert_message = text(
+        "INSERT INTO messages "
+        "(message_id, chat_id, user_id, content, user_message, timestamp) "
+        "VALUES (gen_random_uuid(), :c, :u, :content, true, "
+        "now() + make_interval(mins => :offset))"
+    )
+    with summary_engine.begin() as conn:
+        conn.execute(
+            text("INSERT INTO users (user_id, username, email) VALUES (:u, 'u', 'e')"),
+            {"u": user_id},
+        )
+        conn.execute(
+            text("INSERT INTO chats (chat_id, user_id) VALUES (:c, :u)"),
+            {"c": chat_id, "u": user_id},
+        )
+        for content, offset in (("first", 1), ("x" * 500, 2), ("late arrival", -5)):
+            conn.execute(
+                insert_message,
+                {"c": chat_id, "u": user_id, "content": content, "offset": offset},
+            )
+
+    with summary_engine.connect() as conn:
+        count, preview, newest = conn.execute(
+            text(
+                "SELECT c.message_count, c.last_message_preview, "
+                "c.last_message_at = max(m.timestamp) "
+                "FROM chats c JOIN messages m USING (chat_id) "
+                "WHERE c.chat_id = :c GROUP BY c.chat_id"
+            ),
+            {"c": chat_id},
+        ).one()
+
+    assert count == 3
+    # An out-of-order insert bumps the count but not the preview
+    assert preview == "x" * PREVIEW_LENGTH
+    assert newest
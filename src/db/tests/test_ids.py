@@ -0,0 +1,38 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from common.db.ids import uuid7, uuid7_floor, uuid7_time
+
+
+def test_uuid7_layout():
+    value = uuid7()
+    assert value.version == 7
+    assert value.variant == uuid.RFC_4122
+
+
+def test_uuid7_is_monotonic_within_a_process():
+    values = [uuid7() for _ in range(10_000)]
+    assert values == sorted(values)
+    assert len(set(values)) == len(values)
+
+
+def test_uuid7_embeds_creation_time():
+    before = datetime.now(timezone.utc) - timedelta(milliseconds=1)
+    created = uuid7_time(uuid7())
+    assert before <= created <= datetime.now(timezone.utc) + timedelta(seconds=1)
+
+
+def test_uuid7_time_rejects_other_versions():
+    with pytest.raises(ValueError):
+        uuid7_time(uuid.uuid4())
+
+
+def test_uuid7_floor_precedes_every_id_of_its_millisecond():
+    value = uuid7()
+    created = uuid7_time(value)
+
+    assert uuid7_floor(created).version == 7
+    assert uuid7_floor(created) <= value
+    assert uuid7_floor(created + timedelta(milliseconds=1)) > value
@@ -0,0 +1,143 @@
+import logging
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from common.db.archive import ChatArchive, LocalArchiveStore, get_chat_history
+from common.db.crud import chat as chat_crud
+from common.db.crud import message as message_crud
+from common.db.ids import uuid7
+from common.db.instrumentation import (
+    QueryBudgetExceeded,
+    instrument,
+    normalize,
+    query_budget,
+    track_queries,
+)
+from common.db.models import Base
+
+
+@pytest.mark.parametrize(
+    "statement, shape",
+    [
+        (
+            "SELECT chats.chat_id FROM chats\n  WHERE chats.chat_id = $1::UUID",
+            "SELECT chats.chat_id FROM chats WHERE chats.chat_id = ?::UUID",
+        ),
+        (
+            "SELECT * FROM messages WHERE chat_id IN ($1, $2, $3) LIMIT $4",
+            "SELECT * FROM messages WHERE chat_id IN (...) LIMIT ?",
+        ),
+        (
+            "SELECT * FROM messages WHERE chat_id IN ($1) LIMIT $2",
+            "SELECT * FROM messages WHERE chat_id IN (...) LIMIT ?",
+        ),
+        (
+            "INSERT INTO logs (a, b) VALUES (%(a_m0)s, %(b_m0)s), (%(a_m1)s, 7)",
+            "INSERT INTO logs (a, b) VALUES (...)",
+        ),
+        (
+            "SELECT 'it''s', 42, t1.x::text FROM t1 /* hint */ WHERE y = :name",
+            "SELECT ?, ?, t1.x::text FROM t1 WHERE y = ?",
+        ),
+    ],
+)
+def test_statements_are_recorded_without_parameters(statement, shape):
+    assert normalize(statement) == shape
+
+
+@pytest.fixture
+def tables(pg_url):
+    engine = create_engine(pg_url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    yield engine
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+
+
+@pytest.fixture
+async def db(tables, pg_url):
+    engine = create_async_engine(
+        pg_url.replace("postgresql+psycopg2://", "postgresql+asyncpg://")
+    )
+    instrument(engine, slow_threshold=0.05)
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        yield session
+    await engine.dispose()
+
+
+@pytest.fixture
+def chat_id(tables):
+    user_id, chat_id = uuid7(), uuid7()
+    with tables.begin() as conn:
+        conn.execute(
+            text("INSERT INTO users (user_id, username, email) VALUES (:u, 'u', 'e')"),
+            {"u": user_id},
+        )
+        conn.execute(
+            text("INSERT INTO chats (chat_id, user_id) VALUES (:c, :u)"),
+            {"c": chat_id, "u": user_id},
+        )
+        for i in range(3):
+            conn.execute(
+                text(
+                    "INSERT INTO messages (message_id, chat_id, user_id, content, "
+                    "user_message) VALUES (:m, :c, :u, :t, true)"
+                ),
+                {"m": uuid7(), "c": chat_id, "u": user_id, "t": f"message {i}"},
+            )
+    return chat_id
+
+
+async def test_chat_history_stays_within_its_query_budget(db, chat_id, tmp_path):
+    archive = ChatArchive(LocalArchiveStore(str(tmp_path)))
+
+    # The chat row, then its messages
+    with query_budget(2) as stats:
+        chat = await chat_crud.get(db, id=chat_id)
+        history = await get_chat_history(db, chat, archive)
+
+    assert len(history) == 3
+    assert stats.count == 2
+    assert stats.duration > 0
+    assert not any("message 0" in statement for statement in stats.statements)
+
+
+async def test_lazy_loads_exceed_the_budget(db, chat_id):
+    with pytest.raises(QueryBudgetExceeded, match="3 queries, more than the 2"):
+        with query_budget(2):
+            chat = await chat_crud.get(db, id=chat_id)
+            messages = await chat.awaitable_attrs.messages
+            for message in messages:
+                await message.awaitable_attrs.user
+
+
+async def test_repeated_statements_are_flagged(db, chat_id):
+    with track_queries() as outer:
+        chat = await chat_crud.get(db, id=chat_id)
+        with track_queries() as inner:
+            # One query per message: the N+1 shape
+            for message in await message_crud.get_chat_messages(db, chat_id=chat_id):
+                await message_crud.get(db, id=message.message_id)
+
+    assert (outer.count, inner.count) == (5, 4)
+    ((statement, times),) = inner.repeated(3).items()
+    assert times == 3 and "WHERE messages.message_id = ?" in statement
+    assert chat is not None and outer.repeated(4) == {}
+
+
+async def test_slow_statements_are_logged_and_kept(db, caplog):
+    with caplog.at_level(logging.WARNING, logger="common.db.instrumentation"):
+        with track_queries() as stats:
+            await db.execute(text("SELECT pg_sleep(0.06)"))
+            await db.execute(text("SELECT 1"))
+
+    assert stats.count == 2
+    ((statement, duration),) = stats.slow
+    assert statement == "SELECT pg_sleep(?)" and duration >= 0.06
+    assert "Slow query" in caplog.text and "pg_sleep(?)" in caplog.text
+    assert stats.warnings(repeat_threshold=5) == [
+        f"slow ({duration * 1000:.1f} ms): SELECT pg_sleep(?)"
+    ]
@@ -0,0 +1,97 @@
+import asyncio
+import uuid
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from common.db.models import Base
+from common.db.notify import ChatEvents
+
+
+@pytest.fixture
+def chat_tables(pg_url):
+    engine = create_engine(pg_url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    yield engine
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+
+
+@pytest.fixture
+async def engine(chat_tables, pg_url):
+    engine = create_async_engine(
+        pg_url.replace("postgresql+psycopg2://", "postgresql+asyncpg://")
+    )
+    yield engine
+    await engine.dispose()
+
+
+@pytest.fixture
+def chats(chat_tables):
+    user_id, chat_ids = uuid.uuid4(), [uuid.uuid4(), uuid.uuid4()]
+    with chat_tables.begin() as conn:
+        conn.execute(
+            text("INSERT INTO users (user_id, username, email) VALUES (:u, 'u', 'e')"),
+            {"u": user_id},
+        )
+        for chat_id in chat_ids:
+            conn.execute(
+                text("INSERT INTO chats (chat_id, user_id) VALUES (:c, :u)"),
+                {"c": chat_id, "u": user_id},
+            )
+    return user_id, chat_ids
+
+
+async def add_message(engine, user_id, chat_id):
+    async with engine.begin() as conn:
+        await conn.execute(
+            text(
+                "INSERT INTO messages (message_id, chat_id, user_id, content, "
+                "user_message) VALUES (gen_random_uuid(), :c, :u, 'hi', false)"
+            ),
+            {"c": chat_id, "u": user_id},
+        )
+
+
+async def test_committed_messages_wake_that_chats_waiters(engine, chats):
+    user_id, (chat_id, other_chat_id) = chats
+    events = ChatEvents(engine)
+    await events.start()
+    try:
+        assert events.listening
+        with (
+            events.subscribe(chat_id) as woken,
+            events.subscribe(other_chat_id) as idle,
+        ):
+            assert events.waiting == 2
+            await add_message(engine, user_id, chat_id)
+            assert await events.wait(woken, 5)
+            assert not await events.wait(idle, 0.1)
+        assert events.waiting == 0
+    finally:
+        await events.stop()
+
+
+async def test_waiters_poll_without_a_listener(engine, chats):
+    _, (chat_id, _) = chats
+    events = ChatEvents(engine, poll_interval=0.05)
+
+    with events.subscribe(chat_id) as event:
+        started = asyncio.get_running_loop().time()
+        # Not notified, but worth reading the chat again
+        assert await events.wait(event, 10)
+    assert asyncio.get_running_loop().time() - started < 1
+
+
+async def test_stopping_wakes_waiters(engine, chats):
+    _, (chat_id, _) = chats
+    events = ChatEvents(engine)
+    await events.start()
+    with events.subscribe(chat_id) as event:
+        waiting = asyncio.create_task(events.wait(event, 10))
+        await asyncio.sleep(0.05)
+        await events.stop()
+        assert await asyncio.wait_for(waiting, 1)
+    assert not events.listening
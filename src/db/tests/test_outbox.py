@@ -0,0 +1,156 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from common.db.models import Base, OutboxMessage
+from common.messaging.memory import InMemoryTransport
+from common.messaging.outbox import OutboxRelay, enqueue
+from common.messaging.transport import OutgoingMessage
+
+
+@pytest.fixture
+def outbox_tables(pg_url):
+    engine = create_engine(pg_url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    yield engine
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+
+
+@pytest.fixture
+async def engine(outbox_tables, pg_url):
+    engine = create_async_engine(
+        pg_url.replace("postgresql+psycopg2://", "postgresql+asyncpg://")
+    )
+    yield engine
+    await engine.dispose()
+
+
+async def enqueue_messages(engine, count, queue="chat_queue"):
+    async with AsyncSession(engine) as db:
+        for i in range(count):
+            message = OutgoingMessage(
+                f"message {i}".encode(),
+                headers={"n": i},
+                content_type="application/msgpack",
+                content_encoding="zstd",
+                correlation_id=f"corr-{i}",
+                reply_to="amq.gen-callback",
+                message_id=f"m-{i}",
+            )
+            enqueue(db, queue, message)
+        await db.commit()
+
+
+async def outbox_size(engine):
+    async with AsyncSession(engine) as db:
+        return await db.scalar(select(func.count()).select_from(OutboxMessage))
+
+
+async def received(transport, queue="chat_queue"):
+    messages = []
+    while (delivery := await transport.get(queue)) is not None:
+        messages.append(delivery)
+    return messages
+
+
+async def test_relay_publishes_batches_in_order_and_deletes_them(engine):
+    transport = InMemoryTransport()
+    relay = OutboxRelay(transport, engine, batch_size=3)
+    await enqueue_messages(engine, 5)
+
+    assert await relay.relay_once() == 3
+    assert await outbox_size(engine) == 2
+    assert await relay.drain() == 2
+    assert await outbox_size(engine) == 0
+
+    messages = await received(transport)
+    assert [m.body for m in messages] == [f"message {i}".encode() for i in range(5)]
+    first = messages[0]
+    assert first.headers == {"n": 0}
+    assert (first.content_type, first.content_encoding) == (
+        "application/msgpack",
+        "zstd",
+    )
+    assert (first.correlation_id, first.reply_to, first.message_id) == (
+        "corr-0",
+        "amq.gen-callback",
+        "m-0",
+    )
+
+
+async def test_rows_stay_in_the_outbox_when_publishing_fails(engine):
+    transport = InMemoryTransport()
+    transport.publish_batch = AsyncMock(side_effect=ConnectionError("broker gone"))
+    relay = OutboxRelay(transport, engine)
+    await enqueue_messages(engine, 2)
+
+    with pytest.raises(ConnectionError):
+        await relay.relay_once()
+
+    assert await outbox_size(engine) == 2
+
+
+async def test_rolled_back_messages_are_never_published(engine):
+    transport = InMemoryTransport()
+    relay = OutboxRelay(transport, engine)
+    async with AsyncSession(engine) as db:
+        enqueue(db, "chat_queue", OutgoingMessage(b"rolled back"))
+        await db.rollback()
+
+    assert await relay.drain() == 0
+    assert await received(transport) == []
+
+
+async def test_concurrent_relays_publish_each_row_once(engine):
+    transport = InMemoryTransport()
+    relays = [OutboxRelay(transport, engine, batch_size=7) for _ in range(4)]
+    await enqueue_messages(engine, 100)
+
+    await asyncio.gather(*(relay.drain() for relay in relays))
+
+    bodies = [m.body for m in await received(transport)]
+    assert sorted(bodies) == sorted(f"message {i}".encode() for i in range(100))
+
+
+async def test_notification_wakes_the_relay(engine):
+    transport = InMemoryTransport()
+    # A poll interval far beyond the test: only NOTIFY can trigger the relay
+    relay = OutboxRelay(transport, engine, poll_interval=60)
+    await relay.start()
+    try:
+        assert relay.listening
+        await asyncio.sleep(0.05)
+        await enqueue_messages(engine, 1)
+        for _ in range(100):
+            if transport.broker.depth("chat_queue"):
+                break
+            await asyncio.sleep(0.02)
+        assert transport.broker.depth("chat_queue") == 1
+    finally:
+        await relay.stop()
+    assert not relay.listening
+
+
+async def test_relay_polls_without_a_listener(engine, monkeypatch):
+    transport = InMemoryTransport()
+    relay = OutboxRelay(transport, engine, poll_interval=0.05)
+
+    async def cannot_listen():
+        pass
+
+    monkeypatch.setattr(relay, "_listen", cannot_listen)
+    await relay.start()
+    try:
+        await enqueue_messages(engine, 1)
+        for _ in range(100):
+            if transport.broker.depth("chat_queue"):
+                break
+            await asyncio.sleep(0.02)
+        assert transport.broker.depth("chat_queue") == 1
+    finally:
+        await relay.stop()
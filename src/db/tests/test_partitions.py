@@ -0,0 +1,113 @@
+import uuid
+from datetime import date
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from common.db.models import Base
+from db.core.partitions import (
+    RetentionPolicy,
+    add_months,
+    create_default_partition,
+    create_month_partition,
+    expired_partitions,
+    month_start,
+    parse_partition_name,
+    partition_name,
+)
+
+
+def test_add_months_crosses_year_boundaries():
+    assert add_months(date(2026, 11, 17), 3) == date(2027, 2, 1)
+    assert add_months(date(2026, 1, 31), -1) == date(2025, 12, 1)
+    assert add_months(date(2026, 5, 1), 0) == date(2026, 5, 1)
+
+
+def test_partition_names_round_trip():
+    name = partition_name("logs", month_start(date(2026, 3, 9)))
+    assert name == "logs_p2026_03"
+    assert parse_partition_name(name) == ("logs", date(2026, 3, 1))
+    assert parse_partition_name("logs_default") is None
+
+
+def test_expired_partitions_keeps_current_window():
+    partitions = {
+        date(2026, m, 1): partition_name("logs", date(2026, m, 1)) for m in range(1, 11)
+    }
+    # Keeping 3 months in October keeps August, September and October.
+    expired = expired_partitions(partitions, keep_months=3, today=date(2026, 10, 19))
+    assert expired == [partition_name("logs", date(2026, m, 1)) for m in range(1, 8)]
+
+
+def test_retention_policy_validates_mode():
+    with pytest.raises(ValueError):
+        RetentionPolicy(table="logs", keep_months=3, mode="truncate")
+    with pytest.raises(ValueError):
+        RetentionPolicy(table="logs", keep_months=0)
+
+
+@pytest.fixture
+def partitioned_engine(pg_url):
+    """The model schema with messages partitioned by month, as migration 003 does."""
+    engine = create_engine(pg_url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE messages RENAME TO messages_flat"))
+        conn.execute(
+            text(
+                "CREATE TABLE messages (LIKE messages_flat INCLUDING DEFAULTS "
+                'INCLUDING GENERATED) PARTITION BY RANGE ("timestamp")'
+            )
+        )
+        conn.execute(text("DROP TABLE messages_flat"))
+        conn.execute(
+            text(
+                "CREATE TRIGGER messages_update_chat_summary AFTER INSERT "
+                "ON messages FOR EACH ROW EXECUTE FUNCTION chats_on_message_insert()"
+            )
+        )
+        create_default_partition(conn, "messages")
+    yield engine
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+
+
+def test_rows_stranded_in_default_move_to_their_new_partition(partitioned_engine):
+    user_id, chat_id = uuid.uuid4(), uuid.uuid4()
+    with partitioned_engine.begin() as conn:
+        conn.execute(
+            text("INSERT INTO users (user_id, username, email) VALUES (:u, 'u', 'e')"),
+            {"u": user_id},
+        )
+        conn.execute(
+            text("INSERT INTO chats (chat_id, user_id) VALUES (:c, :u)"),
+            {"c": chat_id, "u": user_id},
+        )
+        conn.execute(
+            text(
+                "INSERT INTO messages "
+                "(message_id, chat_id, user_id, content, user_message, timestamp) "
+                "VALUES (gen_random_uuid(), :c, :u, 'stranded words', true, "
+                "'2026-03-09')"
+            ),
+            {"c": chat_id, "u": user_id},
+        )
+
+    with partitioned_engine.begin() as conn:
+        name = create_month_partition(conn, "messages", date(2026, 3, 1))
+
+    with partitioned_engine.connect() as conn:
+        moved = conn.execute(
+            text(f"SELECT search_vector::text FROM {name}")
+        ).scalar_one()
+        left = conn.execute(text("SELECT count(*) FROM messages_default")).scalar()
+        count = conn.execute(
+            text("SELECT message_count FROM chats WHERE chat_id = :c"), {"c": chat_id}
+        ).scalar_one()
+    assert name == "messages_p2026_03"
+    # The generated column was recomputed in the new partition
+    assert "'strand'" in moved
+    assert left == 0
+    # Moving the row does not count it again
+    assert count == 1
@@ -0,0 +1,258 @@
+"""Query-plan regression tests for common.db.crud.
+
+Each access path is run against a recording session that captures the SELECT
+statements it issues instead of executing them. The statements are then
+EXPLAINed against a seeded PostgreSQL database with ``enable_seqscan`` turned
+off: the planner still falls back to a sequential scan when no index can serve
+a query, so any ``Seq Scan`` node left in a plan means a missing index rather
+than a small-table shortcut.
+
+Run with ``TEST_DATABASE_URL`` pointing at a disposable database.
+"""
+
+import asyncio
+import json
+import uuid
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.sql import Select
+
+from common.db import crud
+from common.db.ids import uuid7
+from common.db.models import Base
+
+SEED_USERS = 50
+SEED_CHATS_PER_USER = 20
+SEED_MESSAGES_PER_CHAT = 20
+
+
+class _EmptyResult:
+    def scalar_one_or_none(self):
+        return None
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return []
+
+
+class RecordingSession:
+    """Stands in for an AsyncSession and records every statement executed."""
+
+    def __init__(self):
+        self.statements = []
+
+    async def execute(self, statement, *args, **kwargs):
+        self.statements.append(statement)
+        return _EmptyResult()
+
+
+# (name, callable(session, ids) -> coroutine). Add an entry for every new query
+# in common.db.crud so its plan is covered.
+ACCESS_PATHS = [
+    ("user.get", lambda db, ids: crud.user.get(db, id=ids["user_id"])),
+    ("chat.get", lambda db, ids: crud.chat.get(db, id=ids["chat_id"])),
+    ("message.get", lambda db, ids: crud.message.get(db, id=ids["message_id"])),
+    ("log.get", lambda db, ids: crud.log.get(db, id=ids["log_id"])),
+    (
+        "chat.list_for_user",
+        lambda db, ids: crud.chat.list_for_user(db, user_id=ids["user_id"]),
+    ),
+    (
+        "chat.list_for_user_before",
+        lambda db, ids: crud.chat.list_for_user(
+            db,
+            user_id=ids["user_id"],
+            before=(ids["last_message_at"], ids["chat_id"]),
+        ),
+    ),
+    (
+        "message.get_chat_messages",
+        lambda db, ids: crud.message.get_chat_messages(db, chat_id=ids["chat_id"]),
+    ),
+    (
+        "message.get_chat_messages_after",
+        lambda db, ids: crud.message.get_chat_messages(
+            db, chat_id=ids["chat_id"], after=ids["message_id"], limit=50
+        ),
+    ),
+    (
+        "message.get_chat_messages_overlap",
+        lambda db, ids: crud.message.get_chat_messages(
+            db, chat_id=ids["chat_id"], after=uuid7(), limit=50, overlap=5
+        ),
+    ),
+    (
+        "message.get_many",
+        lambda db, ids: crud.message.get_many(
+            db, ids=[ids["message_id"], uuid.uuid4()]
+        ),
+    ),
+    (
+        "message.search",
+        lambda db, ids: crud.message.search(
+            db, user_id=ids["user_id"], query="message -missing"
+        ),
+    ),
+    (
+        "message.search_before",
+        lambda db, ids: crud.message.search(
+            db,
+            user_id=ids["user_id"],
+            query='"message 1" or 2',
+            before=(0.1, ids["message_id"]),
+        ),
+    ),
+    (
+        "log.get_chat_logs",
+        lambda db, ids: crud.log.get_chat_logs(db, chat_id=ids["chat_id"]),
+    ),
+    (
+        "processed_message.seen",
+        lambda db, ids: crud.processed_message.seen(db, key=str(ids["message_id"])),
+    ),
+    ("outbox.next_batch", lambda db, ids: crud.outbox.next_batch(db, limit=100)),
+]
+
+
+def index_conditions(plan: dict) -> dict[str, list[str]]:
+    """Return the Index Cond of every index scan in a JSON plan, by index."""
+    found = {}
+    if "Index Cond" in plan:
+        found.setdefault(plan["Index Name"], []).append(plan["Index Cond"])
+    for child in plan.get("Plans", []):
+        for name, conditions in index_conditions(child).items():
+            found.setdefault(name, []).extend(conditions)
+    return found
+
+
+def seq_scans(plan: dict) -> list[str]:
+    """Return the relations read by Seq Scan nodes anywhere in a JSON plan."""
+    found = []
+    if plan.get("Node Type") == "Seq Scan":
+        found.append(plan.get("Relation Name", "?"))
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans(child))
+    return found
+
+
+@pytest.fixture(scope="module")
+def seeded_engine(pg_url):
+    engine = create_engine(pg_url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "INSERT INTO users (user_id, username, email) "
+                "SELECT gen_random_uuid(), 'user' || i, 'user' || i || '@test' "
+                "FROM generate_series(1, :n) AS i"
+            ),
+            {"n": SEED_USERS},
+        )
+        conn.execute(
+            text(
+                "INSERT INTO chats (chat_id, user_id) "
+                "SELECT gen_random_uuid(), u.user_id "
+                "FROM users u, generate_series(1, :n)"
+            ),
+            {"n": SEED_CHATS_PER_USER},
+        )
+        conn.execute(
+            text(
+                "INSERT INTO messages "
+                "(message_id, chat_id, user_id, content, user_message, timestamp) "
+                "SELECT gen_random_uuid(), c.chat_id, c.user_id, 'message ' || i, "
+                "i % 2 = 0, now() - make_interval(mins => i) "
+                "FROM chats c, generate_series(1, :n) AS i"
+            ),
+            {"n": SEED_MESSAGES_PER_CHAT},
+        )
+        conn.execute(
+            text(
+                "INSERT INTO logs (log_id, user_id, chat_id, action, timestamp) "
+                "SELECT gen_random_uuid(), user_id, chat_id, 'send_message', "
+                "timestamp FROM messages"
+            )
+        )
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # VACUUM also merges GIN pending lists into the indexes, as autovacuum
+        # does in production; unmerged, they make every GIN scan look costly
+        conn.execute(text("VACUUM ANALYZE"))
+    yield engine
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+
+
+@pytest.fixture(scope="module")
+def seeded_ids(seeded_engine):
+    with seeded_engine.connect() as conn:
+        row = conn.execute(
+            text(
+                "SELECT m.chat_id, m.user_id, m.message_id, l.log_id, "
+                "c.last_message_at "
+                "FROM messages m JOIN logs l USING (chat_id) "
+                "JOIN chats c USING (chat_id) LIMIT 1"
+            )
+        ).one()
+    return dict(row._mapping)
+
+
+def explain(engine, statement: Select) -> dict:
+    sql = statement.compile(
+        dialect=engine.dialect, compile_kwargs={"literal_binds": True}
+    )
+    with engine.connect() as conn:
+        conn.execute(text("SET enable_seqscan = off"))
+        result = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar_one()
+    if isinstance(result, str):
+        result = json.loads(result)
+    return result[0]["Plan"]
+
+
+@pytest.mark.parametrize(
+    "name,query", ACCESS_PATHS, ids=[name for name, _ in ACCESS_PATHS]
+)
+def test_access_path_uses_index(seeded_engine, seeded_ids, name, query):
+    session = RecordingSession()
+    asyncio.run(query(session, seeded_ids))
+
+    selects = [s for s in session.statements if isinstance(s, Select)]
+    assert selects, f"{name} issued no SELECT statements"
+    for statement in selects:
+        plan = explain(seeded_engine, statement)
+        assert not seq_scans(plan), f"{name} regressed to a sequential scan:\n{plan}"
+
+
+def test_search_matches_user_and_words_in_one_index(seeded_engine, seeded_ids):
+    session = RecordingSession()
+    # "17" is in one of every twenty messages of every user: neither the user
+    # nor the words alone narrow the search down
+    asyncio.run(crud.message.search(session, user_id=seeded_ids["user_id"], query="17"))
+    (statement,) = [s for s in session.statements if isinstance(s, Select)]
+
+    conditions = index_conditions(explain(seeded_engine, statement))
+
+    searched = [c for cs in conditions.values() for c in cs if "search_vector" in c]
+    assert searched, f"search did not use a text search index: {conditions}"
+    assert all("user_id" in condition for condition in searched), conditions
+
+
+def test_seq_scans_walks_nested_plans():
+    plan = {
+        "Node Type": "Nested Loop",
+        "Plans": [
+            {"Node Type": "Index Scan", "Relation Name": "chats"},
+            {"Node Type": "Seq Scan", "Relation Name": "messages"},
+        ],
+    }
+    assert seq_scans(plan) == ["messages"]
+    assert seq_scans({"Node Type": "Index Only Scan"}) == []
+
+
+def test_recording_session_captures_statements():
+    session = RecordingSession()
+    asyncio.run(crud.log.get_chat_logs(session, chat_id=uuid.uuid4()))
+    assert len(session.statements) == 1
@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from common.db.connect import ReplicaRouter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class StubRouter(ReplicaRouter):
+    """Router whose lag checks come from a dict instead of a live replica."""
+
+    def __init__(self, lags, **kwargs):
+        super().__init__("primary", list(lags), **kwargs)
+        self.lags = lags
+        self.checks = 0
+
+    async def measure_lag(self, replica):
+        self.checks += 1
+        lag = self.lags[replica]
+        if isinstance(lag, Exception):
+            raise lag
+        return lag
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+async def routers():
+    started = []
+
+    def make(lags, **kwargs):
+        router = StubRouter(lags, **kwargs)
+        started.append(router)
+        return router
+
+    yield make
+    for router in started:
+        await router.stop()
+
+
+async def checked(router):
+    """Choose once, which starts the lag checks, and let the first one finish."""
+    chosen = await router.choose()
+    await asyncio.sleep(0.01)
+    return chosen
+
+
+async def test_without_replicas_reads_go_to_primary(routers, clock):
+    router = routers({}, clock=clock)
+    assert await router.choose() == "primary"
+
+
+async def test_healthy_replicas_are_used_round_robin(routers, clock):
+    router = routers({"r1": 0.0, "r2": 0.5}, max_lag=1, clock=clock)
+    # Until the first check completes, reads go to the primary (r1's turn)
+    assert await checked(router) == "primary"
+    assert [await router.choose() for _ in range(4)] == ["r2", "r1", "r2", "r1"]
+    # One lag check per replica within the check interval
+    assert router.checks == 2
+
+
+async def test_lagging_or_broken_replicas_fall_back(routers, clock):
+    router = routers(
+        {"r1": 30.0, "r2": ConnectionError("down")},
+        max_lag=5,
+        check_interval=0.01,
+        clock=clock,
+    )
+    await checked(router)
+    assert await router.choose() == "primary"
+
+    router.lags["r1"] = 0.1
+    await asyncio.sleep(0.05)
+    assert await router.choose() == "r1"
+
+
+async def test_reads_never_wait_for_a_lag_check(clock):
+    hung = asyncio.Event()
+
+    class HungRouter(StubRouter):
+        async def measure_lag(self, replica):
+            await hung.wait()
+
+    router = HungRouter({"r1": 0.0}, max_lag=5, clock=clock)
+    try:
+        for _ in range(3):
+            assert await asyncio.wait_for(router.choose(), 0.1) == "primary"
+    finally:
+        await router.stop()
+
+
+async def test_recent_writes_stick_to_primary(routers, clock):
+    router = routers({"r1": 0.0}, sticky_seconds=10, clock=clock)
+    await checked(router)
+    router.note_write("chat-1")
+
+    assert await router.choose(["chat-1"]) == "primary"
+    assert await router.choose(["chat-2"]) == "r1"
+
+    clock.now += 10
+    assert await router.choose(["chat-1"]) == "r1"
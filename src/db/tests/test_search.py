@@ -0,0 +1,82 @@
+import uuid
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from common.db import crud
+from common.db.ids import uuid7
+from common.db.models import Base
+
+CONTENTS = [
+    "I keep skipping my morning run",
+    "Running in the morning feels hard, running at night is easier",
+    "Let's talk about sleep instead",
+    "My run yesterday went well",
+]
+
+
+@pytest.fixture
+def search_engine(pg_url):
+    engine = create_engine(pg_url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    yield engine
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+
+
+async def test_search_ranks_highlights_and_pages(search_engine, pg_url):
+    user_id, other_user, chat_id = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    with search_engine.begin() as conn:
+        conn.execute(
+            text(
+                "INSERT INTO users (user_id, username, email) "
+                "VALUES (:u, 'u', 'u@e'), (:o, 'o', 'o@e')"
+            ),
+            {"u": user_id, "o": other_user},
+        )
+        conn.execute(
+            text("INSERT INTO chats (chat_id, user_id) VALUES (:c, :u)"),
+            {"c": chat_id, "u": user_id},
+        )
+        conn.execute(
+            text(
+                "INSERT INTO messages "
+                "(message_id, chat_id, user_id, content, user_message) "
+                "VALUES (:m, :c, :u, :content, true)"
+            ),
+            [
+                {"m": uuid7(), "c": chat_id, "u": user_id, "content": content}
+                for content in CONTENTS
+            ],
+        )
+
+    engine = create_async_engine(
+        pg_url.replace("postgresql+psycopg2://", "postgresql+asyncpg://")
+    )
+    try:
+        async with AsyncSession(engine) as db:
+            rows = await crud.message.search(db, user_id=user_id, query="running")
+            # Stemming matches run/running; the double mention ranks first
+            assert [row.snippet.count("<mark>") for row in rows[:1]] == [2]
+            assert len(rows) == 3
+            assert "sleep" not in " ".join(row.snippet for row in rows)
+
+            first = await crud.message.search(
+                db, user_id=user_id, query="running", limit=2
+            )
+            last = first[-1]
+            rest = await crud.message.search(
+                db,
+                user_id=user_id,
+                query="running",
+                before=(last.rank, last.message_id),
+                limit=2,
+            )
+            assert [r.message_id for r in first + rest] == [r.message_id for r in rows]
+
+            assert not await crud.message.search(db, user_id=other_user, query="run")
+            assert not await crud.message.search(db, user_id=user_id, query="the")
+    finally:
+        await engine.dispose()
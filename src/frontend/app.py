@@ -1,21 +1,114 @@
 import logging
 import os
-import uuid
 
+import msgpack
 import requests
 import streamlit as st
 from dotenv import load_dotenv
-from streamlit_autorefresh import st_autorefresh
+from requests.adapters import HTTPAdapter
 
 load_dotenv()
 
 # Get API URL from environment, fallback to api:8000 for docker
 API_URL = os.getenv("API_URL", "http://api:8000")
+# Seconds the API holds a history request open waiting for a new message
+CHAT_POLL_WAIT = float(os.getenv("CHAT_POLL_WAIT", "25"))
+# Long polls made for a reply that was still pending when the send returned
+CHAT_POLL_ATTEMPTS = int(os.getenv("CHAT_POLL_ATTEMPTS", "4"))
+# Messages requested per history page (the API allows up to 1000)
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", "200"))
+# Most recent messages rendered; earlier ones are shown on request
+CHAT_RENDER_WINDOW = int(os.getenv("CHAT_RENDER_WINDOW", "50"))
 logger = logging.getLogger(__name__)
 logger.info(f"Using API URL: {API_URL}")
 
 logging.basicConfig(level=logging.INFO)
 
+
+@st.cache_resource
+def api_session():
+    """One keep-alive HTTP session shared by every browser session and rerun."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=20)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def reset_chat(chat_id):
+    st.session_state.chat_id = chat_id
+    st.session_state.messages = []
+    # message_id of the newest message held locally, and the history ETag
+    # the API sent for the messages after it
+    st.session_state.cursor = None
+    st.session_state.history_etag = None
+    st.session_state.render_window = CHAT_RENDER_WINDOW
+
+
+def sync_messages(wait=0):
+    """Append the chat's messages after the local cursor; returns them.
+
+    Unchanged history costs the API a 304 from the chat row alone. With
+    `wait`, the API holds the request until a message is committed. The API
+    also re-sends the last few seconds before the cursor, in case a message
+    there committed late; messages already held are skipped.
+    """
+    new_messages = []
+    held = {message["message_id"] for message in st.session_state.messages}
+    while True:
+        params = {"limit": CHAT_PAGE_SIZE}
+        if st.session_state.cursor:
+            params["after"] = st.session_state.cursor
+        if wait:
+            params["wait"] = wait
+        # MessagePack is smaller and quicker to parse than JSON
+        headers = {"Accept": "application/msgpack, application/json;q=0.9"}
+        if st.session_state.history_etag:
+            headers["If-None-Match"] = st.session_state.history_etag
+        response = api_session().get(
+            f"{API_URL}/api/v1/chats/{st.session_state.chat_id}",
+            params=params,
+            headers=headers,
+            timeout=wait + 10,
+        )
+        response.raise_for_status()
+        if response.status_code == 304:
+            return new_messages
+        if response.headers.get("Content-Type") == "application/msgpack":
+            page = msgpack.unpackb(response.content)
+        else:
+            page = response.json()
+        fresh = [message for message in page if message["message_id"] not in held]
+        held.update(message["message_id"] for message in fresh)
+        st.session_state.messages.extend(fresh)
+        new_messages.extend(fresh)
+        if page and page[-1] in fresh:
+            st.session_state.cursor = page[-1]["message_id"]
+            # The tag was for the old cursor and never matches the new one
+            st.session_state.history_etag = None
+        else:
+            # Same cursor, so the tag stays valid for the next request
+            st.session_state.history_etag = response.headers.get("ETag")
+            if wait and not fresh and st.session_state.history_etag:
+                # Only messages already held: wait again, for a new one
+                continue
+            return new_messages
+        if len(page) < CHAT_PAGE_SIZE:
+            return new_messages
+        # A full page: fetch the rest right away
+        wait = 0
+
+
+def wait_for_reply():
+    """Long-poll until the assistant's reply is appended; returns its text."""
+    for _ in range(CHAT_POLL_ATTEMPTS):
+        new_messages = sync_messages(CHAT_POLL_WAIT)
+        replies = [m for m in new_messages if m["role"] == "assistant"]
+        if replies:
+            return replies[-1]["content"]
+    return None
+
+
 st.set_page_config(page_title="CoachBot Chat", page_icon="🤖", layout="centered")
 
 st.title("🤖 CoachBot Chat")
@@ -27,7 +120,7 @@ if "user_id" not in st.session_state:
     st.session_state.user_id = "d62a2f99-e89b-43ad-b4ba-ec3826266410"
 
 if "chat_id" not in st.session_state:
-    st.session_state.chat_id = None
+    reset_chat(None)
 
 # New Chat Button
 if st.button("New Chat"):
@@ -35,12 +128,12 @@ if st.button("New Chat"):
         f"UI Event: 'New Chat' button clicked by user {st.session_state.user_id}"
     )
     # Send request to create a new chat
-    response = requests.post(
+    response = api_session().post(
         f"{API_URL}/api/v1/chats", json={"user_id": st.session_state.user_id}
     )
     if response.status_code == 200:
         chat_data = response.json()
-        st.session_state.chat_id = chat_data["chat_id"]
+        reset_chat(chat_data["chat_id"])
         logger.info(
             f"New Chat: User {st.session_state.user_id} started chat {st.session_state.chat_id}."
         )
@@ -55,37 +148,32 @@ if st.button("New Chat"):
 if st.session_state.chat_id:
     st.write(f"Chat ID: {st.session_state.chat_id}")
 
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
-
-    # If at least one message exists, start polling for latest messages every 5 seconds.
-    if st.session_state.messages:
-        # Import st_autorefresh if not already imported
-        from streamlit_autorefresh import st_autorefresh
-
-        st_autorefresh(interval=5000, limit=100, key="chat_autorefresh")
-
-        poll_url = f"{API_URL}/api/v1/chats/{st.session_state.chat_id}"
-        try:
-            response = requests.get(poll_url)
-            response.raise_for_status()
-            st.session_state.messages = response.json()
-        except Exception as e:
-            st.error(f"Error polling chat messages: {e}")
-
-    if st.session_state.messages:
+    # Only messages after the cursor are fetched; replies still pending are
+    # waited for with a long poll below
+    try:
+        sync_messages()
+    except Exception as e:
+        st.error(f"Error polling chat messages: {e}")
+
+    messages = st.session_state.messages
+    hidden = max(0, len(messages) - st.session_state.render_window)
+    if hidden:
+        if st.button(f"Show earlier messages ({hidden} hidden)"):
+            st.session_state.render_window += CHAT_RENDER_WINDOW
+            st.rerun()
         logger.info(
-            f"UI Event: Rendering {len(st.session_state.messages)} messages for chat {st.session_state.chat_id} for user {st.session_state.user_id}."
+            f"UI Event: Rendering the last {len(messages) - hidden} of "
+            f"{len(messages)} messages for chat {st.session_state.chat_id} "
+            f"for user {st.session_state.user_id}."
         )
 
-    for message in st.session_state.messages:
+    for message in messages[hidden:]:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
 
     if prompt := st.chat_input("What would you like to ask?"):
         with st.chat_message("user"):
             st.markdown(prompt)
-        st.session_state.messages.append({"role": "user", "content": prompt})
         logger.info(
             f"UI Event: User message submitted in chat {st.session_state.chat_id}. User: {st.session_state.user_id}, Content: {prompt}"
         )
@@ -94,7 +182,7 @@ if st.session_state.chat_id:
             logger.info(
                 f"UI Event: Sending user message for chat {st.session_state.chat_id}. User: {st.session_state.user_id}, Content: {prompt}"
             )
-            response = requests.post(
+            response = api_session().post(
                 f"{API_URL}/api/v1/chat/message",
                 json={
                     "chat_id": st.session_state.chat_id,
@@ -104,16 +192,22 @@ if st.session_state.chat_id:
             )
             response.raise_for_status()
             response_data = response.json()
-            assistant_response = response_data.get("content", "No response received")
+            if response.status_code == 202:
+                # The worker is still answering; wait for its reply to land
+                with st.spinner("Waiting for the coach..."):
+                    assistant_response = wait_for_reply()
+            else:
+                # The saved message and reply are appended to the local
+                # history, like any other new messages
+                sync_messages()
+                assistant_response = response_data.get("content")
+            assistant_response = assistant_response or "No response received"
 
             with st.chat_message("assistant"):
                 st.markdown(assistant_response)
             logger.info(
                 f"UI Event: Displayed assistant response for chat {st.session_state.chat_id}"
             )
-            st.session_state.messages.append(
-                {"role": "assistant", "content": assistant_response}
-            )
 
         except requests.exceptions.RequestException as e:
             logger.error(f"Error communicating with the API: {str(e)}", exc_info=True)
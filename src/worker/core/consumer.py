@@ -0,0 +1,307 @@
+"""asyncio queue consumer with fair, bounded concurrent processing.
+
+The worker consumes one queue per priority lane (see ``core.scheduling``)
+through a ``common.messaging`` transport, RabbitMQ or in-process. The
+broker delivers up to ``prefetch`` unacknowledged messages per lane to this
+process; they are buffered in a ``FairScheduler``, which starts each in its own
+handler task, at most ``concurrency`` at once, highest lane first and
+round-robin across users within a lane. Fairness has to start before the
+buffer, though: with a plain prefetch window, one user's backlog takes every
+credit and everyone else's messages wait at the broker behind it. So each
+user holds at most ``user_max_prefetch`` deliveries of a lane, running or
+buffered; a delivery beyond that is deferred, republished to its queue after
+``defer_delay`` seconds and acked, which hands its credit to the messages
+behind it. A deferred message may start after a later one from the same user.
+A message is acked only after its
+handler returns, i.e. after its results are persisted. A failed message is
+handed to its lane's retry topology (delayed retry tiers, then the dead-letter
+queue) or, without one, nacked back onto the queue. If the message has a
+``reply_to`` queue (an RPC request from the API), the handler's result is
+published there before the ack, in the format the request asked for. Each
+handler runs inside ``track_queries()``; the message is logged with the SQL it
+ran, and slow or repeated statements with a warning.
+
+Bodies are decoded by a ``PayloadCodec`` according to their content type
+(MessagePack or JSON, optionally zstd-compressed), into ``payload_type`` when
+the consumer has one and into a dict otherwise. A body that cannot be decoded
+fails permanently.
+
+``stop()`` drains gracefully: it stops taking deliveries, cancels the broker
+consumers (buffered messages that have not started go back to their queues),
+waits for the in-flight handlers to finish and settle their messages, then
+disconnects.
+"""
+
+import asyncio
+import logging
+from contextlib import AsyncExitStack
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Optional,
+    Sequence,
+    Type,
+    Union,
+)
+
+from common.db.instrumentation import QueryStats, track_queries
+from common.messaging.payloads import Payload, PayloadCodec, PayloadError
+from common.messaging.transport import Delivery, OutgoingMessage, Transport
+
+from .idempotency import IDEMPOTENCY_KEY
+from .retry import PermanentFailure
+from .scheduling import FairScheduler, Lane
+
+logger = logging.getLogger(__name__)
+
+# A handler may return a result, sent to the message's reply_to queue if set
+Message = Union[Payload, Dict[str, Any]]
+Handler = Callable[[Any], Awaitable[Optional[Message]]]
+Decoded = Union[Message, Exception]
+
+_default_codec = PayloadCodec()
+
+
+def decode(
+    delivery: Delivery,
+    codec: Optional[PayloadCodec] = None,
+    payload_type: Optional[Type[Payload]] = None,
+) -> tuple[str, Decoded]:
+    """The scheduling key and payload of a delivery, or why it is unreadable."""
+    try:
+        message = (codec or _default_codec).decode(delivery)
+    except PayloadError as e:
+        return "", PermanentFailure(str(e))
+    if not isinstance(message, dict):
+        return "", PermanentFailure("Message payload is not a map")
+    if delivery.message_id and not message.get(IDEMPOTENCY_KEY):
+        message[IDEMPOTENCY_KEY] = delivery.message_id
+    user = str(message.get("user_id") or "")
+    if payload_type is not None:
+        try:
+            return user, payload_type.from_dict(message)
+        except PayloadError as e:
+            return user, PermanentFailure(str(e))
+    return user, message
+
+
+class Consumer:
+    """Feeds lane deliveries to an async handler, ``concurrency`` at a time."""
+
+    def __init__(
+        self,
+        handler: Handler,
+        *,
+        transport: Transport,
+        lanes: Sequence[Lane],
+        prefetch: int = 32,
+        concurrency: int = 32,
+        user_max_in_flight: int = 2,
+        user_max_prefetch: Optional[int] = None,
+        defer_delay: float = 1,
+        codec: Optional[PayloadCodec] = None,
+        payload_type: Optional[Type[Payload]] = None,
+        query_repeat_threshold: int = 5,
+    ):
+        if concurrency < 1 or prefetch < 1:
+            raise ValueError("prefetch and concurrency must be at least 1")
+        self.handler = handler
+        self.transport = transport
+        self.lanes = {lane.name: lane for lane in lanes}
+        self.prefetch = prefetch
+        self.concurrency = concurrency
+        # A user's share of the prefetch window, enough to keep their slots busy
+        self.user_max_prefetch = user_max_prefetch or max(
+            user_max_in_flight, prefetch // 4
+        )
+        self.defer_delay = defer_delay
+        self.codec = codec or _default_codec
+        self.payload_type = payload_type
+        self.query_repeat_threshold = query_repeat_threshold
+        self.scheduler = FairScheduler(lanes, concurrency, user_max_in_flight)
+        self._ready = asyncio.Event()
+        self._tasks: set[asyncio.Task] = set()
+        self._consuming: Optional[asyncio.Future] = None
+        self._stopping = False
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def run(self) -> None:
+        """Connect, declare the lane queues and process deliveries until stopped."""
+        await self.transport.connect()
+        try:
+            async with AsyncExitStack() as stack:
+                sources = []
+                for lane in self.lanes.values():
+                    await self.transport.declare_queue(lane.queue_name)
+                    if lane.retry is not None:
+                        await lane.retry.declare(self.transport)
+                    deliveries = await stack.enter_async_context(
+                        self.transport.consume(lane.queue_name, prefetch=self.prefetch)
+                    )
+                    sources.append((lane, deliveries))
+                logger.info(
+                    "Worker started, listening on queues: %s "
+                    "(prefetch %d, concurrency %d)",
+                    ", ".join(lane.queue_name for lane in self.lanes.values()),
+                    self.prefetch,
+                    self.concurrency,
+                )
+                try:
+                    await self._consume_until_stopped(sources)
+                finally:
+                    # Settle in-flight messages before the consumers close
+                    await self.drain()
+        finally:
+            await self.transport.close()
+
+    def stop(self) -> None:
+        """Stop taking new deliveries; run() returns once in-flight work is done."""
+        if self._stopping:
+            return
+        logger.info("Stopping consumer, draining %d in-flight messages", self.in_flight)
+        self._stopping = True
+        if self._consuming is not None:
+            self._consuming.cancel()
+
+    async def _consume_until_stopped(
+        self, sources: Sequence[tuple[Lane, AsyncIterator[Delivery]]]
+    ) -> None:
+        if self._stopping:
+            return
+        self._consuming = asyncio.gather(
+            self.dispatch(),
+            *(self.consume(lane, deliveries) for lane, deliveries in sources),
+        )
+        try:
+            await self._consuming
+        except asyncio.CancelledError:
+            # Only swallow the cancellation stop() asked for
+            if not self._stopping:
+                raise
+
+    async def consume(self, lane: Lane, deliveries: AsyncIterator[Delivery]) -> None:
+        """Buffer a lane's deliveries in the scheduler, deferring users' surplus."""
+        async for delivery in deliveries:
+            user, message = decode(delivery, self.codec, self.payload_type)
+            if (
+                user
+                and self.scheduler.held(lane.name, user) >= self.user_max_prefetch
+                and await self._defer(lane, delivery)
+            ):
+                continue
+            self.scheduler.push(lane.name, user, (delivery, message))
+            self._ready.set()
+
+    async def _defer(self, lane: Lane, delivery: Delivery) -> bool:
+        """Send a delivery back to its queue for later, freeing its credit."""
+        try:
+            await self.transport.publish(
+                lane.queue_name,
+                OutgoingMessage.copy_of(delivery),
+                delay=self.defer_delay,
+            )
+            await delivery.ack()
+        except Exception as e:
+            logger.warning(f"Could not defer message, buffering it: {str(e)}")
+            return False
+        return True
+
+    async def dispatch(self) -> None:
+        """Start a handler task for each delivery the scheduler releases."""
+        while True:
+            picked = self.scheduler.pop()
+            if picked is None:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            lane, user, (delivery, message) = picked
+            task = asyncio.create_task(
+                self._process(self.lanes[lane], user, delivery, message)
+            )
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def drain(self) -> None:
+        """Wait for every in-flight handler to finish."""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _process(
+        self,
+        lane: Lane,
+        user: str,
+        delivery: Delivery,
+        message: Decoded,
+    ) -> None:
+        try:
+            try:
+                if isinstance(message, Exception):
+                    raise message
+                logger.info(
+                    "Picked up message from %s queue for processing: chat_id: %s",
+                    lane.name,
+                    _chat_id(message),
+                )
+                with track_queries() as queries:
+                    result = await self.handler(message)
+                self._log_queries(lane, message, queries)
+            except Exception as e:
+                logger.error(f"Error in callback: {str(e)}", exc_info=True)
+                await self._fail(lane, delivery, e)
+            else:
+                if result is not None and delivery.reply_to:
+                    await self._reply(delivery, result)
+                await delivery.ack()
+        except Exception as e:
+            # The channel went away; the broker redelivers unacked messages
+            logger.error(f"Could not settle message: {str(e)}")
+        finally:
+            self.scheduler.finish(lane.name, user)
+            self._ready.set()
+
+    def _log_queries(self, lane: Lane, message: Message, queries: QueryStats):
+        line = (
+            f"Processed message from {lane.name} queue: "
+            f"chat_id: {_chat_id(message)}, db: {queries}"
+        )
+        warnings = queries.warnings(self.query_repeat_threshold)
+        if warnings:
+            logger.warning("\n  ".join([line, *warnings]))
+        else:
+            logger.info(line)
+
+    async def _reply(self, delivery: Delivery, result: Message) -> None:
+        """Answer an RPC request; the caller may have given up, so best effort."""
+        try:
+            await self.transport.publish(
+                delivery.reply_to,
+                self.codec.message(
+                    result,
+                    content_type=self.codec.reply_format(delivery),
+                    correlation_id=delivery.correlation_id,
+                    persistent=False,
+                ),
+            )
+        except Exception as e:
+            logger.warning(f"Could not send reply to {delivery.reply_to}: {str(e)}")
+
+    async def _fail(self, lane: Lane, delivery: Delivery, error: Exception):
+        if lane.retry is not None:
+            try:
+                await lane.retry.fail(self.transport, delivery, error)
+                return
+            except Exception as e:
+                logger.error(f"Could not schedule retry: {str(e)}")
+        await delivery.nack(requeue=True)
+
+
+def _chat_id(message: Message) -> Any:
+    if isinstance(message, dict):
+        return message.get("chat_id")
+    return getattr(message, "chat_id", None)
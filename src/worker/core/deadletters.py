@@ -0,0 +1,106 @@
+"""Inspect and replay messages in the dead-letter queue.
+
+    python -m core.deadletters list [--limit 20]
+    python -m core.deadletters replay [--limit 20 | --all]
+    python -m core.deadletters --lane bulk list
+
+``list`` shows dead letters without consuming them: they are fetched
+unacknowledged and return to the queue, in order, when the command
+disconnects. ``replay`` publishes them back onto the work queue with their
+attempt count reset, then removes them from the dead-letter queue. Each
+priority lane has its own dead-letter queue; ``--lane`` picks one (default:
+interactive).
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from common.messaging.transport import OutgoingMessage, Transport, transport_from_env
+
+from .retry import ATTEMPT_HEADER, RetryTopology, describe
+from .scheduling import INTERACTIVE, LANE_NAMES, lane_queue
+
+logger = logging.getLogger(__name__)
+
+REPLAYED_HEADER = "x-replayed"
+
+
+async def list_dead_letters(
+    transport: Transport, topology: RetryTopology, limit: int
+) -> int:
+    await transport.connect()
+    try:
+        shown = 0
+        while shown < limit:
+            delivery = await transport.get(topology.dead_letter_queue)
+            if delivery is None:
+                break
+            shown += 1
+            print(json.dumps(describe(delivery), default=str))
+    finally:
+        # Closing without acking returns every message to the queue
+        await transport.close()
+    return shown
+
+
+async def replay_dead_letters(
+    transport: Transport, topology: RetryTopology, limit: Optional[int]
+) -> int:
+    await transport.connect()
+    try:
+        replayed = 0
+        while limit is None or replayed < limit:
+            delivery = await transport.get(topology.dead_letter_queue)
+            if delivery is None:
+                break
+            headers = dict(delivery.headers or {})
+            headers[ATTEMPT_HEADER] = 0
+            headers[REPLAYED_HEADER] = int(headers.get(REPLAYED_HEADER, 0)) + 1
+            await transport.publish(
+                topology.queue_name, OutgoingMessage.copy_of(delivery, headers)
+            )
+            await delivery.ack()
+            replayed += 1
+    finally:
+        await transport.close()
+    return replayed
+
+
+def main(argv=None) -> int:
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Inspect or replay dead letters.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    list_parser = commands.add_parser("list", help="Show dead letters")
+    list_parser.add_argument("--limit", type=int, default=20)
+    replay_parser = commands.add_parser("replay", help="Requeue dead letters")
+    group = replay_parser.add_mutually_exclusive_group()
+    group.add_argument("--limit", type=int, default=20)
+    group.add_argument("--all", action="store_true")
+    parser.add_argument("--queue", default=os.getenv("QUEUE_NAME", "chat_queue"))
+    parser.add_argument("--lane", choices=LANE_NAMES, default=INTERACTIVE)
+    args = parser.parse_args(argv)
+
+    transport = transport_from_env()
+    topology = RetryTopology(lane_queue(args.queue, args.lane))
+    if args.command == "list":
+        count = asyncio.run(list_dead_letters(transport, topology, args.limit))
+        print(f"{count} dead letters shown", file=sys.stderr)
+    else:
+        limit = None if args.all else args.limit
+        count = asyncio.run(replay_dead_letters(transport, topology, limit))
+        print(
+            f"{count} dead letters replayed onto {topology.queue_name}", file=sys.stderr
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""Deduplication of redelivered queue messages.
+
+RabbitMQ delivers at least once: a message whose worker crashed, or whose ack
+was lost, comes back even if its reply was already committed. Every message
+carries an idempotency key (``idempotency_key`` in the payload, else the user
+message's ``message_id``, else the AMQP ``message_id``). The worker commits a
+``processed_messages`` row under that key in the reply's own transaction, and
+before answering a message it checks the key:
+
+1. in a per-process cache of recently committed keys (no I/O), then
+2. in ``processed_messages`` (one primary-key lookup).
+
+A hit means the reply exists, so the message is acked without another LLM
+call. If two copies race past the check, the primary key rejects the second
+reply's transaction and that copy is acked as a duplicate.
+"""
+
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from contextlib import AbstractAsyncContextManager
+from typing import Callable, Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from common.db import crud
+from common.db.connect import get_session
+from common.db.models import IDEMPOTENCY_KEY_LENGTH, ProcessedMessage
+from common.messaging.payloads import ChatRequest
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_KEY = "idempotency_key"
+_INBOX_CONSTRAINT = "processed_messages_pkey"
+
+SessionFactory = Callable[[], AbstractAsyncContextManager[AsyncSession]]
+
+
+def idempotency_key(message: ChatRequest) -> Optional[str]:
+    key = message.idempotency_key or message.message_id
+    return str(key)[:IDEMPOTENCY_KEY_LENGTH] if key else None
+
+
+class RecentKeys:
+    """Bounded set of keys, evicting the least recently used."""
+
+    def __init__(self, size: int = 10_000):
+        self.size = size
+        self._keys: OrderedDict[str, None] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key: str) -> bool:
+        if key not in self._keys:
+            return False
+        self._keys.move_to_end(key)
+        return True
+
+    def add(self, key: str) -> None:
+        self._keys[key] = None
+        self._keys.move_to_end(key)
+        while len(self._keys) > self.size:
+            self._keys.popitem(last=False)
+
+
+class Inbox:
+    """Tracks which idempotency keys already have a committed reply."""
+
+    def __init__(
+        self, session_factory: SessionFactory = get_session, cache_size: int = 10_000
+    ):
+        self.session_factory = session_factory
+        self.recent = RecentKeys(cache_size)
+
+    async def seen(self, key: str) -> bool:
+        if key in self.recent:
+            return True
+        async with self.session_factory() as session:
+            found = await crud.processed_message.seen(session, key=key)
+        if found:
+            self.recent.add(key)
+        return found
+
+    def entry(
+        self, key: str, chat_id: uuid.UUID, reply_id: Optional[uuid.UUID]
+    ) -> ProcessedMessage:
+        """The inbox row to commit alongside the reply."""
+        return ProcessedMessage(idempotency_key=key, chat_id=chat_id, reply_id=reply_id)
+
+    def record(self, key: str) -> None:
+        """Remember a key once its reply is committed."""
+        self.recent.add(key)
+
+    @staticmethod
+    def is_duplicate(error: BaseException) -> bool:
+        """Whether a failed commit was rejected by the inbox key constraint."""
+        return isinstance(error, IntegrityError) and _INBOX_CONSTRAINT in str(
+            error.orig
+        )
+
+
+def inbox_from_env() -> Inbox:
+    return Inbox(cache_size=int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000")))
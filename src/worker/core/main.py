@@ -1,18 +1,29 @@
 import asyncio
-import json
 import logging
 import os
+import signal
 import sys
 import uuid
-from datetime import datetime
-from typing import Any, Dict
+from datetime import datetime, timezone
+from typing import Any, Iterable, Optional
 
-import pika
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
 from common.db.connect import get_session as get_db_session
-from common.db.models import Log, Message
+from common.db.crud import message as message_crud
+from common.db.ids import uuid7
+from common.db.models import Base, Log, Message
+from common.loop_monitor import loop_monitor_from_env
+from common.messaging.payloads import ChatReply, ChatRequest, payload_codec_from_env
+from common.messaging.transport import Transport, transport_from_env
+
+from .consumer import Consumer
+from .idempotency import idempotency_key, inbox_from_env
+from .persistence import PersistencePipeline
+from .recall import recall_from_env
+from .retry import PermanentFailure, retry_delays_from_env
+from .scheduling import lanes_from_env
 
 logging.basicConfig(level=logging.INFO, stream=sys.stdout, force=True)
 logger = logging.getLogger(__name__)
@@ -25,20 +36,93 @@ openai_api_key = os.environ.get("OPENAI_API_KEY")
 if not openai_api_key:
     raise Exception("OPENAI_API_KEY is not set in the environment.")
 
-client = OpenAI(api_key=openai_api_key)
+client = AsyncOpenAI(api_key=openai_api_key)
 
+# Past messages similar to the current one are added to each prompt. Embedding
+# runs in a worker thread, so the recall index gets a synchronous client.
+recall_index = recall_from_env(OpenAI(api_key=openai_api_key))
+RECALL_TOP_K = int(os.getenv("RECALL_TOP_K", "5"))
+RECALL_MIN_SCORE = float(os.getenv("RECALL_MIN_SCORE", "0.2"))
+RECALL_SNIPPET_CHARS = 300
 
-async def process_message(message: Dict[str, Any]) -> None:
-    """Process a message from the queue."""
-    try:
-        user_message = message.get("user_message", True)
+# Redelivered messages whose reply is already committed are acked unprocessed
+inbox = inbox_from_env()
+
+# Replies from concurrently processed messages are committed in batches
+persistence = PersistencePipeline(
+    get_db_session,
+    max_batch=int(os.getenv("PERSIST_BATCH_SIZE", "50")),
+    max_delay=int(os.getenv("PERSIST_BATCH_DELAY_MS", "5")) / 1000,
+)
+
+# Logs the stack of any call that blocks the event loop (no metrics endpoint)
+loop_monitor = loop_monitor_from_env()
 
-        if user_message:
+
+def _optional_uuid(value: Any) -> Optional[uuid.UUID]:
+    try:
+        return uuid.UUID(str(value)) if value else None
+    except ValueError:
+        return None
+
+
+async def recall_context(
+    user_id: Optional[uuid.UUID], content: str, exclude: Iterable[uuid.UUID] = ()
+) -> Optional[str]:
+    """Summarise the user's most relevant earlier messages for the prompt."""
+    if recall_index is None or user_id is None or RECALL_TOP_K <= 0:
+        return None
+    hits = await asyncio.to_thread(
+        recall_index.search,
+        user_id,
+        content,
+        RECALL_TOP_K,
+        list(exclude),
+        RECALL_MIN_SCORE,
+    )
+    if not hits:
+        return None
+    async with get_db_session() as session:
+        # Archived chats have left the hot table; their hits are skipped
+        past = await message_crud.get_many(session, ids=[m for m, _ in hits])
+    if not past:
+        return None
+    lines = [
+        f"- ({m.timestamp:%Y-%m-%d}) {m.content[:RECALL_SNIPPET_CHARS]}" for m in past
+    ]
+    return (
+        "Things this user said in earlier conversations that may be relevant:\n"
+        + "\n".join(lines)
+    )
+
+
+async def remember(
+    user_id: Optional[uuid.UUID], message_id: Optional[uuid.UUID], content: str
+) -> None:
+    """Add a user message to the recall index."""
+    if recall_index is None or user_id is None or message_id is None:
+        return
+    await asyncio.to_thread(recall_index.add, user_id, [message_id], [content])
+
+
+async def process_message(message: ChatRequest) -> Optional[ChatReply]:
+    """Process a message from the queue; returns the committed reply, if any."""
+    try:
+        if message.user_message:
             logger.info(
                 "Picked up user message for processing for chat %s",
-                message["chat_id"]
+                message.chat_id
             )
 
+            key = idempotency_key(message)
+            if key is not None and await inbox.seen(key):
+                logger.info(
+                    "Skipping already processed message %s for chat %s",
+                    key,
+                    message.chat_id,
+                )
+                return
+
             # Define the system prompt explicitly.
             system_prompt = (
                 "Traction is a habit tracking app that empowers users to build and sustain positive habits "
@@ -50,18 +134,31 @@ async def process_message(message: Dict[str, Any]) -> None:
             )
 
             # Prepare the messages payload including the system prompt and the user's message.
-            user_content = message["content"]
+            user_content = message.content
             messages_payload = [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_content},
             ]
 
+            # Recall is best effort: a broken index must not block replies
+            user_id = _optional_uuid(message.user_id)
+            message_id = _optional_uuid(message.message_id)
+            try:
+                recalled = await recall_context(
+                    user_id, user_content, exclude=[message_id] if message_id else []
+                )
+            except Exception as e:
+                logger.warning(f"Recall failed for chat {message.chat_id}: {e}")
+                recalled = None
+            if recalled:
+                messages_payload.insert(1, {"role": "system", "content": recalled})
+
             # Log the payload being sent to the LLM for debugging.
             logger.info(f"Sending messages to LLM: {messages_payload}")
 
             logger.info(
                 "Sending request to LLM for chat: %s with content: %s...",
-                message["chat_id"],
+                message.chat_id,
                 user_content[:50]
             )
             response = await client.chat.completions.create(
@@ -70,92 +167,113 @@ async def process_message(message: Dict[str, Any]) -> None:
             generated_message = response.choices[0].message.content
 
             logger.info(
-                f"Received LLM response for chat {message['chat_id']} with content: {generated_message[:50]}..."
+                f"Received LLM response for chat {message.chat_id} with content: {generated_message[:50]}..."
             )
 
-            # Instead of sending the message via StreamChat,
-            # we now log the assistant's response into the database.
-            await log_message(message["chat_id"], generated_message, user_message=False)
-
-            await log_audit(
-                action="LLM response processed & forwarded",
-                details=f"Chat ID: {message['chat_id']}, Response: {generated_message[:50]}...",
+            # Instead of sending the message via StreamChat, we store the
+            # assistant's response; this returns once it is committed.
+            if user_id is None:
+                raise PermanentFailure("Message has no valid user_id")
+            chat_id = uuid.UUID(message.chat_id)
+            rows = reply_rows(chat_id, user_id, generated_message)
+            if key is not None:
+                rows.append(inbox.entry(key, chat_id, rows[0].message_id))
+            try:
+                await persistence.write(rows)
+            except Exception as e:
+                if not inbox.is_duplicate(e):
+                    raise
+                # Another copy of this message committed its reply first
+                logger.info(f"Discarding duplicate reply for message {key}")
+                inbox.record(key)
+                return
+            if key is not None:
+                inbox.record(key)
+
+            try:
+                await remember(user_id, message_id, user_content)
+            except Exception as e:
+                logger.warning(f"Could not index message {message_id}: {e}")
+
+            logger.info(f"Successfully processed message for chat {message.chat_id}")
+            return ChatReply(
+                message_id=str(rows[0].message_id),
+                chat_id=str(chat_id),
+                content=generated_message,
             )
-
-            logger.info(f"Successfully processed message for chat {message['chat_id']}")
         else:
-            logger.info(f"Received system message for chat {message['chat_id']}")
+            logger.info(f"Received system message for chat {message.chat_id}")
     except Exception as e:
         logger.error(f"Error processing message: {str(e)}", exc_info=True)
         raise
 
 
-async def log_message(chat_id: str, content: str, user_message: bool) -> None:
-    """Log a message in the Messages table."""
-    async for session in get_db_session():
-        new_message = Message(
-            message_id=uuid.uuid4(),
+def reply_rows(chat_id: uuid.UUID, user_id: uuid.UUID, content: str) -> list[Base]:
+    """The assistant message and its audit log, written in one transaction."""
+    now = datetime.now(timezone.utc)
+    return [
+        Message(
+            message_id=uuid7(),
             chat_id=chat_id,
+            user_id=user_id,
             content=content,
-            user_message=user_message,
-            timestamp=datetime.utcnow(),
-        )
-        session.add(new_message)
-        await session.commit()
-
-
-async def log_audit(action: str, details: str) -> None:
-    """Insert an audit log record into the Logs table."""
-    async for session in get_db_session():
-        new_log = Log(
-            log_id=uuid.uuid4(),
-            action=action,
-            details=details,
-            timestamp=datetime.utcnow(),
-        )
-        session.add(new_log)
-        await session.commit()
-
-
-async def callback(ch, method, properties, body):
-    """Process messages from RabbitMQ."""
-    try:
-        message = json.loads(body.decode())
-        # Log that a message has been picked up from the queue
-        logger.info(
-            f"Picked up message from queue for processing: chat_id: {message.get('chat_id')}"
-        )
-        await process_message(message)
-        await ch.basic_ack(delivery_tag=method.delivery_tag)
-    except Exception as e:
-        logger.error(f"Error in callback: {str(e)}", exc_info=True)
-        await ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            user_message=False,
+            timestamp=now,
+        ),
+        Log(
+            log_id=uuid7(),
+            chat_id=chat_id,
+            user_id=user_id,
+            action="LLM response processed & forwarded",
+            details=f"Chat ID: {chat_id}, Response: {content[:50]}...",
+            timestamp=now,
+        ),
+    ]
 
 
-async def main():
-    """Main function to run the worker."""
-    rabbitmq_host = os.getenv("RABBITMQ_HOST", "95.216.214.173")
+def build_consumer(transport: Optional[Transport] = None) -> Consumer:
+    """The lane consumer for ``process_message``, configured from the env."""
     queue_name = os.getenv("QUEUE_NAME", "chat_queue")
-
+    concurrency = int(os.getenv("WORKER_CONCURRENCY", "32"))
+    return Consumer(
+        process_message,
+        transport=transport or transport_from_env(),
+        lanes=lanes_from_env(queue_name, concurrency, retry_delays_from_env()),
+        prefetch=int(os.getenv("WORKER_PREFETCH", "32")),
+        concurrency=concurrency,
+        user_max_in_flight=int(os.getenv("WORKER_USER_MAX_IN_FLIGHT", "2")),
+        user_max_prefetch=int(os.getenv("WORKER_USER_MAX_PREFETCH", "0")) or None,
+        defer_delay=float(os.getenv("WORKER_DEFER_DELAY", "1")),
+        codec=payload_codec_from_env(),
+        payload_type=ChatRequest,
+        query_repeat_threshold=int(os.getenv("QUERY_REPEAT_THRESHOLD", "5")),
+    )
+
+
+async def main(
+    consumer: Optional[Consumer] = None,
+    handle_signals: bool = True,
+    monitor_loop: bool = True,
+):
+    """Main function to run the worker."""
+    consumer = consumer or build_consumer()
+    if handle_signals:
+        # SIGTERM (deploys, the supervisor) drains in-flight messages first
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, consumer.stop)
+
+    if monitor_loop:
+        await loop_monitor.start()
+    await persistence.start()
     try:
-        connection = pika.BlockingConnection(
-            pika.ConnectionParameters(host=rabbitmq_host)
-        )
-        channel = connection.channel()
-
-        # Declare the queue
-        channel.queue_declare(queue=queue_name, durable=True)
-
-        # Set up consumer
-        channel.basic_qos(prefetch_count=1)
-        channel.basic_consume(queue=queue_name, on_message_callback=callback)
-
-        logger.info(f"Worker started, listening on queue: {queue_name}")
-        channel.start_consuming()
-
+        await consumer.run()
     except Exception as e:
         logger.error(f"Worker error: {str(e)}", exc_info=True)
         raise
+    finally:
+        await persistence.stop()
+        await loop_monitor.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,107 @@
+"""Batched persistence of worker results.
+
+Each processed message produces a few rows (the assistant reply and its audit
+log) that must be written together. Handlers hand their rows to the pipeline
+and wait; a single background task collects whatever has been queued by
+concurrently running handlers, for up to ``max_delay`` seconds or
+``max_batch`` writes, and commits it all in one transaction. A handler's
+``write`` returns only once its rows are committed, so the consumer's
+ack-after-handler becomes ack-after-commit.
+
+If a batched commit fails, its writes are retried one transaction each so a
+single bad row only fails its own message.
+"""
+
+import asyncio
+import logging
+from contextlib import AbstractAsyncContextManager
+from typing import Callable, Optional, Sequence
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from common.db.connect import get_session
+from common.db.models import Base
+
+logger = logging.getLogger(__name__)
+
+SessionFactory = Callable[[], AbstractAsyncContextManager[AsyncSession]]
+_Write = tuple[Sequence[Base], asyncio.Future]
+
+
+class PersistencePipeline:
+    """Coalesces row writes from concurrent handlers into batched commits."""
+
+    def __init__(
+        self,
+        session_factory: SessionFactory = get_session,
+        max_batch: int = 50,
+        max_delay: float = 0.005,
+    ):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: asyncio.Queue[_Write] = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Commit everything already queued, then stop the background task."""
+        if self._task is None:
+            return
+        while not self._queue.empty():
+            await self._commit(self._take_batch())
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def write(self, rows: Sequence[Base]) -> None:
+        """Queue rows for one transaction and wait until they are committed."""
+        if self._task is None:
+            raise RuntimeError("PersistencePipeline.start() has not been called")
+        done = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((rows, done))
+        await done
+
+    def _take_batch(self, batch: Optional[list[_Write]] = None) -> list[_Write]:
+        batch = batch or []
+        while len(batch) < self.max_batch and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            # Give handlers finishing at about the same time a chance to join
+            if self.max_delay > 0 and self._queue.qsize() < self.max_batch - 1:
+                await asyncio.sleep(self.max_delay)
+            await self._commit(self._take_batch(batch))
+
+    async def _commit(self, batch: list[_Write]) -> None:
+        try:
+            async with self.session_factory() as session:
+                for rows, _ in batch:
+                    session.add_all(rows)
+        except Exception as e:
+            if len(batch) > 1:
+                logger.warning(
+                    "Batched commit of %d writes failed (%s), retrying one by one",
+                    len(batch),
+                    e,
+                )
+                for write in batch:
+                    await self._commit([write])
+                return
+            _, done = batch[0]
+            if not done.done():
+                done.set_exception(e)
+            return
+        logger.debug("Committed %d writes in one transaction", len(batch))
+        for _, done in batch:
+            if not done.done():
+                done.set_result(None)
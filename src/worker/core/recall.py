@@ -0,0 +1,243 @@
+"""Semantic recall of what a user said in earlier conversations.
+
+User messages are embedded and appended to a per-user vector index on local
+disk, keyed by message_id. On each new turn the worker embeds the incoming
+message, finds the closest past messages by cosine similarity and adds them
+to the prompt, so the coach can refer back to something said weeks ago
+without resending whole chat histories.
+
+Each user's index (a shard) is a pair of append-only files: float32 vectors
+and the matching 16-byte message ids. Shards are memory-mapped and searched by
+brute force with a single matrix-vector product, which for a user's history
+(thousands of vectors) takes microseconds; sharding by user keeps query cost
+independent of the total number of vectors and guarantees recall never crosses
+users. Vectors are L2-normalised when embedded, so dot product is cosine
+similarity.
+"""
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterable, Optional, Sequence
+from uuid import UUID
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_ID_BYTES = 16
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def _normalise(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class Embedder(ABC):
+    """Turns texts into fixed-size vectors."""
+
+    # Recorded in the index so vectors from different embedders never mix
+    name: str
+    dim: int
+
+    @abstractmethod
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """Return a (len(texts), dim) float32 array of L2-normalised rows."""
+
+
+class HashingEmbedder(Embedder):
+    """Deterministic bag-of-words embedder that needs no model or network.
+
+    Words and word pairs are hashed into ``dim`` signed buckets (the hashing
+    trick). It captures lexical overlap only, which is enough for tests and
+    offline development and a reasonable fallback in production.
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = _TOKEN_RE.findall(text.lower())
+            features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+            for feature in features:
+                digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                sign = 1.0 if value >> 63 else -1.0
+                vectors[row, value % self.dim] += sign
+        return _normalise(vectors)
+
+
+class OpenAIEmbedder(Embedder):
+    """Embeddings from the OpenAI API, shortened to ``dim`` dimensions."""
+
+    def __init__(self, client, model: str = "text-embedding-3-small", dim: int = 512):
+        self.client = client
+        self.model = model
+        self.dim = dim
+        self.name = f"openai-{model}-{dim}"
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        response = self.client.embeddings.create(
+            model=self.model, input=list(texts), dimensions=self.dim
+        )
+        vectors = np.array([item.embedding for item in response.data], np.float32)
+        return _normalise(vectors)
+
+
+class VectorIndex:
+    """Append-only, memory-mapped vectors for one shard.
+
+    Appends take an exclusive lock and write vectors before ids; readers size
+    the shard from the ids file, so a half-finished append is never visible
+    and is overwritten by the next one.
+    """
+
+    def __init__(self, path: Path, dim: int):
+        self.path = path
+        self.dim = dim
+        self._vectors_path = path / "vectors.f32"
+        self._ids_path = path / "ids.bin"
+        self._vectors = np.empty((0, dim), dtype=np.float32)
+        self._ids = np.empty((0, _ID_BYTES), dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return self._refresh()
+
+    def _stored_rows(self) -> int:
+        try:
+            return self._ids_path.stat().st_size // _ID_BYTES
+        except FileNotFoundError:
+            return 0
+
+    def _refresh(self) -> int:
+        """Re-map the files if another append grew them."""
+        rows = self._stored_rows()
+        if rows != len(self._ids):
+            if rows:
+                self._vectors = np.memmap(
+                    self._vectors_path, np.float32, "r", shape=(rows, self.dim)
+                )
+                self._ids = np.memmap(
+                    self._ids_path, np.uint8, "r", shape=(rows, _ID_BYTES)
+                )
+            else:
+                self._vectors = np.empty((0, self.dim), dtype=np.float32)
+                self._ids = np.empty((0, _ID_BYTES), dtype=np.uint8)
+        return rows
+
+    def append(self, ids: Sequence[UUID], vectors: np.ndarray) -> None:
+        if len(ids) != len(vectors):
+            raise ValueError("ids and vectors must have the same length")
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected vectors of dimension {self.dim}")
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self._ids_path, "ab") as ids_file:
+            fcntl.flock(ids_file, fcntl.LOCK_EX)
+            rows = os.fstat(ids_file.fileno()).st_size // _ID_BYTES
+            with open(self._vectors_path, "ab") as vectors_file:
+                # Drop any tail left by an append that died before its ids
+                vectors_file.truncate(rows * self.dim * vectors.itemsize)
+                vectors_file.write(vectors.tobytes())
+                vectors_file.flush()
+            ids_file.write(b"".join(message_id.bytes for message_id in ids))
+            ids_file.flush()
+
+    def search(
+        self, query: np.ndarray, k: int, exclude: Iterable[UUID] = ()
+    ) -> list[tuple[UUID, float]]:
+        """The ``k`` most similar entries as (message_id, score), best first."""
+        rows = self._refresh()
+        if not rows or k <= 0:
+            return []
+        scores = self._vectors @ np.asarray(query, dtype=np.float32)
+        excluded = {message_id.bytes for message_id in exclude}
+        if excluded:
+            ids = self._ids.view(f"V{_ID_BYTES}").ravel()
+            mask = np.isin(ids, np.array(list(excluded), dtype=f"V{_ID_BYTES}"))
+            scores[mask] = -np.inf
+        k = min(k, rows)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (UUID(bytes=self._ids[i].tobytes()), float(scores[i]))
+            for i in top
+            if scores[i] > -np.inf
+        ]
+
+
+class RecallIndex:
+    """Per-user vector shards under one root directory."""
+
+    def __init__(self, root: str, embedder: Embedder, shard_cache_size: int = 256):
+        self.root = Path(root)
+        self.embedder = embedder
+        self._check_meta()
+        # Keep recently used shards (and their memory maps) open
+        self._shard = lru_cache(maxsize=shard_cache_size)(self._open_shard)
+
+    def _check_meta(self) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        meta_path = self.root / "meta.json"
+        meta = {"embedder": self.embedder.name, "dim": self.embedder.dim}
+        if meta_path.exists():
+            stored = json.loads(meta_path.read_text())
+            if stored != meta:
+                raise ValueError(
+                    f"Recall index at {self.root} was built with {stored}, "
+                    f"not {meta}; point RECALL_INDEX_DIR elsewhere or rebuild it"
+                )
+        else:
+            meta_path.write_text(json.dumps(meta))
+
+    def _open_shard(self, user_id: UUID) -> VectorIndex:
+        return VectorIndex(self.root / user_id.hex[:2] / user_id.hex, self.embedder.dim)
+
+    def add(
+        self, user_id: UUID, message_ids: Sequence[UUID], texts: Sequence[str]
+    ) -> None:
+        """Embed texts and append them to the user's shard."""
+        if message_ids:
+            self._shard(user_id).append(message_ids, self.embedder.embed(texts))
+
+    def search(
+        self,
+        user_id: UUID,
+        text: str,
+        k: int,
+        exclude: Iterable[UUID] = (),
+        min_score: float = 0.0,
+    ) -> list[tuple[UUID, float]]:
+        """The user's past messages most similar to ``text``, best first."""
+        query = self.embedder.embed([text])[0]
+        hits = self._shard(user_id).search(query, k, exclude)
+        return [(message_id, score) for message_id, score in hits if score > min_score]
+
+
+def recall_from_env(client=None) -> Optional[RecallIndex]:
+    """Build the recall index from RECALL_* settings, or None if disabled."""
+    root = os.getenv("RECALL_INDEX_DIR", "/var/lib/coach-bot/recall")
+    embedder_name = os.getenv("RECALL_EMBEDDER", "hashing")
+    if embedder_name == "off":
+        return None
+    if embedder_name == "openai":
+        if client is None:
+            raise ValueError("RECALL_EMBEDDER=openai needs an OpenAI client")
+        embedder: Embedder = OpenAIEmbedder(
+            client, dim=int(os.getenv("RECALL_DIM", "512"))
+        )
+    elif embedder_name == "hashing":
+        embedder = HashingEmbedder(dim=int(os.getenv("RECALL_DIM", "512")))
+    else:
+        raise ValueError(f"Unknown RECALL_EMBEDDER: {embedder_name}")
+    return RecallIndex(root, embedder)
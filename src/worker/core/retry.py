@@ -0,0 +1,128 @@
+"""Delayed retries and dead-lettering for failed messages.
+
+Instead of nacking a failed message straight back onto the work queue (which
+redelivers it immediately, in a tight loop), the worker republishes it to the
+work queue with a delay and acks the original. Delays grow with each attempt,
+so an outage costs one publish per message per attempt rather than a
+redelivery storm. On RabbitMQ each delay is a TTL queue with no consumers,
+which dead-letters the message back onto the work queue when it expires:
+
+    chat_queue --fail--> chat_queue.retry.1s  --ttl--> chat_queue
+               --fail--> chat_queue.retry.5s  --ttl--> chat_queue
+               ...
+               --fail after the last tier, or permanently--> chat_queue.dead
+
+The attempt count and the last error travel in message headers. Messages in
+the dead-letter queue stay there until inspected or replayed with
+``python -m core.deadletters``.
+"""
+
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Any, Optional, Sequence
+
+from common.messaging.payloads import PayloadCodec, PayloadError
+from common.messaging.transport import Delivery, OutgoingMessage, Transport
+
+logger = logging.getLogger(__name__)
+
+ATTEMPT_HEADER = "x-attempt"
+ERROR_HEADER = "x-last-error"
+FIRST_FAILED_HEADER = "x-first-failed-at"
+DEFAULT_DELAYS = (1, 5, 30, 120, 600)
+
+
+class PermanentFailure(Exception):
+    """A failure retrying cannot fix; the message goes straight to the DLQ."""
+
+
+def retry_delays_from_env() -> tuple[int, ...]:
+    raw = os.getenv("RETRY_DELAYS")
+    if not raw:
+        return DEFAULT_DELAYS
+    return tuple(int(delay) for delay in raw.split(",") if delay.strip())
+
+
+def attempts(headers: Optional[dict]) -> int:
+    """How many times the message has already failed."""
+    try:
+        return int((headers or {}).get(ATTEMPT_HEADER, 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+class RetryTopology:
+    """Retry delays and the dead-letter queue for one work queue."""
+
+    def __init__(self, queue_name: str, delays: Sequence[int] = DEFAULT_DELAYS):
+        self.queue_name = queue_name
+        self.delays = tuple(delays)
+        self.dead_letter_queue = f"{queue_name}.dead"
+
+    async def declare(self, transport: Transport) -> None:
+        await transport.declare_queue(self.dead_letter_queue)
+
+    def route(
+        self, headers: Optional[dict], error: BaseException
+    ) -> tuple[str, int, dict]:
+        """Where a failed message goes next, after what delay, with what headers."""
+        attempt = attempts(headers) + 1
+        new_headers = {
+            **(headers or {}),
+            ATTEMPT_HEADER: attempt,
+            ERROR_HEADER: f"{type(error).__name__}: {error}"[:500],
+        }
+        new_headers.setdefault(
+            FIRST_FAILED_HEADER, datetime.now(timezone.utc).isoformat()
+        )
+        permanent = isinstance(
+            error, (PermanentFailure, PayloadError, json.JSONDecodeError)
+        )
+        if permanent or attempt > len(self.delays):
+            return self.dead_letter_queue, 0, new_headers
+        return self.queue_name, self.delays[attempt - 1], new_headers
+
+    async def fail(
+        self, transport: Transport, delivery: Delivery, error: BaseException
+    ) -> None:
+        """Schedule a failed delivery's retry or move it to the DLQ, then ack it.
+
+        The publish completes before the original is acked, so a crash in
+        between can only duplicate the message, never lose it.
+        """
+        queue, delay, headers = self.route(delivery.headers, error)
+        await transport.publish(
+            queue, OutgoingMessage.copy_of(delivery, headers), delay=delay
+        )
+        if queue == self.dead_letter_queue:
+            logger.error(
+                "Message failed (attempt %d), moved to %s: %s",
+                headers[ATTEMPT_HEADER],
+                queue,
+                headers[ERROR_HEADER],
+            )
+        else:
+            logger.warning(
+                "Message failed (attempt %d), retrying in %ds: %s",
+                headers[ATTEMPT_HEADER],
+                delay,
+                headers[ERROR_HEADER],
+            )
+        await delivery.ack()
+
+
+def describe(delivery: Delivery) -> dict[str, Any]:
+    """Summary of a dead letter for display."""
+    headers = delivery.headers or {}
+    try:
+        payload: Any = PayloadCodec().decode(delivery)
+    except PayloadError:
+        payload = delivery.body[:200].decode(errors="replace")
+    return {
+        "attempts": attempts(headers),
+        "first_failed_at": headers.get(FIRST_FAILED_HEADER),
+        "last_error": headers.get(ERROR_HEADER),
+        "payload": payload,
+    }
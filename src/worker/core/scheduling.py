@@ -0,0 +1,124 @@
+"""Priority lanes and per-user fair scheduling for the worker.
+
+Work arrives on one queue per lane: interactive chat turns on the main queue,
+background and bulk jobs on ``<queue>.background`` and ``<queue>.bulk``.
+Deliveries from all lanes are buffered here and started by the scheduler:
+
+- Lanes are served in priority order. Lower lanes are capped below the total
+  concurrency (half and a quarter of it by default), so however much
+  background or bulk work is queued, slots stay free for interactive turns.
+- Within a lane, users are served round-robin and each user has at most
+  ``user_max_in_flight`` messages running, so one heavy user or a backfill
+  for one account cannot starve everyone else. The consumer also caps how
+  many deliveries a user holds here (see ``held()``), so their backlog cannot
+  fill the broker's prefetch window either.
+
+Producers choose the lane by publishing to ``lane_queue(queue, lane)``.
+"""
+
+import os
+from collections import Counter, OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, Optional, Sequence
+
+from .retry import RetryTopology
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+BULK = "bulk"
+LANE_NAMES = (INTERACTIVE, BACKGROUND, BULK)
+
+
+def lane_queue(queue_name: str, lane: str) -> str:
+    """The queue carrying a lane's messages; interactive keeps the base name."""
+    if lane not in LANE_NAMES:
+        raise ValueError(f"Unknown lane: {lane}")
+    return queue_name if lane == INTERACTIVE else f"{queue_name}.{lane}"
+
+
+@dataclass
+class Lane:
+    name: str
+    queue_name: str
+    max_in_flight: int
+    retry: Optional[RetryTopology] = None
+
+
+def lanes_from_env(
+    queue_name: str, concurrency: int, retry_delays: Sequence[int]
+) -> list[Lane]:
+    """Interactive, background and bulk lanes, highest priority first."""
+    caps = {
+        INTERACTIVE: concurrency,
+        BACKGROUND: int(os.getenv("LANE_BACKGROUND_MAX", max(1, concurrency // 2))),
+        BULK: int(os.getenv("LANE_BULK_MAX", max(1, concurrency // 4))),
+    }
+    lanes = []
+    for name in LANE_NAMES:
+        queue = lane_queue(queue_name, name)
+        lanes.append(Lane(name, queue, caps[name], RetryTopology(queue, retry_delays)))
+    return lanes
+
+
+class FairScheduler:
+    """Decides which buffered item starts next. Not thread-safe; one per loop."""
+
+    def __init__(
+        self, lanes: Sequence[Lane], concurrency: int, user_max_in_flight: int = 2
+    ):
+        if concurrency < 1 or user_max_in_flight < 1:
+            raise ValueError("concurrency and user_max_in_flight must be at least 1")
+        self.lanes = list(lanes)
+        self.concurrency = concurrency
+        self.user_max_in_flight = user_max_in_flight
+        # lane -> user -> items, users in round-robin order
+        self._pending: dict[str, OrderedDict[str, deque]] = {
+            lane.name: OrderedDict() for lane in self.lanes
+        }
+        self._lane_in_flight: Counter = Counter()
+        self._user_in_flight: Counter = Counter()
+        self.in_flight = 0
+
+    def __len__(self) -> int:
+        """Items waiting to start."""
+        return sum(
+            len(items) for users in self._pending.values() for items in users.values()
+        )
+
+    def push(self, lane: str, user: str, item: Any) -> None:
+        self._pending[lane].setdefault(user, deque()).append(item)
+
+    def held(self, lane: str, user: str) -> int:
+        """Items a user has waiting in a lane plus running in any lane."""
+        return len(self._pending[lane].get(user, ())) + self._user_in_flight[user]
+
+    def pop(self) -> Optional[tuple[str, str, Any]]:
+        """The next (lane, user, item) allowed to start, or None."""
+        if self.in_flight >= self.concurrency:
+            return None
+        for lane in self.lanes:
+            if self._lane_in_flight[lane.name] >= lane.max_in_flight:
+                continue
+            users = self._pending[lane.name]
+            for user in users:
+                if self._user_in_flight[user] >= self.user_max_in_flight:
+                    continue
+                items = users[user]
+                item = items.popleft()
+                if items:
+                    users.move_to_end(user)
+                else:
+                    del users[user]
+                self._lane_in_flight[lane.name] += 1
+                self._user_in_flight[user] += 1
+                self.in_flight += 1
+                return lane.name, user, item
+        return None
+
+    def finish(self, lane: str, user: str) -> None:
+        """Record that an item popped for (lane, user) has completed."""
+        self._lane_in_flight[lane] -= 1
+        self._user_in_flight[user] -= 1
+        if not self._user_in_flight[user]:
+            del self._user_in_flight[user]
+        self.in_flight -= 1
@@ -0,0 +1,58 @@
+"""Run the API and one worker consumer in a single process.
+
+For small deployments without a broker: with ``TRANSPORT=memory`` the API's
+RPC client and the consumer share the in-process broker, so chat messages are
+answered by the consumer running on the same event loop. Queued and delayed
+retry messages live only as long as the process.
+
+Both services are imported from ``src`` as packages, so run it from there:
+
+    cd src && TRANSPORT=memory python -m worker.core.standalone
+
+The API's dependencies come with the worker's ``standalone`` extra
+(``poetry install -E standalone``).
+
+uvicorn handles SIGTERM and SIGINT; once it has shut the API down, the
+consumer drains its in-flight messages and exits.
+"""
+
+import asyncio
+import logging
+import os
+
+import uvicorn
+
+from .main import build_consumer
+from .main import main as run_worker
+
+logger = logging.getLogger(__name__)
+
+
+async def serve() -> None:
+    # Imported here so TRANSPORT can be set before the API builds its RPC client
+    from api.core.main import app
+
+    if os.getenv("TRANSPORT") != "memory":
+        logger.warning("TRANSPORT is not 'memory'; messages go through the broker")
+
+    server = uvicorn.Server(
+        uvicorn.Config(
+            app,
+            host=os.getenv("API_HOST", "0.0.0.0"),
+            port=int(os.getenv("API_PORT", "8000")),
+        )
+    )
+    consumer = build_consumer()
+    # The API's loop monitor watches the shared loop
+    worker = asyncio.create_task(
+        run_worker(consumer, handle_signals=False, monitor_loop=False)
+    )
+    try:
+        await server.serve()
+    finally:
+        consumer.stop()
+        await worker
+
+
+if __name__ == "__main__":
+    asyncio.run(serve())
@@ -0,0 +1,193 @@
+"""Run several worker processes on one node.
+
+The supervisor forks ``WORKER_PROCESSES`` consumer processes (one per CPU by
+default), each running ``core.main.main``. The node's database connection
+budget, ``DB_POOL_BUDGET``, is split evenly between them by setting each
+child's ``DB_POOL_SIZE`` before it creates its engine, so adding processes
+never exceeds what PostgreSQL was provisioned for.
+
+Children that exit unexpectedly are restarted, with a growing delay if they
+keep crashing straight after start. On SIGTERM or SIGINT the supervisor
+forwards SIGTERM to every child, which stops consuming, finishes and acks its
+in-flight messages and exits; children still running after
+``WORKER_DRAIN_TIMEOUT`` seconds are killed (their unacked messages are
+redelivered by the broker).
+
+    python -m core.supervisor
+"""
+
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from multiprocessing.connection import wait
+from multiprocessing.process import BaseProcess
+from typing import Callable, Optional
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+# A child that dies sooner than this after starting counts as a crash loop
+MIN_HEALTHY_SECONDS = 10.0
+MAX_RESTART_DELAY = 30.0
+
+# Imported before forking so children share the pages instead of re-importing
+PRELOAD_MODULES = ("aio_pika", "numpy", "openai", "sqlalchemy.ext.asyncio")
+
+
+def pool_size_per_process(budget: int, processes: int) -> int:
+    """Split a connection budget evenly; every process needs at least one."""
+    if budget < processes:
+        logger.warning(
+            "DB_POOL_BUDGET=%d is smaller than WORKER_PROCESSES=%d; "
+            "each process still gets one connection",
+            budget,
+            processes,
+        )
+    return max(1, budget // processes)
+
+
+def run_worker(index: int, pool_size: int) -> None:
+    """Child entry point: configure the DB pool, then run one consumer."""
+    # Forked children inherit the supervisor's handlers; core.main installs its own
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    os.environ["DB_POOL_SIZE"] = str(pool_size)
+    os.environ["DB_MAX_OVERFLOW"] = "0"
+    os.environ["WORKER_INDEX"] = str(index)
+
+    import asyncio
+
+    from core.main import main
+
+    asyncio.run(main())
+
+
+class _Slot:
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[BaseProcess] = None
+        self.started_at = 0.0
+        self.failures = 0
+        self.restart_at: Optional[float] = None
+
+
+class Supervisor:
+    """Keeps ``processes`` children running ``target(index, pool_size)``."""
+
+    def __init__(
+        self,
+        processes: int,
+        pool_budget: int,
+        drain_timeout: float = 60.0,
+        min_healthy: float = MIN_HEALTHY_SECONDS,
+        target: Callable[[int, int], None] = run_worker,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if processes < 1:
+            raise ValueError("processes must be at least 1")
+        self.processes = processes
+        self.pool_size = pool_size_per_process(pool_budget, processes)
+        self.drain_timeout = drain_timeout
+        self.min_healthy = min_healthy
+        self.target = target
+        self.clock = clock
+        self._context = multiprocessing.get_context("fork")
+        self._slots = [_Slot(index) for index in range(processes)]
+        self._stopping = False
+
+    def request_shutdown(self, *_) -> None:
+        """Begin a graceful shutdown; safe to call from a signal handler."""
+        self._stopping = True
+
+    def _start(self, slot: _Slot) -> None:
+        slot.process = self._context.Process(
+            target=self.target,
+            args=(slot.index, self.pool_size),
+            name=f"worker-{slot.index}",
+        )
+        slot.process.start()
+        slot.started_at = self.clock()
+        slot.restart_at = None
+        logger.info(
+            "Started worker %d (pid %s, pool size %d)",
+            slot.index,
+            slot.process.pid,
+            self.pool_size,
+        )
+
+    def _reap(self, slot: _Slot) -> None:
+        """Record a child's exit and schedule its restart."""
+        process = slot.process
+        process.join()
+        uptime = self.clock() - slot.started_at
+        slot.failures = slot.failures + 1 if uptime < self.min_healthy else 0
+        delay = min(MAX_RESTART_DELAY, 2 ** (slot.failures - 1)) if slot.failures else 0
+        logger.error(
+            "Worker %d (pid %s) exited with code %s after %.1fs; restarting in %.0fs",
+            slot.index,
+            process.pid,
+            process.exitcode,
+            uptime,
+            delay,
+        )
+        slot.process = None
+        slot.restart_at = self.clock() + delay
+
+    def run(self) -> None:
+        """Start the children and supervise them until shutdown is requested."""
+        for slot in self._slots:
+            self._start(slot)
+        while not self._stopping:
+            running = [slot for slot in self._slots if slot.process is not None]
+            ready = wait([slot.process.sentinel for slot in running], timeout=0.5)
+            for slot in running:
+                if slot.process.sentinel in ready and not self._stopping:
+                    self._reap(slot)
+            now = self.clock()
+            for slot in self._slots:
+                if slot.process is None and not self._stopping:
+                    if slot.restart_at is not None and now >= slot.restart_at:
+                        self._start(slot)
+        self._shutdown()
+
+    def _shutdown(self) -> None:
+        children = [slot.process for slot in self._slots if slot.process is not None]
+        logger.info("Draining %d workers", len(children))
+        for process in children:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+        deadline = self.clock() + self.drain_timeout
+        for process in children:
+            process.join(max(0.0, deadline - self.clock()))
+        for process in children:
+            if process.is_alive():
+                logger.warning(
+                    "Worker pid %s did not drain in time; killing", process.pid
+                )
+                process.kill()
+                process.join()
+        logger.info("All workers stopped")
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout, force=True)
+    load_dotenv()
+    processes = int(os.getenv("WORKER_PROCESSES") or os.cpu_count() or 1)
+    supervisor = Supervisor(
+        processes=processes,
+        pool_budget=int(os.getenv("DB_POOL_BUDGET", str(5 * processes))),
+        drain_timeout=float(os.getenv("WORKER_DRAIN_TIMEOUT", "60")),
+    )
+    for module in PRELOAD_MODULES:
+        __import__(module)
+    signal.signal(signal.SIGTERM, supervisor.request_shutdown)
+    signal.signal(signal.SIGINT, supervisor.request_shutdown)
+    supervisor.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,15 @@
+import os
 import platform
+import sys
 
 import pytest
 
+# Add the src directory to the Python path so common.* imports resolve
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../")))
+
+# common.db.connect refuses to import without a URL; engines connect lazily
+os.environ.setdefault("DATABASE_URL", "postgresql+asyncpg://user:password@db/test")
+
 pytestmark = pytest.mark.asyncio(scope="session")
 
 
@@ -0,0 +1,297 @@
+import asyncio
+import json
+import time
+from unittest.mock import AsyncMock
+
+import pytest
+from common.messaging.memory import InMemoryTransport
+from common.messaging.transport import OutgoingMessage
+from core.consumer import Consumer, decode
+from core.retry import PermanentFailure
+from core.scheduling import Lane
+
+
+class FakeDelivery:
+    def __init__(self, payload):
+        self.body = json.dumps(payload).encode()
+        self.message_id = None
+        self.reply_to = None
+        self.correlation_id = None
+        self.ack = AsyncMock()
+        self.nack = AsyncMock()
+
+
+async def deliver(deliveries):
+    for delivery in deliveries:
+        yield delivery
+
+
+def make_consumer(handler, concurrency, lanes=None, **kwargs):
+    lanes = lanes or [Lane("interactive", "test", concurrency)]
+    kwargs.setdefault("transport", InMemoryTransport())
+    return Consumer(handler, lanes=lanes, concurrency=concurrency, **kwargs)
+
+
+def start(consumer, *sources):
+    return asyncio.create_task(consumer._consume_until_stopped(sources))
+
+
+async def finish(consumer, consuming):
+    """Stop once every buffered delivery has been processed."""
+    for _ in range(200):
+        await asyncio.sleep(0.005)
+        if not len(consumer.scheduler) and not consumer.in_flight:
+            break
+    consumer.stop()
+    await consuming
+    await consumer.drain()
+
+
+async def test_handlers_run_concurrently_up_to_the_limit():
+    running, peak = 0, 0
+    release = asyncio.Event()
+
+    async def handler(message):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await release.wait()
+        running -= 1
+
+    consumer = make_consumer(handler, concurrency=3)
+    deliveries = [
+        FakeDelivery({"chat_id": str(i), "user_id": str(i)}) for i in range(10)
+    ]
+    consuming = start(consumer, (consumer.lanes["interactive"], deliver(deliveries)))
+
+    await asyncio.sleep(0.01)
+    assert peak == 3
+    assert len(consumer.scheduler) == 7
+
+    release.set()
+    await finish(consumer, consuming)
+    assert peak == 3
+    assert all(d.ack.await_count == 1 for d in deliveries)
+
+
+async def test_failed_messages_are_requeued_not_acked():
+    handler = AsyncMock(side_effect=[None, RuntimeError("LLM down")])
+    ok, failed = FakeDelivery({"chat_id": "a"}), FakeDelivery({"chat_id": "b"})
+    consumer = make_consumer(handler, concurrency=1)
+
+    consuming = start(consumer, (consumer.lanes["interactive"], deliver([ok, failed])))
+    await finish(consumer, consuming)
+
+    ok.ack.assert_awaited_once()
+    ok.nack.assert_not_awaited()
+    failed.nack.assert_awaited_once_with(requeue=True)
+    failed.ack.assert_not_awaited()
+    assert consumer.in_flight == 0
+    assert consumer.scheduler.in_flight == 0
+
+
+async def test_ack_waits_for_the_handler():
+    finished = asyncio.Event()
+    delivery = FakeDelivery({"chat_id": "a"})
+
+    async def handler(message):
+        await finished.wait()
+
+    consumer = make_consumer(handler, concurrency=1)
+    consuming = start(consumer, (consumer.lanes["interactive"], deliver([delivery])))
+    await asyncio.sleep(0.01)
+    delivery.ack.assert_not_awaited()
+
+    finished.set()
+    await finish(consumer, consuming)
+    delivery.ack.assert_awaited_once()
+
+
+def test_rejects_zero_concurrency():
+    with pytest.raises(ValueError):
+        make_consumer(AsyncMock(), concurrency=0)
+
+
+async def test_stop_finishes_in_flight_messages_and_takes_no_more():
+    release = asyncio.Event()
+    pulled = []
+
+    async def endless():
+        while True:
+            await asyncio.sleep(0)
+            delivery = FakeDelivery({"chat_id": str(len(pulled))})
+            pulled.append(delivery)
+            yield delivery
+
+    async def handler(message):
+        await release.wait()
+
+    consumer = make_consumer(handler, concurrency=2, user_max_in_flight=2)
+    consuming = start(consumer, (consumer.lanes["interactive"], endless()))
+    await asyncio.sleep(0.01)
+    assert consumer.in_flight == 2
+
+    consumer.stop()
+    await consuming
+    release.set()
+    await consumer.drain()
+
+    acked = [d for d in pulled if d.ack.await_count]
+    assert len(acked) == 2
+    # Buffered deliveries that never started are left for the broker to redeliver
+    assert len(pulled) > 2
+
+
+async def test_a_busy_user_does_not_hold_up_others():
+    started = []
+    release = asyncio.Event()
+
+    async def handler(message):
+        started.append(message["user_id"])
+        await release.wait()
+
+    heavy = [FakeDelivery({"chat_id": "h", "user_id": "heavy"}) for _ in range(5)]
+    light = [FakeDelivery({"chat_id": "l", "user_id": "light"})]
+    consumer = make_consumer(handler, concurrency=2, user_max_in_flight=1)
+    consuming = start(consumer, (consumer.lanes["interactive"], deliver(heavy + light)))
+
+    await asyncio.sleep(0.01)
+    assert sorted(started) == ["heavy", "light"]
+
+    release.set()
+    await finish(consumer, consuming)
+    assert started.count("heavy") == 5
+
+
+async def test_a_heavy_users_backlog_does_not_fill_the_prefetch_window():
+    transport = InMemoryTransport()
+    started = {}
+
+    async def handler(message):
+        started.setdefault(message["user_id"], []).append(time.monotonic())
+        await asyncio.sleep(0.005)
+
+    lanes = [Lane("interactive", "q", 4)]
+    consumer = make_consumer(
+        handler,
+        concurrency=4,
+        lanes=lanes,
+        transport=transport,
+        prefetch=32,
+        user_max_in_flight=2,
+        defer_delay=0.02,
+    )
+    for i, user in enumerate(["heavy"] * 200 + ["light"]):
+        body = json.dumps({"chat_id": str(i), "user_id": user}).encode()
+        await transport.publish("q", OutgoingMessage(body))
+
+    began = time.monotonic()
+    running = asyncio.create_task(consumer.run())
+    for _ in range(400):
+        await asyncio.sleep(0.01)
+        if len(started.get("heavy", ())) == 200:
+            break
+    consumer.stop()
+    await running
+
+    # Behind the backlog it would start after 100 heavy rounds, about 0.5s
+    assert started["light"][0] - began < 0.1
+    assert len(started["heavy"]) == 200 and len(started["light"]) == 1
+    assert transport.broker.depth("q") == 0
+
+
+async def test_interactive_messages_jump_buffered_bulk_work():
+    started = []
+    gate = asyncio.Event()
+
+    async def handler(message):
+        started.append(message["chat_id"])
+        await gate.wait()
+
+    lanes = [Lane("interactive", "q", 1), Lane("bulk", "q.bulk", 1)]
+    consumer = make_consumer(handler, concurrency=1, lanes=lanes)
+    bulk = [FakeDelivery({"chat_id": f"bulk-{i}", "user_id": str(i)}) for i in range(3)]
+    consuming = start(consumer, (lanes[1], deliver(bulk)))
+    await asyncio.sleep(0.01)
+    assert started == ["bulk-0"]
+
+    chat = FakeDelivery({"chat_id": "chat", "user_id": "u"})
+    consumer.scheduler.push("interactive", "u", (chat, decode(chat)[1]))
+    gate.set()
+    await finish(consumer, consuming)
+    assert started[:2] == ["bulk-0", "chat"]
+
+
+def test_unreadable_payloads_fail_permanently():
+    not_an_object = FakeDelivery(["a"])
+    user, error = decode(not_an_object)
+    assert user == "" and isinstance(error, PermanentFailure)
+
+    garbled = FakeDelivery({})
+    garbled.body = b"\xff"
+    assert isinstance(decode(garbled)[1], PermanentFailure)
+
+    user, message = decode(FakeDelivery({"user_id": 7, "chat_id": "c"}))
+    assert user == "7" and message["chat_id"] == "c"
+
+
+async def test_results_are_sent_to_reply_to_before_the_ack():
+    transport = InMemoryTransport()
+    callback = await transport.declare_callback_queue()
+    request = FakeDelivery({"chat_id": "a", "user_id": "u"})
+    request.reply_to, request.correlation_id = callback, "corr-1"
+    request.ack.side_effect = lambda: replies.append(transport.broker.depth(callback))
+    fire_and_forget = FakeDelivery({"chat_id": "b", "user_id": "u"})
+    replies = []
+
+    handler = AsyncMock(return_value={"content": "hi"})
+    consumer = make_consumer(handler, concurrency=1, transport=transport)
+    lane = consumer.lanes["interactive"]
+    await consumer._process(lane, "u", request, decode(request)[1])
+    await consumer._process(lane, "u", fire_and_forget, decode(fire_and_forget)[1])
+
+    # The reply was already queued when the request was acked
+    assert replies == [1]
+    reply = await transport.get(callback)
+    assert reply.correlation_id == "corr-1"
+    assert json.loads(reply.body) == {"content": "hi"}
+    assert await transport.get(callback) is None
+    fire_and_forget.ack.assert_awaited_once()
+
+
+async def test_run_consumes_from_the_transport_until_stopped():
+    transport = InMemoryTransport()
+    release = asyncio.Event()
+    handled = []
+
+    async def handler(message):
+        handled.append(message["chat_id"])
+        if message["chat_id"] == "slow":
+            await release.wait()
+
+    lanes = [Lane("interactive", "q", 1)]
+    consumer = make_consumer(
+        handler, concurrency=1, lanes=lanes, transport=transport, prefetch=2
+    )
+    for chat_id in ("fast", "slow", "queued", "left"):
+        body = json.dumps({"chat_id": chat_id, "user_id": "u"}).encode()
+        await transport.publish("q", OutgoingMessage(body))
+
+    running = asyncio.create_task(consumer.run())
+    await asyncio.sleep(0.01)
+    assert handled == ["fast", "slow"]
+
+    consumer.stop()
+    await asyncio.sleep(0.01)
+    assert not running.done()  # still draining the slow message
+    release.set()
+    await running
+
+    # The prefetched but unstarted message went back, behind the unread one
+    assert transport.broker.depth("q") == 2
+    redelivered = [await transport.get("q") for _ in range(2)]
+    assert sorted(json.loads(d.body)["chat_id"] for d in redelivered) == [
+        "left",
+        "queued",
+    ]
+    assert any(d.redelivered for d in redelivered)
@@ -0,0 +1,101 @@
+import json
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+from common.messaging.payloads import ChatRequest
+from core.consumer import decode
+from core.idempotency import Inbox, RecentKeys, idempotency_key
+from sqlalchemy.exc import IntegrityError
+
+
+class FakeSessions:
+    """Session factory answering key lookups from a set of committed keys."""
+
+    def __init__(self, committed=()):
+        self.committed = set(committed)
+        self.lookups = 0
+
+    @asynccontextmanager
+    async def __call__(self):
+        sessions = self
+
+        class Session:
+            async def execute(self, statement):
+                sessions.lookups += 1
+                key = statement.whereclause.right.value
+                found = key if key in sessions.committed else None
+                return SimpleNamespace(scalar_one_or_none=lambda: found)
+
+        yield Session()
+
+
+def request(**fields):
+    return ChatRequest(chat_id="c", content="hi", **fields)
+
+
+def test_key_comes_from_payload_then_message_id():
+    assert idempotency_key(request(idempotency_key="k1", message_id="m1")) == "k1"
+    assert idempotency_key(request(message_id="m1")) == "m1"
+    assert idempotency_key(request()) is None
+    assert len(idempotency_key(request(idempotency_key="x" * 1000))) == 255
+
+
+def test_amqp_message_id_is_the_fallback_key():
+    delivery = SimpleNamespace(body=json.dumps({"chat_id": "c"}).encode())
+    delivery.message_id = "amqp-1"
+    assert decode(delivery)[1]["idempotency_key"] == "amqp-1"
+
+    delivery.body = json.dumps({"idempotency_key": "own"}).encode()
+    assert decode(delivery)[1]["idempotency_key"] == "own"
+
+    delivery.body = json.dumps({"chat_id": "c", "content": "hi"}).encode()
+    assert decode(delivery, payload_type=ChatRequest)[1].idempotency_key == "amqp-1"
+
+
+def test_recent_keys_evict_least_recently_used():
+    keys = RecentKeys(size=2)
+    keys.add("a")
+    keys.add("b")
+    assert "a" in keys
+    keys.add("c")
+
+    assert "a" in keys and "c" in keys
+    assert "b" not in keys
+    assert len(keys) == 2
+
+
+async def test_inbox_checks_the_table_once_per_committed_key():
+    sessions = FakeSessions(committed={"done"})
+    inbox = Inbox(sessions, cache_size=10)
+
+    assert await inbox.seen("done")
+    assert await inbox.seen("done")
+    assert sessions.lookups == 1
+
+    assert not await inbox.seen("new")
+    assert not await inbox.seen("new")
+    assert sessions.lookups == 3
+
+
+async def test_recorded_keys_skip_the_table():
+    sessions = FakeSessions()
+    inbox = Inbox(sessions)
+    inbox.record("just-committed")
+
+    assert await inbox.seen("just-committed")
+    assert sessions.lookups == 0
+
+
+def test_only_inbox_key_violations_count_as_duplicates():
+    duplicate = IntegrityError(
+        "INSERT",
+        {},
+        Exception(
+            'duplicate key value violates unique constraint "processed_messages_pkey"'
+        ),
+    )
+    other = IntegrityError("INSERT", {}, Exception('violates foreign key "fk_chat"'))
+
+    assert Inbox.is_duplicate(duplicate)
+    assert not Inbox.is_duplicate(other)
+    assert not Inbox.is_duplicate(RuntimeError("processed_messages_pkey"))
@@ -0,0 +1,49 @@
+import asyncio
+import logging
+import time
+
+from common.loop_monitor import LoopMonitor
+
+
+def blocking_completion():
+    # Stands in for a sync HTTP client called from a coroutine
+    time.sleep(0.3)
+
+
+async def handler_that_blocks():
+    blocking_completion()
+
+
+async def test_lag_is_measured_while_the_loop_is_free():
+    lags = []
+    monitor = LoopMonitor(interval=0.01, block_threshold=0.2, on_lag=lags.append)
+
+    await monitor.start()
+    await asyncio.sleep(0.1)
+    await monitor.stop()
+
+    assert len(lags) >= 3
+    assert all(0 <= lag < 0.2 for lag in lags)
+    assert not monitor.running
+
+
+async def test_blocking_calls_are_reported_with_their_stack(caplog):
+    lags = []
+    monitor = LoopMonitor(interval=0.01, block_threshold=0.1, on_lag=lags.append)
+    await monitor.start()
+    await asyncio.sleep(0.03)
+
+    with caplog.at_level(logging.WARNING, logger="common.loop_monitor"):
+        await handler_that_blocks()
+        await asyncio.sleep(0.03)
+    await monitor.stop()
+
+    assert max(lags) >= 0.25
+    stalls = [r.message for r in caplog.records if r.name == "common.loop_monitor"]
+    # Once while blocked, with the culprit's stack, and once when over
+    assert len(stalls) == 2
+    assert "blocked for" in stalls[0] and "so far, in:" in stalls[0]
+    assert "handler_that_blocks" in stalls[0]
+    assert "blocking_completion" in stalls[0]
+    assert "time.sleep(0.3)" in stalls[0]
+    assert stalls[1].startswith("Event loop was blocked for")
@@ -1,129 +1,160 @@
+import asyncio
 import json
-import sys
-from unittest.mock import AsyncMock, Mock, patch
+import os
+import uuid
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, Mock
 
 import pytest
+from common.db.models import Log, Message, ProcessedMessage
+from common.messaging.memory import InMemoryTransport
+from common.messaging.payloads import MSGPACK, ChatReply, ChatRequest, PayloadCodec
+from common.messaging.transport import OutgoingMessage
+from core.idempotency import Inbox
+from core.retry import PermanentFailure
 
-# Mock the database modules
-mock_crud = Mock()
-mock_crud.log = Mock()
-mock_crud.message = Mock()
+# core.main builds its clients at import time
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+os.environ["RECALL_EMBEDDER"] = "off"
+from core import main as worker  # noqa: E402
 
-mock_core = Mock()
-mock_core.crud = mock_crud
 
-mock_coach_bot_db = Mock()
-mock_coach_bot_db.core = mock_core
+class EmptyInbox:
+    """Session factory for an empty processed_messages table."""
 
-# Mock modules before imports
-sys.modules["coach_bot_db"] = mock_coach_bot_db
-sys.modules["coach_bot_db.core"] = mock_core
-sys.modules["coach_bot_db.core.crud"] = mock_crud
+    @asynccontextmanager
+    async def __call__(self):
+        async def execute(statement):
+            return SimpleNamespace(scalar_one_or_none=lambda: None)
 
-# Now we can safely import our app
-with patch("openai.OpenAI"), patch("stream_chat.StreamChat"):
-    from core.main import callback, process_message
+        yield SimpleNamespace(execute=execute)
 
 
 @pytest.fixture
-def mock_openai():
-    with patch("core.main.openai_client") as mock:
-        # Create a proper async response
-        async def async_create(**kwargs):
-            return Mock(choices=[Mock(message=Mock(content="Test AI response"))])
-
-        mock.chat.completions.create = async_create
-        yield mock
+def llm(monkeypatch):
+    create = AsyncMock(
+        return_value=Mock(choices=[Mock(message=Mock(content="Test AI response"))])
+    )
+    monkeypatch.setattr(
+        worker, "client", Mock(chat=Mock(completions=Mock(create=create)))
+    )
+    return create
 
 
 @pytest.fixture
-def mock_stream():
-    with patch("core.main.stream_client") as mock:
-        channel = Mock()
-        channel.create = AsyncMock()
-        channel.send_message = AsyncMock()
-        mock.channel = Mock(return_value=channel)
-        yield mock
+def persistence(monkeypatch):
+    fake = Mock(write=AsyncMock())
+    monkeypatch.setattr(worker, "persistence", fake)
+    monkeypatch.setattr(worker, "inbox", Inbox(EmptyInbox()))
+    return fake
+
+
+def chat_message(**overrides):
+    fields = {
+        "chat_id": str(uuid.uuid4()),
+        "user_id": str(uuid.uuid4()),
+        "message_id": str(uuid.uuid4()),
+        "content": "Hello, bot!",
+        **overrides,
+    }
+    return ChatRequest(**fields)
 
 
-@pytest.fixture
-def mock_channel():
-    mock = Mock()
-    mock.basic_ack = AsyncMock()
-    mock.basic_nack = AsyncMock()
-    return mock
+async def test_process_message_commits_and_returns_the_reply(llm, persistence):
+    message = chat_message()
 
+    result = await worker.process_message(message)
 
-@pytest.mark.asyncio
-async def test_process_message_success(mock_openai, mock_stream):
-    """Test successful message processing."""
-    message = {"user_id": "test_user", "chat_id": "test_chat", "content": "Hello, bot!"}
+    sent = llm.await_args.kwargs["messages"]
+    assert sent[0]["role"] == "system"
+    assert sent[-1] == {"role": "user", "content": "Hello, bot!"}
+    (rows,) = persistence.write.await_args.args
+    reply, log, inbox_row = rows
+    assert isinstance(reply, Message) and isinstance(log, Log)
+    assert isinstance(inbox_row, ProcessedMessage)
+    assert reply.content == "Test AI response" and not reply.user_message
+    assert inbox_row.idempotency_key == message.message_id
+    assert inbox_row.reply_id == reply.message_id
+    assert result == ChatReply(
+        message_id=str(reply.message_id),
+        chat_id=message.chat_id,
+        content="Test AI response",
+    )
 
-    await process_message(message)
 
-    # Verify Stream Chat calls
-    mock_stream.channel.assert_called_once_with("messaging", "test_chat")
-    channel = mock_stream.channel.return_value
+async def test_llm_errors_propagate_without_writing(llm, persistence):
+    llm.side_effect = Exception("API Error")
 
-    # Verify channel.create call
-    assert channel.create.await_count == 1
-    assert channel.create.await_args.kwargs == {"data": {"members": ["test_user"]}}
+    with pytest.raises(Exception, match="API Error"):
+        await worker.process_message(chat_message())
 
-    # Verify channel.send_message call
-    assert channel.send_message.await_count == 1
-    assert channel.send_message.await_args.args == ({"text": "Test AI response"},)
-    assert channel.send_message.await_args.kwargs == {"user_id": "test_user"}
+    persistence.write.assert_not_awaited()
 
 
-@pytest.mark.asyncio(scope="function")
-async def test_process_message_openai_error(mock_openai, mock_stream):
-    """Test handling of OpenAI API error."""
+async def test_missing_user_is_a_permanent_failure(llm, persistence):
+    with pytest.raises(PermanentFailure):
+        await worker.process_message(chat_message(user_id=None))
 
-    async def raise_error(**kwargs):
-        raise Exception("API Error")
 
-    mock_openai.chat.completions.create = raise_error
+async def test_system_messages_are_not_answered(llm, persistence):
+    assert await worker.process_message(chat_message(user_message=False)) is None
+    llm.assert_not_awaited()
 
-    message = {"user_id": "test_user", "chat_id": "test_chat", "content": "Hello"}
 
-    with pytest.raises(Exception, match="API Error"):
-        await process_message(message)
+async def run_worker(transport, until):
+    consumer = worker.build_consumer(transport)
+    running = asyncio.create_task(consumer.run())
+    for _ in range(200):
+        await asyncio.sleep(0.005)
+        if until():
+            break
+    consumer.stop()
+    await running
 
-    mock_stream.channel.assert_not_called()
 
+async def test_redelivered_message_is_acked_without_a_second_llm_call(llm, persistence):
+    transport = InMemoryTransport()
+    body = json.dumps(chat_message().to_dict()).encode()
+    for _ in range(2):
+        await transport.publish("chat_queue", OutgoingMessage(body))
 
-@pytest.mark.asyncio
-async def test_callback_success(mock_openai, mock_stream, mock_channel):
-    """Test successful message callback processing."""
-    message = {"user_id": "test_user", "chat_id": "test_chat", "content": "Hello"}
-    method = Mock(delivery_tag="test_tag")
+    await run_worker(transport, until=lambda: not transport.broker.depth("chat_queue"))
 
-    await callback(mock_channel, method, None, json.dumps(message).encode())
+    assert llm.await_count == 1
+    assert persistence.write.await_count == 1
+    assert transport.broker.depth("chat_queue") == 0
 
-    # Verify message was acknowledged
-    assert mock_channel.basic_ack.await_count == 1
-    assert mock_channel.basic_ack.await_args.kwargs == {"delivery_tag": "test_tag"}
-    assert mock_channel.basic_nack.await_count == 0
 
+async def test_rpc_requests_get_the_reply(llm, persistence):
+    transport = InMemoryTransport()
+    callback = await transport.declare_callback_queue()
+    codec = PayloadCodec(MSGPACK)
+    await transport.publish(
+        "chat_queue",
+        codec.request(chat_message(), correlation_id="corr-1", reply_to=callback),
+    )
 
-@pytest.mark.asyncio
-async def test_callback_error(mock_openai, mock_stream, mock_channel):
-    """Test error handling in callback."""
+    await run_worker(transport, until=lambda: transport.broker.depth(callback))
 
-    async def raise_error(**kwargs):
-        raise Exception("API Error")
+    reply = await transport.get(callback)
+    assert reply.correlation_id == "corr-1"
+    assert reply.content_type == MSGPACK
+    assert codec.decode(reply, ChatReply).content == "Test AI response"
 
-    mock_openai.chat.completions.create = raise_error
 
-    message = {"user_id": "test_user", "chat_id": "test_chat", "content": "Hello"}
-    method = Mock(delivery_tag="test_tag")
+async def test_legacy_json_requests_get_json_replies(llm, persistence):
+    transport = InMemoryTransport()
+    callback = await transport.declare_callback_queue()
+    legacy = {k: v for k, v in chat_message().to_dict().items() if k != "v"}
+    await transport.publish(
+        "chat_queue",
+        OutgoingMessage(
+            json.dumps(legacy).encode(), correlation_id="corr-1", reply_to=callback
+        ),
+    )
 
-    await callback(mock_channel, method, None, json.dumps(message).encode())
+    await run_worker(transport, until=lambda: transport.broker.depth(callback))
 
-    # Verify message was not acknowledged and requeued
-    assert mock_channel.basic_ack.await_count == 0
-    assert mock_channel.basic_nack.await_count == 1
-    assert mock_channel.basic_nack.await_args.kwargs == {
-        "delivery_tag": "test_tag",
-        "requeue": True,
-    }
+    reply = await transport.get(callback)
+    assert json.loads(reply.body)["content"] == "Test AI response"
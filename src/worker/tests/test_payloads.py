@@ -0,0 +1,135 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from common.messaging.payloads import (
+    ACCEPT_HEADER,
+    JSON,
+    MSGPACK,
+    ZSTD,
+    ChatReply,
+    ChatRequest,
+    PayloadCodec,
+    PayloadError,
+)
+from core.consumer import decode
+from core.retry import PermanentFailure
+
+
+def request(content="Hello, bot!"):
+    return ChatRequest(chat_id="c-1", user_id="u-1", message_id="m-1", content=content)
+
+
+@pytest.mark.parametrize("content_type", [MSGPACK, JSON])
+def test_payloads_round_trip(content_type):
+    codec = PayloadCodec(content_type)
+
+    message = codec.message(request(), correlation_id="corr")
+
+    assert message.content_type == content_type
+    assert message.content_encoding is None
+    assert message.correlation_id == "corr"
+    assert codec.decode(message, ChatRequest) == request()
+
+
+def test_msgpack_is_smaller_than_json():
+    msgpack_body, _, _ = PayloadCodec(MSGPACK).encode(request())
+    json_body, _, _ = PayloadCodec(JSON).encode(request())
+    assert len(msgpack_body) < len(json_body)
+
+
+def test_large_bodies_are_compressed():
+    codec = PayloadCodec(compress_threshold=256)
+
+    small = codec.message(request("short"))
+    large = codec.message(request("a habit a day " * 200))
+
+    assert small.content_encoding is None
+    assert large.content_encoding == ZSTD
+    assert len(large.body) < 256
+    assert codec.decode(large, ChatRequest).content == "a habit a day " * 200
+
+
+def test_compression_is_skipped_when_it_does_not_help():
+    codec = PayloadCodec(compress_threshold=1)
+    body, _, encoding = codec.encode({"k": "x"})
+    assert encoding is None and codec.decode_data(body, MSGPACK) == {"k": "x"}
+
+
+def test_legacy_json_without_content_type_or_version():
+    legacy = SimpleNamespace(
+        body=json.dumps({"chat_id": "c", "content": "hi", "extra": 1}).encode(),
+        content_type=None,
+        content_encoding=None,
+    )
+    assert PayloadCodec().decode(legacy, ChatRequest) == ChatRequest("c", "hi")
+
+
+@pytest.mark.parametrize(
+    "data, error",
+    [
+        ({"v": 2, "chat_id": "c", "content": "hi"}, "version"),
+        ({"chat_id": "c"}, "missing 'content'"),
+        ({"chat_id": 7, "content": "hi"}, "wrong type"),
+        ({"chat_id": "c", "content": "hi", "user_message": 1}, "wrong type"),
+        (["c", "hi"], "not a map"),
+    ],
+)
+def test_invalid_payloads_are_rejected(data, error):
+    with pytest.raises(PayloadError, match=error):
+        ChatRequest.from_dict(data)
+
+
+def test_unknown_formats_are_rejected():
+    codec = PayloadCodec()
+    with pytest.raises(PayloadError, match="content type"):
+        codec.decode_data(b"<xml/>", "application/xml")
+    with pytest.raises(PayloadError, match="content encoding"):
+        codec.decode_data(b"{}", JSON, "br")
+    with pytest.raises(PayloadError, match="zstd"):
+        codec.decode_data(b"not zstd", MSGPACK, ZSTD)
+
+
+def test_replies_use_the_first_accepted_format():
+    codec = PayloadCodec(JSON)
+    asked = SimpleNamespace(
+        headers={ACCEPT_HEADER: "application/cbor, application/msgpack"},
+        content_type=JSON,
+    )
+    legacy = SimpleNamespace(headers={}, content_type=None)
+    unknown = SimpleNamespace(headers=None, content_type="text/plain")
+
+    assert codec.reply_format(asked) == MSGPACK
+    assert codec.reply_format(legacy) == JSON
+    assert codec.reply_format(unknown) == JSON
+    assert PayloadCodec(MSGPACK).request(request()).headers[ACCEPT_HEADER] == (
+        f"{MSGPACK}, {JSON}"
+    )
+
+
+def test_consumer_decodes_into_the_payload_type():
+    codec = PayloadCodec(compress_threshold=64)
+    message = codec.message(request("long " * 100))
+    delivery = SimpleNamespace(
+        body=message.body,
+        content_type=message.content_type,
+        content_encoding=message.content_encoding,
+        message_id=None,
+    )
+
+    user, decoded = decode(delivery, codec, ChatRequest)
+
+    assert user == "u-1"
+    assert isinstance(decoded, ChatRequest) and decoded.content == "long " * 100
+
+    delivery.body = b"\xc1"
+    assert isinstance(decode(delivery, codec, ChatRequest)[1], PermanentFailure)
+    delivery.body = PayloadCodec().encode({"chat_id": "c"})[0]
+    delivery.content_encoding = None
+    assert isinstance(decode(delivery, codec, ChatRequest)[1], PermanentFailure)
+
+
+def test_reply_payloads_round_trip():
+    codec = PayloadCodec()
+    reply = ChatReply(message_id="m", chat_id="c", content="Keep going!")
+    assert codec.decode(codec.message(reply), ChatReply) == reply
@@ -0,0 +1,91 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+from core.persistence import PersistencePipeline
+
+
+class FakeSessions:
+    """Session factory recording what each transaction committed."""
+
+    def __init__(self, fail_on=None):
+        self.commits = []
+        self.fail_on = fail_on
+
+    @asynccontextmanager
+    async def __call__(self):
+        rows = []
+        session = type("Session", (), {"add_all": lambda _, new: rows.extend(new)})()
+        yield session
+        if self.fail_on in rows:
+            raise RuntimeError("constraint violated")
+        self.commits.append(rows)
+
+
+@pytest.fixture
+async def make_pipeline():
+    pipelines = []
+
+    async def make(sessions, **kwargs):
+        pipeline = PersistencePipeline(sessions, **kwargs)
+        await pipeline.start()
+        pipelines.append(pipeline)
+        return pipeline
+
+    yield make
+    for pipeline in pipelines:
+        await pipeline.stop()
+
+
+async def test_concurrent_writes_share_one_commit(make_pipeline):
+    sessions = FakeSessions()
+    pipeline = await make_pipeline(sessions, max_batch=50, max_delay=0.01)
+
+    await asyncio.gather(*(pipeline.write([f"reply{i}", f"log{i}"]) for i in range(10)))
+
+    assert len(sessions.commits) == 1
+    assert sorted(sessions.commits[0]) == sorted(
+        row for i in range(10) for row in (f"reply{i}", f"log{i}")
+    )
+
+
+async def test_batches_are_capped(make_pipeline):
+    sessions = FakeSessions()
+    pipeline = await make_pipeline(sessions, max_batch=4, max_delay=0.01)
+
+    await asyncio.gather(*(pipeline.write([i]) for i in range(10)))
+
+    assert [len(rows) for rows in sessions.commits] == [4, 4, 2]
+
+
+async def test_write_returns_only_after_commit(make_pipeline):
+    sessions = FakeSessions()
+    pipeline = await make_pipeline(sessions, max_delay=0.01)
+
+    write = asyncio.create_task(pipeline.write(["reply"]))
+    await asyncio.sleep(0)
+    assert not write.done() and sessions.commits == []
+
+    await write
+    assert sessions.commits == [["reply"]]
+
+
+async def test_failing_write_does_not_fail_its_batch(make_pipeline):
+    sessions = FakeSessions(fail_on="bad")
+    pipeline = await make_pipeline(sessions, max_delay=0.01)
+
+    results = await asyncio.gather(
+        pipeline.write(["good1"]),
+        pipeline.write(["bad"]),
+        pipeline.write(["good2"]),
+        return_exceptions=True,
+    )
+
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], RuntimeError)
+    assert sessions.commits == [["good1"], ["good2"]]
+
+
+async def test_write_requires_start():
+    with pytest.raises(RuntimeError):
+        await PersistencePipeline(FakeSessions()).write(["reply"])
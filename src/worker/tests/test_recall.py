@@ -0,0 +1,72 @@
+import uuid
+
+import numpy as np
+import pytest
+from core.recall import HashingEmbedder, RecallIndex, VectorIndex
+
+
+def test_hashing_embedder_is_deterministic_and_normalised():
+    embedder = HashingEmbedder(dim=64)
+    first = embedder.embed(["I want to sleep earlier", ""])
+    second = HashingEmbedder(dim=64).embed(["I want to sleep earlier", ""])
+
+    np.testing.assert_array_equal(first, second)
+    assert first.dtype == np.float32
+    assert np.linalg.norm(first[0]) == pytest.approx(1.0)
+    assert not first[1].any()
+
+
+def test_vector_index_appends_and_searches(tmp_path):
+    index = VectorIndex(tmp_path / "shard", dim=3)
+    ids = [uuid.uuid4() for _ in range(3)]
+    index.append(ids[:2], np.array([[1, 0, 0], [0, 1, 0]], np.float32))
+    index.append(ids[2:], np.array([[0.8, 0.6, 0]], np.float32))
+
+    hits = index.search(np.array([1, 0, 0], np.float32), k=2)
+    assert [message_id for message_id, _ in hits] == [ids[0], ids[2]]
+    assert hits[0][1] == pytest.approx(1.0)
+
+    hits = index.search(np.array([1, 0, 0], np.float32), k=5, exclude=[ids[0]])
+    assert [message_id for message_id, _ in hits] == [ids[2], ids[1]]
+
+    # A fresh handle sees the same data through its own memory map
+    assert len(VectorIndex(tmp_path / "shard", dim=3)) == 3
+
+
+def test_vector_index_ignores_torn_append(tmp_path):
+    index = VectorIndex(tmp_path / "shard", dim=2)
+    first, second = uuid.uuid4(), uuid.uuid4()
+    index.append([first], np.array([[1, 0]], np.float32))
+    # Vectors written but the process died before writing the ids
+    with open(tmp_path / "shard" / "vectors.f32", "ab") as f:
+        f.write(np.array([[9, 9]], np.float32).tobytes())
+    assert len(index) == 1
+
+    index.append([second], np.array([[0, 1]], np.float32))
+    hits = index.search(np.array([0, 1], np.float32), k=1)
+    assert hits == [(second, pytest.approx(1.0))]
+
+
+def test_recall_index_keeps_users_apart(tmp_path):
+    recall = RecallIndex(str(tmp_path), HashingEmbedder())
+    alice, bob = uuid.uuid4(), uuid.uuid4()
+    run, sleep, bob_run = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    recall.add(
+        alice,
+        [run, sleep],
+        ["I want to start running every morning", "I keep going to bed too late"],
+    )
+    recall.add(bob, [bob_run], ["running every morning is my goal"])
+
+    hits = recall.search(alice, "my morning running plan", k=5)
+    assert hits[0][0] == run
+    assert recall.search(alice, "bed too late again", k=1)[0][0] == sleep
+
+    assert bob_run not in [message_id for message_id, _ in hits]
+    assert recall.search(uuid.uuid4(), "running", k=5) == []
+
+
+def test_recall_index_refuses_a_different_embedder(tmp_path):
+    RecallIndex(str(tmp_path), HashingEmbedder(dim=128))
+    with pytest.raises(ValueError):
+        RecallIndex(str(tmp_path), HashingEmbedder(dim=64))
@@ -0,0 +1,126 @@
+import json
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+from common.messaging.memory import InMemoryTransport
+from core.consumer import Consumer
+from core.retry import (
+    ATTEMPT_HEADER,
+    ERROR_HEADER,
+    FIRST_FAILED_HEADER,
+    PermanentFailure,
+    RetryTopology,
+    attempts,
+    describe,
+)
+from core.scheduling import Lane
+
+
+@pytest.fixture
+def topology():
+    return RetryTopology("chat_queue", delays=(1, 5, 30))
+
+
+def test_failures_walk_the_retry_tiers_then_dead_letter(topology):
+    headers = None
+    routes = []
+    for _ in range(4):
+        queue, delay, headers = topology.route(headers, RuntimeError("LLM down"))
+        routes.append((queue, delay))
+
+    assert routes == [
+        ("chat_queue", 1),
+        ("chat_queue", 5),
+        ("chat_queue", 30),
+        ("chat_queue.dead", 0),
+    ]
+    assert headers[ATTEMPT_HEADER] == 4
+    assert headers[ERROR_HEADER] == "RuntimeError: LLM down"
+
+
+def test_first_failure_time_is_kept(topology):
+    _, _, headers = topology.route({}, RuntimeError())
+    first = headers[FIRST_FAILED_HEADER]
+    _, _, headers = topology.route(headers, RuntimeError())
+    assert headers[FIRST_FAILED_HEADER] == first
+
+
+@pytest.mark.parametrize(
+    "error", [PermanentFailure("no user"), json.JSONDecodeError("bad", "x", 0)]
+)
+def test_permanent_failures_skip_retries(topology, error):
+    queue, delay, headers = topology.route(None, error)
+    assert (queue, delay) == ("chat_queue.dead", 0)
+    assert headers[ATTEMPT_HEADER] == 1
+
+
+def test_attempts_tolerates_missing_or_bad_headers():
+    assert attempts(None) == 0
+    assert attempts({ATTEMPT_HEADER: "x"}) == 0
+    assert attempts({ATTEMPT_HEADER: 2}) == 2
+
+
+def fake_delivery(body=b'{"chat_id": "c"}', headers=None):
+    return Mock(
+        body=body,
+        headers=headers or {},
+        content_type="application/json",
+        content_encoding=None,
+        correlation_id=None,
+        reply_to=None,
+        message_id=None,
+        priority=None,
+        ack=AsyncMock(),
+        nack=AsyncMock(),
+    )
+
+
+def make_consumer(topology, transport):
+    return Consumer(
+        AsyncMock(side_effect=RuntimeError("LLM down")),
+        transport=transport,
+        lanes=[Lane("interactive", "chat_queue", 1, topology)],
+    )
+
+
+async def test_consumer_delays_failed_message_for_a_retry(topology):
+    transport = InMemoryTransport()
+    transport.publish = AsyncMock()
+    consumer = make_consumer(topology, transport)
+    delivery = fake_delivery(headers={ATTEMPT_HEADER: 1})
+
+    await consumer._process(consumer.lanes["interactive"], "", delivery, {})
+
+    queue, message = transport.publish.await_args.args
+    assert queue == "chat_queue"
+    assert transport.publish.await_args.kwargs["delay"] == 5
+    assert message.headers[ATTEMPT_HEADER] == 2
+    assert message.body == delivery.body
+    delivery.ack.assert_awaited_once()
+    delivery.nack.assert_not_awaited()
+
+
+async def test_consumer_requeues_when_retry_publish_fails(topology):
+    transport = InMemoryTransport()
+    transport.publish = AsyncMock(side_effect=ConnectionError("broker gone"))
+    consumer = make_consumer(topology, transport)
+    delivery = fake_delivery()
+
+    await consumer._process(consumer.lanes["interactive"], "", delivery, {})
+
+    delivery.ack.assert_not_awaited()
+    delivery.nack.assert_awaited_once_with(requeue=True)
+
+
+async def test_dead_letters_reach_the_dead_letter_queue(topology):
+    transport = InMemoryTransport()
+    await topology.declare(transport)
+    consumer = make_consumer(topology, transport)
+    delivery = fake_delivery(headers={ATTEMPT_HEADER: 3})
+
+    await consumer._process(consumer.lanes["interactive"], "", delivery, {})
+
+    dead = await transport.get("chat_queue.dead")
+    assert dead.body == delivery.body
+    assert dead.headers[ATTEMPT_HEADER] == 4
+    assert describe(dead)["last_error"] == "RuntimeError: LLM down"
@@ -0,0 +1,115 @@
+import pytest
+from core.scheduling import (
+    BACKGROUND,
+    BULK,
+    INTERACTIVE,
+    FairScheduler,
+    Lane,
+    lane_queue,
+    lanes_from_env,
+)
+
+
+def make_scheduler(concurrency=4, user_max_in_flight=2, background=2, bulk=1):
+    lanes = [
+        Lane(INTERACTIVE, "q", concurrency),
+        Lane(BACKGROUND, "q.background", background),
+        Lane(BULK, "q.bulk", bulk),
+    ]
+    return FairScheduler(lanes, concurrency, user_max_in_flight)
+
+
+def drain(scheduler):
+    picked = []
+    while (item := scheduler.pop()) is not None:
+        picked.append(item)
+    return picked
+
+
+def test_users_are_served_round_robin_within_a_lane():
+    scheduler = make_scheduler(concurrency=10, user_max_in_flight=10)
+    for i in range(3):
+        scheduler.push(INTERACTIVE, "heavy", f"h{i}")
+    scheduler.push(INTERACTIVE, "a", "a0")
+    scheduler.push(INTERACTIVE, "b", "b0")
+
+    assert [item for _, _, item in drain(scheduler)] == ["h0", "a0", "b0", "h1", "h2"]
+
+
+def test_per_user_cap_holds_back_a_users_backlog():
+    scheduler = make_scheduler(user_max_in_flight=1)
+    scheduler.push(INTERACTIVE, "heavy", "h0")
+    scheduler.push(INTERACTIVE, "heavy", "h1")
+    scheduler.push(INTERACTIVE, "light", "l0")
+
+    assert [item for _, _, item in drain(scheduler)] == ["h0", "l0"]
+    assert len(scheduler) == 1
+
+    scheduler.finish(INTERACTIVE, "heavy")
+    assert scheduler.pop() == (INTERACTIVE, "heavy", "h1")
+
+
+def test_user_cap_spans_lanes():
+    scheduler = make_scheduler(user_max_in_flight=1)
+    scheduler.push(INTERACTIVE, "u", "chat")
+    scheduler.push(BULK, "u", "export")
+
+    assert drain(scheduler) == [(INTERACTIVE, "u", "chat")]
+
+
+def test_interactive_is_served_before_lower_lanes():
+    scheduler = make_scheduler(concurrency=1)
+    scheduler.push(BULK, "a", "bulk")
+    scheduler.push(BACKGROUND, "b", "background")
+    scheduler.push(INTERACTIVE, "c", "chat")
+
+    order = []
+    while (picked := scheduler.pop()) is not None:
+        order.append(picked[2])
+        scheduler.finish(picked[0], picked[1])
+    assert order == ["chat", "background", "bulk"]
+
+
+def test_lower_lanes_leave_slots_for_interactive_work():
+    scheduler = make_scheduler(concurrency=4, background=2, bulk=1)
+    for i in range(10):
+        scheduler.push(BACKGROUND, f"b{i}", i)
+        scheduler.push(BULK, f"k{i}", i)
+
+    lanes = [lane for lane, _, _ in drain(scheduler)]
+    assert lanes.count(BACKGROUND) == 2
+    assert lanes.count(BULK) == 1
+    assert scheduler.in_flight == 3
+
+    scheduler.push(INTERACTIVE, "user", "chat")
+    assert scheduler.pop() == (INTERACTIVE, "user", "chat")
+    assert scheduler.pop() is None
+
+
+def test_finish_releases_capacity():
+    scheduler = make_scheduler(concurrency=1)
+    scheduler.push(INTERACTIVE, "a", 1)
+    scheduler.push(INTERACTIVE, "b", 2)
+    assert scheduler.pop() == (INTERACTIVE, "a", 1)
+    assert scheduler.pop() is None
+
+    scheduler.finish(INTERACTIVE, "a")
+    assert scheduler.pop() == (INTERACTIVE, "b", 2)
+    scheduler.finish(INTERACTIVE, "b")
+    assert scheduler.in_flight == 0 and len(scheduler) == 0
+
+
+def test_lane_queues(monkeypatch):
+    assert lane_queue("chat_queue", INTERACTIVE) == "chat_queue"
+    assert lane_queue("chat_queue", BULK) == "chat_queue.bulk"
+    with pytest.raises(ValueError):
+        lane_queue("chat_queue", "urgent")
+
+    monkeypatch.setenv("LANE_BULK_MAX", "3")
+    lanes = lanes_from_env("chat_queue", 32, (1, 5))
+    assert [(lane.name, lane.max_in_flight) for lane in lanes] == [
+        (INTERACTIVE, 32),
+        (BACKGROUND, 16),
+        (BULK, 3),
+    ]
+    assert lanes[1].retry.dead_letter_queue == "chat_queue.background.dead"
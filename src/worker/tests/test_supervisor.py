@@ -0,0 +1,98 @@
+import os
+import signal
+import threading
+import time
+
+import pytest
+from core.supervisor import Supervisor, pool_size_per_process
+
+
+def test_pool_budget_is_split_between_processes():
+    assert pool_size_per_process(40, 8) == 5
+    assert pool_size_per_process(10, 4) == 2
+    assert pool_size_per_process(2, 4) == 1
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def run_in_thread(supervisor):
+    thread = threading.Thread(target=supervisor.run, daemon=True)
+    thread.start()
+    return thread
+
+
+def started(tmp_path):
+    return sorted(tmp_path.glob("started-*"))
+
+
+def test_drains_children_on_shutdown(tmp_path):
+    def target(index, pool_size):
+        def drain(*_):
+            (tmp_path / f"drained-{index}-{pool_size}").touch()
+            os._exit(0)
+
+        signal.signal(signal.SIGTERM, drain)
+        (tmp_path / f"started-{os.getpid()}").touch()
+        while True:
+            time.sleep(0.01)
+
+    supervisor = Supervisor(processes=2, pool_budget=6, target=target)
+    thread = run_in_thread(supervisor)
+    assert wait_for(lambda: len(started(tmp_path)) == 2)
+
+    supervisor.request_shutdown()
+    thread.join(timeout=5)
+
+    assert not thread.is_alive()
+    assert sorted(p.name for p in tmp_path.glob("drained-*")) == [
+        "drained-0-3",
+        "drained-1-3",
+    ]
+
+
+def test_restarts_crashed_children(tmp_path):
+    def target(index, pool_size):
+        (tmp_path / f"started-{os.getpid()}").touch()
+        os._exit(1)
+
+    supervisor = Supervisor(processes=1, pool_budget=1, min_healthy=0, target=target)
+    thread = run_in_thread(supervisor)
+
+    assert wait_for(lambda: len(started(tmp_path)) >= 3)
+    supervisor.request_shutdown()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+
+
+def test_kills_children_that_do_not_drain(tmp_path):
+    def target(index, pool_size):
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        (tmp_path / f"started-{os.getpid()}").touch()
+        while True:
+            time.sleep(0.01)
+
+    supervisor = Supervisor(
+        processes=1, pool_budget=1, drain_timeout=0.2, target=target
+    )
+    thread = run_in_thread(supervisor)
+    assert wait_for(lambda: len(started(tmp_path)) == 1)
+    pid = int(started(tmp_path)[0].name.split("-")[1])
+
+    supervisor.request_shutdown()
+    thread.join(timeout=5)
+
+    assert not thread.is_alive()
+    with pytest.raises(ProcessLookupError):
+        os.kill(pid, 0)
+
+
+def test_rejects_zero_processes():
+    with pytest.raises(ValueError):
+        Supervisor(processes=0, pool_budget=1)